@@ -1,23 +1,30 @@
 import glob
 import logging
 import os
+import threading
+from collections import defaultdict
 from pathlib import Path
-from typing import Callable, Dict, Generic, List, Optional, Set, Tuple, TypeVar
+from typing import Any, Callable, Dict, Generic, List, Optional, Set, Tuple, TypeVar
 
+import h5py
 import numpy as np
 import obspy
 import pyasdf
 from datetimerange import DateTimeRange
 
 from . import channelcatalog
-from .constants import PROGRESS_DATATYPE
-from .datatypes import Channel, ChannelData, ChannelType, CrossCorrelation, Stack, Station
+from .constants import PRODUCTS_DATATYPE, PROGRESS_DATATYPE
+from .datatypes import Channel, ChannelData, ChannelType, CrossCorrelation, Stack, Station, to_json_types
 from .stores import (
+    PRODUCTS_DIR,
     CrossCorrelationDataStore,
     RawDataStore,
     StackStore,
+    lag_slice,
     parse_station_pair,
     parse_timespan,
+    row_slice,
+    slice_window,
     timespan_str,
 )
 
@@ -45,6 +52,9 @@ class ASDFDirectory(Generic[T]):
         self.mode = mode
         self.get_filename = get_filename
         self.parse_filename = parse_filename
+        # writes and lazy loads of a file are serialized, so loads never open a file that is being written
+        self._file_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+        self._file_locks_lock = threading.Lock()
 
     def __getitem__(self, key: T) -> pyasdf.ASDFDataSet:
         return self._get_dataset(key, self.mode)
@@ -54,8 +64,14 @@ class ASDFDirectory(Generic[T]):
         file_path = os.path.join(self.directory, file_name)
         return _get_dataset(file_path, mode)
 
+    def file_lock(self, file_path: str) -> threading.Lock:
+        with self._file_locks_lock:
+            return self._file_locks[os.path.abspath(file_path)]
+
     def get_keys(self) -> List[T]:
         h5files = sorted(glob.glob(os.path.join(self.directory, "**/*.h5"), recursive=True))
+        # derived products are not keyed like the data files
+        h5files = [f for f in h5files if PRODUCTS_DIR not in Path(os.path.relpath(f, self.directory)).parts]
         return list(map(self.parse_filename, h5files))
 
     def contains(self, key: T, data_type: str, path: str = None):
@@ -72,8 +88,9 @@ class ASDFDirectory(Generic[T]):
             return exists
 
     def add_aux_data(self, key: T, params: Dict, data_type: str, path: str, data: np.ndarray):
-        with self[key] as ccf_ds:
-            ccf_ds.add_auxiliary_data(data=data, data_type=data_type, path=path, parameters=params)
+        with self.file_lock(os.path.join(self.directory, self.get_filename(key))):
+            with self[key] as ccf_ds:
+                ccf_ds.add_auxiliary_data(data=data, data_type=data_type, path=path, parameters=params)
 
 
 class ASDFRawDataStore(RawDataStore):
@@ -99,10 +116,10 @@ class ASDFRawDataStore(RawDataStore):
     def get_timespans(self) -> List[DateTimeRange]:
         return self.datasets.get_keys()
 
-    def read_data(self, timespan: DateTimeRange, chan: Channel) -> ChannelData:
+    def read_data(self, timespan: DateTimeRange, chan: Channel, window: DateTimeRange = None) -> ChannelData:
         with self.datasets[timespan] as ds:
             stream = ds.waveforms[str(chan.station)][str(chan.type)]
-        return ChannelData(stream)
+        return slice_window(ChannelData(stream), window, chan)
 
     def get_inventory(self, timespan: DateTimeRange, station: Station) -> obspy.Inventory:
         with self.datasets[timespan] as ds:
@@ -164,7 +181,60 @@ class ASDFCCStore(CrossCorrelationDataStore):
         self._visit_pairs(lambda pairs, _: pairs_all.update((parse_station_pair(p) for p in pairs)))
         return list(pairs_all)
 
-    def read(self, timespan: DateTimeRange, src_sta: Station, rec_sta: Station) -> List[CrossCorrelation]:
+    def read(
+        self,
+        timespan: DateTimeRange,
+        src_sta: Station,
+        rec_sta: Station,
+        components: List[str] = None,
+        lag_window: Tuple[float, float] = None,
+    ) -> List[CrossCorrelation]:
+        return self._read(timespan, src_sta, rec_sta, components, lag_window)
+
+    def read_substacks(
+        self,
+        timespan: DateTimeRange,
+        src_sta: Station,
+        rec_sta: Station,
+        rows: Tuple[int, int] = None,
+        window: DateTimeRange = None,
+        components: List[str] = None,
+        lag_window: Tuple[float, float] = None,
+    ) -> List[CrossCorrelation]:
+        return self._read(
+            timespan, src_sta, rec_sta, components, lag_window, lambda p: row_slice(p, rows, window)
+        )
+
+    def read_lazy(
+        self, timespan: DateTimeRange, src_sta: Station, rec_sta: Station, mmap: bool = False
+    ) -> List[CrossCorrelation]:
+        """
+        See ``CrossCorrelationDataStore.read_lazy``. With ``mmap``, the data is memory-mapped when it's stored
+        contiguously in the file.
+        """
+        with self.datasets[timespan] as ccf_ds:
+            dtype = self._get_station_pair(src_sta, rec_sta)
+            if dtype not in ccf_ds.auxiliary_data:
+                logging.warning(f"No data available for {timespan}/{dtype}")
+                return []
+            ccs = []
+            for ch_pair_path in ccf_ds.auxiliary_data[dtype].list():
+                src_ch, rec_ch = _parse_channel_path(ch_pair_path)
+                stream = ccf_ds.auxiliary_data[dtype][ch_pair_path]
+                cc = CrossCorrelation(src_ch, rec_ch, stream.parameters, None)
+                cc.set_loader(_DatasetLoader(self.datasets, ccf_ds.filename, stream.data, mmap))
+                ccs.append(cc)
+            return ccs
+
+    def _read(
+        self,
+        timespan: DateTimeRange,
+        src_sta: Station,
+        rec_sta: Station,
+        components: Optional[List[str]],
+        lag_window: Optional[Tuple[float, float]],
+        row_select: Callable[[Dict], Tuple[slice, Dict]] = None,
+    ) -> List[CrossCorrelation]:
         with self.datasets[timespan] as ccf_ds:
             dtype = self._get_station_pair(src_sta, rec_sta)
             if dtype not in ccf_ds.auxiliary_data:
@@ -175,7 +245,33 @@ class ASDFCCStore(CrossCorrelationDataStore):
             for ch_pair_path in ch_pair_paths:
                 src_ch, rec_ch = _parse_channel_path(ch_pair_path)
                 stream = ccf_ds.auxiliary_data[dtype][ch_pair_path]
-                ccs.append(CrossCorrelation(src_ch, rec_ch, stream.parameters, stream.data[:]))
+                cc = CrossCorrelation(src_ch, rec_ch, stream.parameters, stream.data)
+                if components is not None and cc.get_component() not in components:
+                    continue
+                lags, cc.parameters = lag_slice(cc.parameters, lag_window)
+                index = (Ellipsis, lags)
+                if row_select is not None:
+                    rows, cc.parameters = row_select(cc.parameters)
+                    index = (rows, lags)
+                # h5py only reads the selected hyperslab
+                cc.data = stream.data[index]
+                ccs.append(cc)
+            return ccs
+
+    def read_metadata(
+        self, timespan: DateTimeRange, src_sta: Station, rec_sta: Station
+    ) -> List[CrossCorrelation]:
+        with self.datasets[timespan] as ccf_ds:
+            dtype = self._get_station_pair(src_sta, rec_sta)
+            if dtype not in ccf_ds.auxiliary_data:
+                logging.warning(f"No data available for {timespan}/{dtype}")
+                return []
+            ccs = []
+            for ch_pair_path in ccf_ds.auxiliary_data[dtype].list():
+                src_ch, rec_ch = _parse_channel_path(ch_pair_path)
+                # only the HDF5 attributes are read, the dataset is not loaded
+                params = ccf_ds.auxiliary_data[dtype][ch_pair_path].parameters
+                ccs.append(CrossCorrelation(src_ch, rec_ch, params, np.empty((0, 0), dtype=np.float32)))
             return ccs
 
     def _visit_pairs(self, visitor: Callable[[Set[Tuple[str, str]], DateTimeRange], None]):
@@ -221,15 +317,125 @@ class ASDFStackStore(StackStore):
         )
         return [parse_timespan(os.path.basename(i)) for i in h5files]
 
-    def read(self, timespan: DateTimeRange, src: Station, rec: Station) -> List[Stack]:
+    def read(
+        self,
+        timespan: DateTimeRange,
+        src: Station,
+        rec: Station,
+        components: List[str] = None,
+        lag_window: Tuple[float, float] = None,
+    ) -> List[Stack]:
         stacks = []
         with self.datasets[(src, rec, timespan)] as ds:
             for name in ds.auxiliary_data.list():
                 for component in ds.auxiliary_data[name].list():
+                    if components is not None and component not in components:
+                        continue
                     stream = ds.auxiliary_data[name][component]
-                    stacks.append(Stack(component, name, stream.parameters, stream.data[:]))
+                    lags, params = lag_slice(stream.parameters, lag_window)
+                    stacks.append(Stack(component, name, params, stream.data[lags]))
+        return stacks
+
+    def read_lazy(
+        self, timespan: DateTimeRange, src: Station, rec: Station, mmap: bool = False
+    ) -> List[Stack]:
+        """
+        See ``StackStore.read_lazy``. With ``mmap``, the data is memory-mapped when it's stored contiguously
+        in the file.
+        """
+        stacks = []
+        with self.datasets[(src, rec, timespan)] as ds:
+            for name in ds.auxiliary_data.list():
+                for component in ds.auxiliary_data[name].list():
+                    stream = ds.auxiliary_data[name][component]
+                    stack = Stack(component, name, stream.parameters, None)
+                    stack.set_loader(_DatasetLoader(self.datasets, ds.filename, stream.data, mmap))
+                    stacks.append(stack)
+        return stacks
+
+    def read_metadata(self, timespan: DateTimeRange, src: Station, rec: Station) -> List[Stack]:
+        stacks = []
+        with self.datasets[(src, rec, timespan)] as ds:
+            for name in ds.auxiliary_data.list():
+                for component in ds.auxiliary_data[name].list():
+                    params = ds.auxiliary_data[name][component].parameters
+                    stacks.append(Stack(component, name, params, np.empty(0, dtype=np.float32)))
         return stacks
 
+    def append_product(self, name: str, timespan: DateTimeRange, params: Dict[str, Any], data: np.ndarray):
+        """
+        Writes a derived product (e.g. a moveout stack) computed from the stacks of the given timespan,
+        replacing it if it already exists. The products of a timespan are kept in their own file.
+        """
+        filename = self._get_product_file(timespan)
+        # products are always appended, and written under the same lock as the stacks of the directory
+        with self.datasets.file_lock(filename), _get_dataset(filename, "a") as ds:
+            if _has_product(ds, name):
+                del ds.auxiliary_data[PRODUCTS_DATATYPE][name]
+            ds.add_auxiliary_data(data=data, data_type=PRODUCTS_DATATYPE, path=name, parameters=params)
+
+    def read_product(self, name: str, timespan: DateTimeRange) -> Optional[Tuple[np.ndarray, Dict[str, Any]]]:
+        filename = self._get_product_file(timespan)
+        # the lock keeps the file from being read while it's being written
+        with self.datasets.file_lock(filename):
+            if not os.path.exists(filename):
+                return None
+            with _get_dataset(filename, "r") as ds:
+                if not _has_product(ds, name):
+                    return None
+                stream = ds.auxiliary_data[PRODUCTS_DATATYPE][name]
+                return stream.data[()], to_json_types(stream.parameters)
+
+    def _get_product_file(self, timespan: DateTimeRange) -> str:
+        return os.path.join(self.datasets.directory, PRODUCTS_DIR, _filename_from_timespan(timespan))
+
+
+def _has_product(ds: pyasdf.ASDFDataSet, name: str) -> bool:
+    return PRODUCTS_DATATYPE in ds.auxiliary_data and name in ds.auxiliary_data[PRODUCTS_DATATYPE].list()
+
+
+class _DatasetLoader:
+    """
+    Loads an HDF5 dataset of an ASDF file. With ``mmap``, the dataset is memory-mapped instead when its data is
+    in a single uncompressed block: either contiguous or, as pyasdf writes resizable datasets, a single chunk.
+    The file is opened under the lock of the directory's writes, so it's closed (and flushed) by the store.
+    """
+
+    def __init__(self, directory: ASDFDirectory, filename: str, dataset: h5py.Dataset, mmap: bool) -> None:
+        self.lock = directory.file_lock(filename)
+        self.filename = filename
+        self.name = dataset.name
+        self.dtype = dataset.dtype
+        self.shape = dataset.shape
+        self.block = _single_block(dataset) if mmap else None
+
+    def __call__(self) -> np.ndarray:
+        if self.block is not None:
+            offset, block_shape = self.block
+            with self.lock:
+                data = np.memmap(self.filename, dtype=self.dtype, mode="r", offset=offset, shape=block_shape)
+            # a chunk can be larger than the dataset
+            return data[tuple(slice(0, n) for n in self.shape)]
+        with self.lock:
+            with h5py.File(self.filename, "r") as f:
+                return f[self.name][()]
+
+
+def _single_block(dataset: h5py.Dataset) -> Optional[Tuple[int, Tuple[int, ...]]]:
+    """
+    Returns the file offset and shape of the data of a dataset stored in a single uncompressed block, or None
+    """
+    if dataset.chunks is None:
+        offset = dataset.id.get_offset()
+        return None if offset is None else (offset, dataset.shape)
+    # the fletcher32 checksum (which pyasdf enables) is appended to the chunk and doesn't change the data,
+    # but it isn't verified when memory-mapping
+    if dataset.compression is not None or dataset.shuffle or dataset.scaleoffset:
+        return None
+    if dataset.id.get_num_chunks() != 1:
+        return None
+    return dataset.id.get_chunk_info(0).byte_offset, dataset.chunks
+
 
 def _get_dataset(filename: str, mode: str) -> pyasdf.ASDFDataSet:
     logger.debug(f"Opening {filename}")
@@ -1,6 +1,7 @@
 import re
-from typing import Callable, List
+from typing import Callable, Iterator, List, Optional, Tuple
 
+import numpy as np
 import obspy
 from datetimerange import DateTimeRange
 
@@ -22,8 +23,15 @@ class LocationChannelFilterStore(RawDataStore):
     def get_timespans(self) -> List[DateTimeRange]:
         return self.store.get_timespans()
 
-    def read_data(self, timespan: DateTimeRange, chan: Channel) -> ChannelData:
-        return self.store.read_data(timespan, chan)
+    def read_data(self, timespan: DateTimeRange, chan: Channel, window: DateTimeRange = None) -> ChannelData:
+        if window is None:
+            return self.store.read_data(timespan, chan)
+        return self.store.read_data(timespan, chan, window)
+
+    def iter_windows(
+        self, timespan: DateTimeRange, chan: Channel, length: float, step: float = None
+    ) -> Iterator[ChannelData]:
+        return self.store.iter_windows(timespan, chan, length, step)
 
     def get_inventory(self, timespan: DateTimeRange, station: Station) -> obspy.Inventory:
         return self.store.get_inventory(timespan, station)
@@ -42,28 +50,126 @@ class LocationChannelFilterStore(RawDataStore):
         return list(min_chans.values())
 
 
-def channel_filter(
-    net_list: List[str], sta_list: List[str], cha_list: List[str]
-) -> Callable[[Channel], bool]:
-    stations = set(sta_list)
-    networks = set(net_list)
-    channels = set(cha_list)
+class ChannelFilter:
+    """
+    A callable that decides whether a channel should be used, based on lists of network, station and channel
+    name patterns. Patterns may use the '*' (any string) and '?' (any character) wild cards and are matched at
+    the start of the name. Patterns are compiled once into a single regular expression per field, and plain
+    names are checked with a prefix comparison instead of a regular expression.
+    """
+
+    def __init__(self, net_list: List[str], sta_list: List[str], cha_list: List[str]):
+        self.networks = _FieldMatcher(net_list)
+        self.stations = _FieldMatcher(sta_list)
+        self.channels = _FieldMatcher(cha_list)
+
+    def __call__(self, ch: Channel) -> bool:
+        return self.match(ch.station.network, ch.station.name, ch.type.name)
+
+    def match(self, network: str, station: str, channel: str) -> bool:
+        return self.stations.match(station) and self.networks.match(network) and self.channels.match(channel)
 
-    def filter(ch: Channel) -> bool:
-        return (
-            match(ch.station.name, stations)
-            and match(ch.station.network, networks)
-            and match(ch.type.name, channels)
+    def match_arrays(self, networks: np.ndarray, stations: np.ndarray, channels: np.ndarray) -> np.ndarray:
+        """
+        Vectorized version of ``match`` over arrays of network, station and channel names.
+        Returns a boolean mask.
+        """
+        return self.stations.mask(stations) & self.networks.mask(networks) & self.channels.mask(channels)
+
+    def filter_channels(self, channels: List[Channel]) -> np.ndarray:
+        """
+        Returns a boolean mask of the channels selected by the filter
+        """
+        return self.match_arrays(
+            np.array([ch.station.network for ch in channels], dtype=str),
+            np.array([ch.station.name for ch in channels], dtype=str),
+            np.array([ch.type.name for ch in channels], dtype=str),
         )
 
-    def match(string: str, p: set) -> bool:
-        if WILD_CARD_ANY in p:
+    def sql_condition(
+        self, network: str = "network", station: str = "station", channel: str = "channel"
+    ) -> str:
+        """
+        Returns an SQL condition on the given column names that selects (at least) the names accepted by
+        the filter, or an empty string if all names are accepted. The LIKE operator is case insensitive so
+        the results should still be checked with ``match_arrays``. Fields with patterns that can't be
+        translated to LIKE patterns (e.g. alternations, character classes or anchors) are not filtered in SQL.
+        """
+        conditions = [
+            m.sql_condition(col)
+            for m, col in [(self.networks, network), (self.stations, station), (self.channels, channel)]
+        ]
+        return " AND ".join(c for c in conditions if c)
+
+
+class _FieldMatcher:
+    """
+    Matches names against the patterns of a single field (network, station or channel)
+    """
+
+    def __init__(self, patterns: List[str]):
+        patterns = set(patterns)
+        self.patterns = patterns
+        self.match_all = WILD_CARD_ANY in patterns
+        # patterns without any special characters only need a prefix comparison
+        self.literals = tuple(sorted(p for p in patterns if re.escape(p) == p))
+        wild = sorted(patterns.difference(self.literals))
+        self.regex = None
+        if len(wild) > 0:
+            self.regex = re.compile(
+                "|".join(f"(?:{p.replace(WILD_CARD_SINGLE, '.').replace(WILD_CARD_ANY, '.*')})" for p in wild)
+            )
+
+    def match(self, name: str) -> bool:
+        if self.match_all or name.startswith(self.literals):
             return True
-        else:
-            for i in p:
-                if bool(re.match(i.replace(WILD_CARD_SINGLE, ".").replace(WILD_CARD_ANY, ".*"), string)):
-                    return True
-            else:
-                return False
-
-    return filter
+        return self.regex is not None and self.regex.match(name) is not None
+
+    def sql_condition(self, column: str) -> str:
+        # only the wild cards have a LIKE equivalent, other regular expressions would drop valid names
+        if self.match_all or not all(_is_like_pattern(p) for p in self.patterns):
+            return ""
+        likes = [
+            p.replace("'", "''").replace(WILD_CARD_SINGLE, "_").replace(WILD_CARD_ANY, "%") + "%"
+            for p in sorted(self.patterns)
+        ]
+        return "(" + " OR ".join(f"{column} LIKE '{like}'" for like in likes) + ")"
+
+    def mask(self, names: np.ndarray) -> np.ndarray:
+        names = np.asarray(names, dtype=str)
+        if self.match_all:
+            return np.ones(names.shape, dtype=bool)
+        if self.regex is None:
+            mask = np.zeros(names.shape, dtype=bool)
+            for lit in self.literals:
+                mask |= np.char.startswith(names, lit)
+            return mask
+        # evaluate the patterns once per distinct name
+        unique, inverse = np.unique(names, return_inverse=True)
+        return np.array([self.match(str(n)) for n in unique], dtype=bool)[inverse].reshape(names.shape)
+
+
+def _is_like_pattern(pattern: str) -> bool:
+    plain = pattern.replace(WILD_CARD_SINGLE, "").replace(WILD_CARD_ANY, "")
+    return re.escape(plain) == plain
+
+
+def name_mask(chan_filter: Callable[[Channel], bool], names: List[Tuple[str, ...]]) -> Optional[np.ndarray]:
+    """
+    Applies ``chan_filter`` to channel names before any ``Channel`` objects are created. ``names`` holds tuples
+    that start with the (network, station, channel) names. Returns a boolean mask when the filter is a
+    ``ChannelFilter``, or None when the filter is an arbitrary function that has to be called on the full
+    ``Channel``.
+    """
+    if not isinstance(chan_filter, ChannelFilter):
+        return None
+    if len(names) == 0:
+        return np.zeros(0, dtype=bool)
+    networks, stations, channels = list(zip(*names))[:3]
+    return chan_filter.match_arrays(
+        np.array(networks, dtype=str), np.array(stations, dtype=str), np.array(channels, dtype=str)
+    )
+
+
+def channel_filter(net_list: List[str], sta_list: List[str], cha_list: List[str]) -> ChannelFilter:
+    return ChannelFilter(net_list, sta_list, cha_list)
@@ -1,9 +1,17 @@
+from __future__ import annotations
+
 import glob
 import logging
 import os
+import threading
 import time
+import warnings
+import weakref
 from abc import ABC, abstractmethod
-from functools import lru_cache
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, fields
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import diskcache as dc
 import numpy as np
@@ -15,55 +23,218 @@ from obspy import read_inventory
 from obspy.clients.fdsn import Client
 
 from .datatypes import Channel, Station
-from .utils import fs_join, get_filesystem
+from .utils import ByteLRUCache, RateLimiter, file_version, fs_join, get_filesystem
 
 logger = logging.getLogger(__name__)
 
+# Default bound for the in-memory cache of parsed StationXML inventories, shared by all catalogs
+INVENTORY_CACHE_BYTES = 512 * 1024**2
+_shared_inventory_cache = ByteLRUCache(INVENTORY_CACHE_BYTES)
+# Interval (in seconds) after which a StationXML file held in memory is checked again for changes
+INVENTORY_REVALIDATE_SECONDS = 300.0
+# Maximum number of concurrent inventory requests in get_inventories()
+MAX_INVENTORY_WORKERS = 8
+# FDSN request levels and cache key suffix for the coordinate tables
+CHANNEL_LEVEL = "channel"
+RESPONSE_LEVEL = "response"
+COORDINATES_KEY = "|coordinates"
+
 
 class ChannelCatalog(ABC):
     """
     An abstract catalog for getting full channel information (lat, lon, elev, resp)
     """
 
+    def __init__(self):
+        # coordinate index of each inventory, by id(inventory): (weak reference to the inventory, index)
+        self._indexes: Dict[int, Tuple[weakref.ref, Dict[Tuple[str, str, str], Tuple[float, ...]]]] = {}
+
     def populate_from_inventory(self, inv: obspy.Inventory, ch: Channel) -> Channel:
-        filtered = inv.select(network=ch.station.network, station=ch.station.name, channel=ch.type.name)
-        if (
-            len(filtered) == 0
-            or len(filtered.networks[0].stations) == 0
-            or len(filtered.networks[0].stations[0].channels) == 0
-        ):
+        return self._populate_from_index(self._get_coordinate_index(inv), ch)
+
+    def _get_coordinate_index(self, inv: obspy.Inventory) -> Dict[Tuple[str, str, str], Tuple[float, ...]]:
+        """
+        Returns the coordinate index of the inventory, which is only built the first time the (cached)
+        inventory object is seen. Indexes are dropped when their inventory is garbage collected.
+        """
+        key = id(inv)
+        entry = self._indexes.get(key, None)
+        if entry is not None and entry[0]() is inv:
+            return entry[1]
+        index = _coordinate_index(inv)
+        indexes = self._indexes
+        indexes[key] = (weakref.ref(inv, lambda _: indexes.pop(key, None)), index)
+        return index
+
+    def _populate_from_index(
+        self, index: Dict[Tuple[str, str, str], Tuple[float, ...]], ch: Channel
+    ) -> Channel:
+        coords = index.get((ch.station.network, ch.station.name, ch.type.name), None)
+        if coords is None:
             logger.warning(f"Could not find channel {ch} in the inventory")
             return ch
 
-        inv_chan = filtered.networks[0].stations[0].channels[0]
+        lat, lon, elevation = coords
         return Channel(
             ch.type,
             Station(
                 network=ch.station.network,
                 name=ch.station.name,
-                lat=inv_chan.latitude,
-                lon=inv_chan.longitude,
-                elevation=inv_chan.elevation,
+                lat=lat,
+                lon=lon,
+                elevation=elevation,
                 location=ch.station.location,
             ),
         )
 
     def get_full_channel(self, timespan: DateTimeRange, channel: Channel) -> Channel:
         inv = self.get_inventory(timespan, channel.station)
-        return self.populate_from_inventory(inv, channel)
+        return self._populate_from_index(self._get_coordinate_index(inv), channel)
+
+    def get_full_channels(self, timespan: DateTimeRange, channels: List[Channel]) -> List[Channel]:
+        """
+        Populate the coordinates of all the channels. The inventories of the stations are loaded with
+        get_inventories() and each one is indexed only once, so resolving a channel is a dictionary lookup.
+        """
+        invs = self.get_inventories(timespan, [ch.station for ch in channels])
+        return [
+            self._populate_from_index(self._get_coordinate_index(invs[ch.station]), ch) for ch in channels
+        ]
+
+    def get_inventories(
+        self, timespan: DateTimeRange, stations: List[Station]
+    ) -> Dict[Station, obspy.Inventory]:
+        """
+        Get the inventories for several stations. Implementations backed by a remote service can override
+        this to fetch them in bulk.
+        """
+        unique = list(set(stations))
+        if len(unique) == 0:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(len(unique), MAX_INVENTORY_WORKERS)) as executor:
+            invs = list(executor.map(lambda s: self.get_inventory(timespan, s), unique))
+        return dict(zip(unique, invs))
+
+    def prefetch(self, timespan: DateTimeRange, stations: List[Station]):
+        """
+        Load whatever is needed to resolve the full channels of the given stations, so that subsequent
+        calls to get_full_channel() are served from memory. By default this loads the inventories.
+        """
+        self.get_inventories(timespan, stations)
 
     @abstractmethod
     def get_inventory(self, timespan: DateTimeRange, station: Station) -> obspy.Inventory:
         pass
 
 
+def _coordinate_index(inv: obspy.Inventory) -> Dict[Tuple[str, str, str], Tuple[float, ...]]:
+    """
+    Map each (network, station, channel) in the inventory to the (lat, lon, elevation) of its first epoch
+    """
+    index = {}
+    for net in inv:
+        for sta in net:
+            for cha in sta:
+                index.setdefault((net.code, sta.code, cha.code), (cha.latitude, cha.longitude, cha.elevation))
+    return index
+
+
+@dataclass
+class CoordinateTable:
+    """
+    A compact, columnar table of channel coordinates (one row per channel epoch) extracted from an
+    ``obspy.Inventory``. It is much cheaper to store and load than the full (response level) inventory and
+    is all that is needed to populate the location of a channel.
+    Epochs are stored as seconds since 01/01/1970, open ended epochs have an ``end`` of +inf.
+    """
+
+    network: np.ndarray
+    station: np.ndarray
+    channel: np.ndarray
+    location: np.ndarray
+    lat: np.ndarray
+    lon: np.ndarray
+    elevation: np.ndarray
+    start: np.ndarray
+    end: np.ndarray
+
+    def from_inventory(inv: obspy.Inventory) -> CoordinateTable:
+        rows = [
+            (
+                net.code,
+                sta.code,
+                cha.code,
+                cha.location_code,
+                cha.latitude,
+                cha.longitude,
+                cha.elevation,
+                cha.start_date.timestamp if cha.start_date else -np.inf,
+                cha.end_date.timestamp if cha.end_date else np.inf,
+            )
+            for net in inv
+            for sta in net
+            for cha in sta
+        ]
+        cols = list(zip(*rows)) if len(rows) > 0 else [()] * 9
+        return CoordinateTable(
+            *(np.array(c, dtype=str) for c in cols[:4]),
+            *(np.array(c, dtype=np.float64) for c in cols[4:]),
+        )
+
+    def __len__(self) -> int:
+        return len(self.network)
+
+    def select(self, network: str, station: str) -> CoordinateTable:
+        mask = (self.network == network) & (self.station == station)
+        return CoordinateTable(*(getattr(self, f.name)[mask] for f in fields(self)))
+
+    def lookup(
+        self, network: str, station: str, channel: str, time: float = None
+    ) -> Optional[Tuple[float, ...]]:
+        """
+        Find the (lat, lon, elevation) of a channel. If a time is given, channel epochs containing it are
+        preferred, otherwise the first matching row is used.
+        """
+        idx = np.flatnonzero(
+            (self.network == network) & (self.station == station) & (self.channel == channel)
+        )
+        if len(idx) == 0:
+            return None
+        if time is not None:
+            in_epoch = idx[(self.start[idx] <= time) & (self.end[idx] > time)]
+            if len(in_epoch) > 0:
+                idx = in_epoch
+        i = idx[0]
+        return (float(self.lat[i]), float(self.lon[i]), float(self.elevation[i]))
+
+
+@dataclass
+class _CachedInventory:
+    inventory: obspy.Inventory
+    version: str
+    checked: float
+
+
 class XMLStationChannelCatalog(ChannelCatalog):
     """
     A channel catalog that reads <station>.XML files from a directory or an s3://... bucket url path.
+
+    Parsed inventories are kept in a byte-bounded in-memory cache that is shared by all instances (unless
+    a specific one is passed in). Optionally, they can also be persisted to a local ``cache_dir`` so that
+    subsequent runs don't need to parse the StationXML files again. Disk cache entries are keyed by the file
+    path and its version (ETag or modification time), so changes to the files invalidate them. The memory
+    cache is keyed by path only, so hits don't touch the file system, and the version of a file held in
+    memory is only checked again after ``revalidate_seconds``.
     """
 
     def __init__(
-        self, xmlpath: str, path_format: str = "{network}_{station}.xml", storage_options={}
+        self,
+        xmlpath: str,
+        path_format: str = "{network}_{station}.xml",
+        storage_options={},
+        cache_dir: Optional[str] = None,
+        memory_cache: Optional[ByteLRUCache] = None,
+        revalidate_seconds: float = INVENTORY_REVALIDATE_SECONDS,
     ) -> None:
         """
         Constructs a XMLStationChannelCatalog
@@ -72,6 +243,10 @@ class XMLStationChannelCatalog(ChannelCatalog):
             xmlpath (str): Base directory where to find the files
             path_format (str): Format string to construct the file name from a station.
                                The argument names are 'network' and 'station'.
+            storage_options (dict): Options to pass to fsspec
+            cache_dir (str): Optional local directory to persist the parsed inventories
+            memory_cache (ByteLRUCache): Optional in-memory cache to use instead of the shared one
+            revalidate_seconds (float): How often to check if a file held in memory has changed
         """
         super().__init__()
         self.xmlpath = xmlpath
@@ -79,74 +254,231 @@ class XMLStationChannelCatalog(ChannelCatalog):
         self.fs = get_filesystem(xmlpath, storage_options=storage_options)
         if not self.fs.exists(self.xmlpath):
             raise Exception(f"The XML Station file directory '{xmlpath}' doesn't exist")
+        self.memory_cache = memory_cache if memory_cache is not None else _shared_inventory_cache
+        self.revalidate_seconds = revalidate_seconds
+        self.disk_cache = None
+        if cache_dir is not None:
+            logger.info(f"Using StationXML cache dir: {cache_dir}")
+            self.disk_cache = dc.Cache(cache_dir)
 
     def get_inventory(self, timespan: DateTimeRange, station: Station) -> obspy.Inventory:
         file_name = self.path_format.format(network=station.network, station=station.name)
         xmlfile = fs_join(self.xmlpath, file_name)
         return self._get_inventory_from_file(xmlfile)
 
-    @lru_cache(maxsize=None)
-    def _get_inventory_from_file(self, xmlfile):
-        if not self.fs.exists(xmlfile):
+    def _get_inventory_from_file(self, xmlfile: str) -> obspy.Inventory:
+        now = time.monotonic()
+        cached = self.memory_cache.get(xmlfile)
+        if cached is not None and now - cached.checked < self.revalidate_seconds:
+            return cached.inventory
+        try:
+            info = self.fs.info(xmlfile)
+        except FileNotFoundError:
             logger.warning(f"Could not find StationXML file {xmlfile}. Returning empty Inventory()")
             return obspy.Inventory()
-        with self.fs.open(xmlfile) as f:
-            logger.info(f"Reading StationXML file {xmlfile}")
-            return read_inventory(f)
+
+        version = file_version(info)
+        # the file size is a cheap (and proportional) proxy for the size of the parsed inventory
+        nbytes = info.get("size") or 0
+        inv = cached.inventory if cached is not None and cached.version == version else None
+        if inv is None and self.disk_cache is not None:
+            inv = self.disk_cache.get(f"{xmlfile}|{version}", None)
+        if inv is None:
+            with self.fs.open(xmlfile) as f:
+                logger.info(f"Reading StationXML file {xmlfile}")
+                inv = read_inventory(f)
+            if self.disk_cache is not None:
+                self.disk_cache[f"{xmlfile}|{version}"] = inv
+        self.memory_cache.put(xmlfile, _CachedInventory(inv, version, now), nbytes)
+        return inv
 
 
 class FDSNChannelCatalog(ChannelCatalog):
     """
     A channel catalog that queries the FDSN web service
     FDSN ~ International Federation of Digital Seismograph Network
+
+    The catalog keeps two levels of metadata: a slim CoordinateTable per station (fetched at channel level)
+    that is used to populate the channel locations, and the full response level inventories, which are
+    only fetched when get_inventory() is called.
     """
 
-    def __init__(self, url_key: str, cache_dir: str, sleep_time: int = 10):
+    def __init__(
+        self,
+        url_key: str,
+        cache_dir: str,
+        sleep_time: float = None,
+        requests_per_second: float = 1.0,
+        bulk_size: int = 50,
+        client_kwargs: dict = {},
+    ):
         """
         Constructs a FDSNChannelCatalog. A local directory will be used for inventory caching.
 
         Args:
-            url_key (str): url key for obspy FDSN client, i.e., IRIS, SCEDC. See obspy.clients.fdsn
+            url_key (str): url key for obspy FDSN client, i.e., IRIS, SCEDC. See obspy.clients.fdsn.
+                           A full base URL (e.g. a local test server) is also accepted.
             cache_dir (str): local database for metadata cache
-            sleep_time (int): give a random wait time for FDSN request
+            sleep_time (float): deprecated, use requests_per_second. If given, the rate is set to 1/sleep_time
+            requests_per_second (float): maximum rate of requests to the FDSN service, shared by all threads
+            bulk_size (int): maximum number of stations to request in a single call when fetching in bulk
+            client_kwargs (dict): additional arguments for the obspy FDSN Client
         """
         super().__init__()
+        if sleep_time is not None:
+            warnings.warn(
+                "sleep_time is deprecated, use requests_per_second to throttle the FDSN requests",
+                DeprecationWarning,
+                stacklevel=2,
+            )
+            if sleep_time > 0:
+                requests_per_second = 1.0 / sleep_time
         self.url_key = url_key
         self.sleep_time = sleep_time
+        self.bulk_size = bulk_size
+        self.client_kwargs = client_kwargs
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._inventories: Dict[str, obspy.Inventory] = {}
+        self._coordinates: Dict[str, CoordinateTable] = {}
 
         logger.info(f"Using FDSN service by {self.url_key}")
         logger.info(f"Cache dir: {cache_dir}")
         self.cache = dc.Cache(cache_dir)
 
     def get_full_channel(self, timespan: DateTimeRange, channel: Channel) -> Channel:
-        inv = self._get_inventory(channel.station)
-        return self.populate_from_inventory(inv, channel)
+        table = self._get_coordinates(channel.station)
+        time = timespan.start_datetime.timestamp() if timespan.start_datetime is not None else None
+        coords = table.lookup(channel.station.network, channel.station.name, channel.type.name, time)
+        if coords is None:
+            logger.warning(f"Could not find channel {channel} in the inventory")
+            return channel
+        lat, lon, elevation = coords
+        return Channel(
+            channel.type,
+            Station(
+                network=channel.station.network,
+                name=channel.station.name,
+                lat=lat,
+                lon=lon,
+                elevation=elevation,
+                location=channel.station.location,
+            ),
+        )
+
+    def get_full_channels(self, timespan: DateTimeRange, channels: List[Channel]) -> List[Channel]:
+        self.prefetch(timespan, [ch.station for ch in channels])
+        return [self.get_full_channel(timespan, ch) for ch in channels]
 
     def get_inventory(self, timespan: DateTimeRange, station: Station) -> obspy.Inventory:
         return self._get_inventory(station)
 
-    @lru_cache
+    def get_inventories(
+        self, timespan: DateTimeRange, stations: List[Station]
+    ) -> Dict[Station, obspy.Inventory]:
+        """
+        Get the (response level) inventories for all the stations, requesting the ones not found in the cache
+        in bulk: one ``get_stations`` call per network for up to ``bulk_size`` stations at a time.
+        """
+        self._fetch_missing(stations, self._get_cached_inventory, RESPONSE_LEVEL)
+        return {sta: self._get_inventory(sta) for sta in stations}
+
+    def prefetch(self, timespan: DateTimeRange, stations: List[Station]):
+        """
+        Fetch the coordinates of all the stations in bulk (see get_inventories())
+        """
+        self._fetch_missing(stations, self._get_cached_coordinates, CHANNEL_LEVEL)
+
+    def _get_client(self) -> Client:
+        # Reuse a single client (and its service discovery) across requests and threads
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = Client(self.url_key, **self.client_kwargs)
+        return self._client
+
+    def _get_cached_inventory(self, station: Station) -> Optional[obspy.Inventory]:
+        key = str(station)
+        inventory = self._inventories.get(key, None)
+        if inventory is None:
+            inventory = self.cache.get(key, None)  # check local cache
+            if inventory is not None:
+                self._inventories[key] = inventory
+        return inventory
+
+    def _get_cached_coordinates(self, station: Station) -> Optional[CoordinateTable]:
+        key = f"{station}{COORDINATES_KEY}"
+        table = self._coordinates.get(key, None)
+        if table is None:
+            table = self.cache.get(key, None)
+            if table is not None:
+                self._coordinates[key] = table
+        return table
+
+    def _put_cached(self, station: Station, level: str, inventory: obspy.Inventory):
+        if level == RESPONSE_LEVEL:
+            self.cache[str(station)] = inventory
+            self._inventories[str(station)] = inventory
+        else:
+            table = CoordinateTable.from_inventory(inventory)
+            self.cache[f"{station}{COORDINATES_KEY}"] = table
+            self._coordinates[f"{station}{COORDINATES_KEY}"] = table
+
+    def _get_stations(self, network: str, station: str, level: str) -> obspy.Inventory:
+        self.rate_limiter.acquire()
+        try:
+            return self._get_client().get_stations(
+                network=network,
+                station=station,
+                location="*",
+                channel="?H?,?N?",
+                level=level,
+            )
+        except obspy.clients.fdsn.header.FDSNNoDataException:
+            logger.warning(f"FDSN returns no data for {network}.{station}. Returning empty Inventory()")
+            return obspy.Inventory()
+
     def _get_inventory(self, station: Station) -> obspy.Inventory:
-        inventory = self.cache.get(str(station), None)  # check local cache
+        inventory = self._get_cached_inventory(station)
         if inventory is None:
             logging.info(f"Inventory not found in cache for '{station}'. Fetching from {self.url_key}.")
-            # Don't send request too fast
-            time.sleep(np.random.uniform(self.sleep_time))
-            client = Client(self.url_key)
-            try:
-                inventory = client.get_stations(
-                    network=station.network,
-                    station=station.name,
-                    location="*",
-                    channel="?H?,?N?",
-                    level="response",
-                )
-            except obspy.clients.fdsn.header.FDSNNoDataException:
-                logger.warning(f"FDSN returns no data for {station}. Returning empty Inventory()")
-                inventory = obspy.Inventory()
-            self.cache[str(station)] = inventory
+            inventory = self._get_stations(station.network, station.name, RESPONSE_LEVEL)
+            self._put_cached(station, RESPONSE_LEVEL, inventory)
         return inventory
 
+    def _get_coordinates(self, station: Station) -> CoordinateTable:
+        table = self._get_cached_coordinates(station)
+        if table is None:
+            logging.info(f"Coordinates not found in cache for '{station}'. Fetching from {self.url_key}.")
+            self._put_cached(
+                station, CHANNEL_LEVEL, self._get_stations(station.network, station.name, CHANNEL_LEVEL)
+            )
+            table = self._get_cached_coordinates(station)
+        return table
+
+    def _fetch_missing(self, stations: List[Station], get_cached: Callable[[Station], Any], level: str):
+        missing = defaultdict(list)
+        for sta in set(stations):
+            if get_cached(sta) is None:
+                missing[sta.network].append(sta)
+        chunks = [
+            (net, stas[i : i + self.bulk_size])
+            for net, stas in missing.items()
+            for i in range(0, len(stas), self.bulk_size)
+        ]
+        if len(chunks) == 0:
+            return
+        logger.info(f"Fetching {level} metadata for {sum(len(m) for m in missing.values())} stations")
+        with ThreadPoolExecutor(max_workers=min(len(chunks), MAX_INVENTORY_WORKERS)) as executor:
+            list(executor.map(lambda c: self._fetch_bulk(*c, level), chunks))
+
+    def _fetch_bulk(self, network: str, stations: List[Station], level: str):
+        inventory = self._get_stations(network, ",".join(sta.name for sta in stations), level)
+        # split the response into per-station cache entries
+        for sta in stations:
+            self._put_cached(sta, level, inventory.select(network=network, station=sta.name))
+
 
 class CSVChannelCatalog(ChannelCatalog):
     """
@@ -154,43 +486,91 @@ class CSVChannelCatalog(ChannelCatalog):
     """
 
     def __init__(self, file: str):
+        super().__init__()
         self.df = pd.read_csv(file)
-
-    def get_full_channel(self, timespan: DateTimeRange, ch: Channel) -> Channel:
-        ista = self.df[self.df["station"] == ch.station.name].index.values.astype("int64")[0]
+        # Index the rows once by (network, station). The coordinates of a station are taken from its first row.
+        keys = list(zip(self.df["network"].astype(str), self.df["station"].astype(str)))
+        self.rows: Dict[Tuple[str, str], List[int]] = defaultdict(list)
+        for i, key in enumerate(keys):
+            self.rows[key].append(i)
+        self.station_rows = {}
+        for (_, sta), rows in self.rows.items():
+            self.station_rows.setdefault(sta, rows[0])
+        self.first_rows = pd.DataFrame(
+            [(net, sta, rows[0]) for (net, sta), rows in self.rows.items()],
+            columns=["network", "station", "row"],
+        )
+        self.lat = self.df["latitude"].to_numpy()
+        self.lon = self.df["longitude"].to_numpy()
+        self.elevation = self.df["elevation"].to_numpy()
+        self._inventories: Dict[Tuple[str, str], obspy.Inventory] = {}
+        self._lock = threading.Lock()
+
+    def _row(self, station: Station) -> Optional[int]:
+        rows = self.rows.get((station.network, station.name), None)
+        if rows is not None:
+            return rows[0]
+        # fall back to matching just the station name
+        return self.station_rows.get(station.name, None)
+
+    def _full_channel(self, ch: Channel, row: Optional[int]) -> Channel:
+        if row is None:
+            logger.warning(f"Could not find station {ch.station} in the CSV catalog")
+            return ch
         return Channel(
             ch.type,
             Station(
                 network=ch.station.network,
                 name=ch.station.name,
-                lat=self.df.iloc[ista]["latitude"],
-                lon=self.df.iloc[ista]["longitude"],
-                elevation=self.df.iloc[ista]["elevation"],
+                lat=self.lat[row],
+                lon=self.lon[row],
+                elevation=self.elevation[row],
                 location=ch.station.location,
             ),
         )
 
+    def get_full_channel(self, timespan: DateTimeRange, ch: Channel) -> Channel:
+        return self._full_channel(ch, self._row(ch.station))
+
+    def get_full_channels(self, timespan: DateTimeRange, channels: List[Channel]) -> List[Channel]:
+        """
+        Populate the coordinates of all the channels with a single join against the CSV
+        """
+        if len(channels) == 0:
+            return []
+        requested = pd.DataFrame(
+            [(ch.station.network, ch.station.name) for ch in channels], columns=["network", "station"]
+        )
+        rows = requested.merge(self.first_rows, on=["network", "station"], how="left")["row"]
+        # fall back to matching just the station name
+        rows = rows.fillna(requested["station"].map(self.station_rows))
+        return [self._full_channel(ch, None if pd.isna(r) else int(r)) for ch, r in zip(channels, rows)]
+
     def get_inventory(self, timespan: DateTimeRange, station: Station) -> obspy.Inventory:
-        # Build a obspy.Inventory from the dataframe
-        network_codes = list(self.df["network"].unique())
-        df = self.df
-        nets = []
-        for net in network_codes:
-            sta_names = list(df[df.network == net]["station"].unique())
-            stations = []
-            for sta in sta_names:
-                sta_row = df[df.network == net][df.station == sta].iloc[0]
-                lat = sta_row["latitude"]
-                lon = sta_row["longitude"]
-                elevation = sta_row["elevation"]
-                channels = [
-                    inventory.Channel(ch, "", lat, lon, elevation, 0)
-                    for ch in df[df.network == net][df.station == sta]["channel"].values
-                ]
-                station = inventory.Station(sta, lat, lon, elevation, channels=channels)
-                stations.append(station)
-            nets.append(inventory.Network(net, stations))
-        return obspy.Inventory(nets)
+        """
+        Build an obspy.Inventory for the station from the dataframe. If no station is given, the inventory
+        includes all the stations in the CSV.
+        """
+        keys = list(self.rows.keys()) if station is None else [(station.network, station.name)]
+        keys = [k for k in keys if k in self.rows]
+        nets = defaultdict(list)
+        for key in keys:
+            nets[key[0]].extend(self._station_inventory(key).networks[0].stations)
+        return obspy.Inventory([inventory.Network(net, stations) for net, stations in nets.items()])
+
+    def _station_inventory(self, key: Tuple[str, str]) -> obspy.Inventory:
+        inv = self._inventories.get(key, None)
+        if inv is None:
+            rows = self.rows[key]
+            lat, lon, elevation = self.lat[rows[0]], self.lon[rows[0]], self.elevation[rows[0]]
+            channels = [
+                inventory.Channel(ch, "", lat, lon, elevation, 0) for ch in self.df["channel"].values[rows]
+            ]
+            station = inventory.Station(key[1], lat, lon, elevation, channels=channels)
+            inv = obspy.Inventory([inventory.Network(key[0], [station])])
+            with self._lock:
+                self._inventories[key] = inv
+        return inv
 
 
 def sta_info_from_inv(inv: obspy.Inventory):
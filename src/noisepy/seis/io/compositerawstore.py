@@ -1,4 +1,6 @@
-from typing import Dict, List
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
 
 import obspy
 from datetimerange import DateTimeRange
@@ -12,27 +14,80 @@ class CompositeRawStore(RawDataStore):
     A class for reading the raw data for a given channel from multiple sources
     """
 
-    def __init__(self, stores: Dict[str, RawDataStore]):
+    def __init__(self, stores: Dict[str, RawDataStore], executor: Executor = None):
+        """
+        Parameters:
+            stores: Dictionary of network name to the store that holds the data for that network
+            executor: Executor used to query the member stores concurrently. The caller owns it and is
+                      responsible for shutting it down. Defaults to a thread pool with one thread per store,
+                      created and shut down by each call.
+        """
         self.stores = stores
+        self.executor = executor
 
     def get_channels(self, timespan: DateTimeRange) -> List[Channel]:
-        return [chan for store in self.stores.values() for chan in store.get_channels(timespan)]
+        with self._executor() as executor:
+            futures = [executor.submit(store.get_channels, timespan) for store in self.stores.values()]
+            return [chan for f in futures for chan in f.result()]
 
     def get_timespans(self) -> List[DateTimeRange]:
-        timespans = dict([nets, store.get_timespans()] for nets, store in self.stores.items())
-        uniquespans = []
-        for netspans in timespans.values():
-            for span in netspans:
-                if span not in uniquespans:
-                    uniquespans.append(span)
-        return uniquespans
+        with self._executor() as executor:
+            futures = [executor.submit(store.get_timespans) for store in self.stores.values()]
+            # DateTimeRange is not hashable so we use its string representation as the key
+            uniquespans = {}
+            for f in futures:
+                for span in f.result():
+                    uniquespans.setdefault(str(span), span)
+            return list(uniquespans.values())
 
-    def read_data(self, timespan: DateTimeRange, chan: Channel) -> ChannelData:
-        return self._store(chan.station.network).read_data(timespan, chan)
+    def read_data(self, timespan: DateTimeRange, chan: Channel, window: DateTimeRange = None) -> ChannelData:
+        if window is None:
+            # stores that don't support windows keep working
+            return self._store(chan.station.network).read_data(timespan, chan)
+        return self._store(chan.station.network).read_data(timespan, chan, window)
+
+    def iter_windows(
+        self, timespan: DateTimeRange, chan: Channel, length: float, step: float = None
+    ) -> Iterator[ChannelData]:
+        return self._store(chan.station.network).iter_windows(timespan, chan, length, step)
+
+    def read_data_bulk(
+        self, timespan: DateTimeRange, channels: List[Channel], executor: Executor = None
+    ) -> List[ChannelData]:
+        """
+        Groups the channels by network and reads each group from its store in parallel. The member stores
+        use ``executor`` for their own reads if given, otherwise their own default. The results are in the
+        same order as the channels.
+        """
+        # stores that manage their own readers (e.g. DASH5DataStore) don't take an executor
+        extra = () if executor is None else (executor,)
+        groups: Dict[str, List[int]] = {}
+        for i, ch in enumerate(channels):
+            groups.setdefault(ch.station.network, []).append(i)
+        with self._executor() as store_executor:
+            futures = {
+                net: store_executor.submit(
+                    self._store(net).read_data_bulk, timespan, [channels[i] for i in idxs], *extra
+                )
+                for net, idxs in groups.items()
+            }
+            results = [None] * len(channels)
+            for net, f in futures.items():
+                for i, data in zip(groups[net], f.result()):
+                    results[i] = data
+            return results
 
     def get_inventory(self, timespan: DateTimeRange, station: Station) -> obspy.Inventory:
         return self._store(station.network).get_inventory(timespan, station)
 
+    @contextmanager
+    def _executor(self) -> Iterator[Executor]:
+        if self.executor is not None:
+            yield self.executor
+            return
+        with ThreadPoolExecutor(max_workers=max(1, len(self.stores))) as executor:
+            yield executor
+
     def _store(self, network: str) -> RawDataStore:
         if network not in self.stores:
             raise ValueError(f"Network {network} not found in known stores")
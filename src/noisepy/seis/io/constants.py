@@ -3,6 +3,8 @@ DATE_FORMAT_HELP = "%%Y_%%m_%%d_%%H_%%M_%%S"
 DATE_FORMAT = "%Y_%m_%d_%H_%M_%S"
 DONE_PATH = "done"
 PROGRESS_DATATYPE = "Progress"
+# ASDF auxiliary data type of the derived products (e.g. moveout stacks) of the stack stores
+PRODUCTS_DATATYPE = "Products"
 CONFIG_FILE = "config.yaml"
 AWS_BATCH_JOB_ARRAY_INDEX = "AWS_BATCH_JOB_ARRAY_INDEX"
 AWS_BATCH_JOB_ID = "AWS_BATCH_JOB_ID"
@@ -1,13 +1,14 @@
 from __future__ import annotations
 
 import sys
+import threading
 import typing
 from abc import ABC, abstractmethod
 from collections import defaultdict
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from enum import Enum
-from typing import Any, DefaultDict, Dict, List, Optional, Tuple
+from typing import Any, Callable, DefaultDict, Dict, List, Optional, Tuple
 from urllib.parse import urlparse
 
 import numpy as np
@@ -323,9 +324,9 @@ class ChannelData:
         data: series values
         sampling_rate: In HZ
         start_timestamp: Seconds since 01/01/1970
+        stream: obspy.Stream with the data. When created with ``from_array`` it's only built if accessed
     """
 
-    stream: obspy.Stream
     data: np.ndarray
     sampling_rate: int
     start_timestamp: float
@@ -333,12 +334,84 @@ class ChannelData:
     def empty() -> ChannelData:
         return ChannelData(obspy.Stream([obspy.Trace(np.empty(0))]))
 
+    def from_array(
+        data: np.ndarray, sampling_rate: float, start_timestamp: float, channel: Optional[Channel] = None
+    ) -> ChannelData:
+        """
+        Creates a ChannelData directly from the samples, without creating obspy objects. The optional channel
+        is used to fill in the stats of the stream if it is ever accessed.
+        """
+        cd = ChannelData.__new__(ChannelData)
+        cd._stream = None
+        cd._channel = channel
+        cd.data = data
+        cd.sampling_rate = sampling_rate
+        cd.start_timestamp = start_timestamp
+        return cd
+
     def __init__(self, stream: obspy.Stream):
-        self.stream = stream
+        self._stream = stream
+        self._channel = None
         self.data = stream[0].data[:]
         self.sampling_rate = stream[0].stats.sampling_rate
         self.start_timestamp = stream[0].stats.starttime.timestamp
 
+    @property
+    def stream(self) -> obspy.Stream:
+        if self._stream is None:
+            trace = obspy.Trace(self.data)
+            trace.stats.sampling_rate = self.sampling_rate
+            trace.stats.starttime = obspy.UTCDateTime(self.start_timestamp)
+            if self._channel is not None:
+                trace.stats.network = self._channel.station.network
+                trace.stats.station = self._channel.station.name
+                trace.stats.location = self._channel.type.location
+                trace.stats.channel = self._channel.type.name
+            self._stream = obspy.Stream([trace])
+        return self._stream
+
+    @stream.setter
+    def stream(self, stream: obspy.Stream):
+        self._stream = stream
+
+
+@dataclass
+class ChannelBlock:
+    """
+    The data of several channels that share the same sampling rate and start time
+
+    Attributes:
+        data: 2D array with one row of samples per channel
+        channels: the channel of each row
+        sampling_rate: In HZ
+        start_timestamp: Seconds since 01/01/1970
+    """
+
+    data: np.ndarray
+    channels: List[Channel]
+    sampling_rate: float
+    start_timestamp: float
+
+    def __post_init__(self):
+        assert self.data.ndim == 2, f"Expected a 2D array, got shape {self.data.shape}"
+        assert self.data.shape[0] == len(
+            self.channels
+        ), f"The number of rows ({self.data.shape[0]}) should match the number of channels ({len(self.channels)})"
+
+    def __len__(self) -> int:
+        return len(self.channels)
+
+    def __getitem__(self, index: int) -> ChannelData:
+        return ChannelData.from_array(
+            self.data[index], self.sampling_rate, self.start_timestamp, self.channels[index]
+        )
+
+    def channel_data(self) -> List[ChannelData]:
+        """
+        Returns a ChannelData per row. The rows are views of the block's array.
+        """
+        return [self[i] for i in range(len(self))]
+
 
 @dataclass
 class NoiseFFT:
@@ -355,53 +428,106 @@ class NoiseFFT:
 
 class AnnotatedData(ABC):
     """
-    A base class for grouping data+metdata
+    A base class for grouping data+metdata. The data can be loaded lazily: when a loader is set (see
+    ``set_loader``), it's called the first time ``data`` is accessed.
     """
 
     parameters: Dict[str, Any]
-    data: np.ndarray
 
     def __init__(self, params: Dict[str, Any], data: np.ndarray):
-        self.data = data
+        self._data = data
+        self._loader = None
+        self._load_lock = None
         self.parameters = to_json_types(params)
 
+    @property
+    def data(self) -> np.ndarray:
+        loader = self._loader
+        if loader is not None:
+            with self._load_lock:
+                # another thread may have loaded it while this one waited for the lock
+                if self._loader is loader:
+                    self._data = loader()
+                    self._loader = None
+        return self._data
+
+    @data.setter
+    def data(self, data: np.ndarray):
+        self._data = data
+        self._loader = None
+
+    def set_loader(self, loader: Callable[[], np.ndarray]):
+        """
+        Defers loading the data until it's first accessed
+        """
+        self._data = None
+        self._load_lock = threading.Lock()
+        self._loader = loader
+
+    def get_loader(self) -> Optional[Callable[[], np.ndarray]]:
+        return self._loader
+
+    def is_loaded(self) -> bool:
+        return self._loader is None
+
+    def _shape_str(self) -> str:
+        return str(self._data.shape) if self.is_loaded() else "(not loaded)"
+
     @abstractmethod
     def get_metadata(self) -> Tuple:
         pass
 
+    def get_component(self) -> str:
+        """
+        Returns the cross component, e.g. 'ZZ'. Needed to select components when reading from the stores.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not define its component")
+
     def pack(datas: List[AnnotatedData]) -> Tuple[np.ndarray, List[Dict[str, Any]]]:
         if len(datas) == 0:
             raise ValueError("Cannot pack empty list of data")
-        # Some arrays may have different lengths, so pad them with NaNs for stacking
-        max_rows = max(d.data.shape[0] for d in datas)
-        if len(datas[0].data.shape) == 1:
-            padded = [
-                np.pad(
-                    d.data,
-                    (0, max_rows - d.data.shape[0]),
-                    mode="constant",
-                    constant_values=np.nan,
-                )
-                for d in datas
-            ]
-        elif len(datas[0].data.shape) == 2:
-            max_cols = max(d.data.shape[1] for d in datas)
-            padded = [
-                np.pad(
-                    d.data,
-                    ((0, max_rows - d.data.shape[0]), (0, max_cols - d.data.shape[1])),
-                    mode="constant",
-                    constant_values=np.nan,
-                )
-                for d in datas
-            ]
-        else:
+        ndim = len(datas[0].data.shape)
+        if ndim not in (1, 2):
             raise ValueError(f"Cannot pack data with shape {datas[0].data.shape}")
+        # Some arrays may have different lengths, so pad them with NaNs for stacking. The output is allocated
+        # once and each array is copied into its slice
+        shape = tuple(max(d.data.shape[i] for d in datas) for i in range(ndim))
+        dtype = np.result_type(*[d.data.dtype for d in datas])
+        if all(d.data.shape == shape for d in datas):
+            data_stack = np.empty((len(datas),) + shape, dtype=dtype)
+        else:
+            data_stack = np.full((len(datas),) + shape, np.nan, dtype=dtype)
+        for i, d in enumerate(datas):
+            data_stack[(i,) + tuple(slice(0, n) for n in d.data.shape)] = d.data
 
-        data_stack = np.stack(padded, axis=0)
         json_params = [p.get_metadata() for p in datas]
         return data_stack, json_params
 
+    def pack_ragged(
+        datas: List[AnnotatedData],
+    ) -> Tuple[np.ndarray, List[int], List[Tuple], List[Dict[str, Any]]]:
+        """
+        Packs the arrays without any padding: returns their concatenated (flattened) data, the offset of each
+        array in it (plus the total length), their shapes and their metadata. See ``unpack_ragged``.
+        """
+        if len(datas) == 0:
+            raise ValueError("Cannot pack empty list of data")
+        sizes = [d.data.size for d in datas]
+        offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64).tolist()
+        data = np.empty(offsets[-1], dtype=np.result_type(*[d.data.dtype for d in datas]))
+        for i, d in enumerate(datas):
+            data[offsets[i] : offsets[i + 1]] = d.data.ravel()
+        shapes = [tuple(d.data.shape) for d in datas]
+        json_params = [p.get_metadata() for p in datas]
+        return data, offsets, shapes, json_params
+
+
+def unpack_ragged(data: np.ndarray, offsets: List[int], shapes: List[Tuple]) -> List[np.ndarray]:
+    """
+    Splits the data packed by ``AnnotatedData.pack_ragged`` into (views of) the original arrays
+    """
+    return [data[offsets[i] : offsets[i + 1]].reshape(shape) for i, shape in enumerate(shapes)]
+
 
 class CrossCorrelation(AnnotatedData):
     src: ChannelType
@@ -413,11 +539,14 @@ class CrossCorrelation(AnnotatedData):
         self.rec = rec
 
     def __repr__(self) -> str:
-        return f"{self.src}_{self.rec}/{self.data.shape}"
+        return f"{self.src}_{self.rec}/{self._shape_str()}"
 
     def get_metadata(self) -> Tuple:
         return (self.src.name, self.src.location, self.rec.name, self.rec.location, self.parameters)
 
+    def get_component(self) -> str:
+        return (self.src.get_orientation() + self.rec.get_orientation()).upper()
+
     def load_instances(tuples: List[Tuple[np.ndarray, Dict[str, Any]]]) -> List[CrossCorrelation]:
         return [
             CrossCorrelation(
@@ -437,11 +566,14 @@ class Stack(AnnotatedData):
         self.name = name
 
     def __repr__(self) -> str:
-        return f"{self.component}/{self.name}/{self.data.shape}"
+        return f"{self.component}/{self.name}/{self._shape_str()}"
 
     def get_metadata(self) -> Tuple:
         return (self.component, self.name, self.parameters)
 
+    def get_component(self) -> str:
+        return self.component
+
     def load_instances(tuples: List[Tuple[np.ndarray, Dict[str, Any]]]) -> List[Stack]:
         return [Stack(comp, name, params, remove_nans(data)) for data, (comp, name, params) in tuples]
 
@@ -1,24 +1,54 @@
+import bisect
+import json
 import logging
 import os
+import threading
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from typing import List
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
 
+import fsspec
 import h5py
+import numpy as np
 import obspy
+import zarr
 from datetimerange import DateTimeRange
 
-from .datatypes import Channel, ChannelData, ChannelType, Station
-from .stores import RawDataStore
-from .utils import TimeLogger, fs_join, get_filesystem
+from .datatypes import Channel, ChannelBlock, ChannelData, ChannelType, Station
+from .stores import RawDataStore, slice_window
+from .utils import ByteLRUCache, TimeLogger, error_if, fs_join, get_filesystem, iter_timespans
 
 logger = logging.getLogger(__name__)
 
+RAW_DATA = "/Acquisition/Raw[0]/RawData"
+RAW_DATA_TIME = "/Acquisition/Raw[0]/RawDataTime"
+# Default size of the cache of channel blocks used by read_data
+BLOCK_CACHE_BYTES = 256 * 1024 * 1024
+# Bounds of the read block size used for remote files, which is otherwise sized to the HDF5 chunks
+MIN_READ_BLOCK_SIZE = 1024 * 1024
+MAX_READ_BLOCK_SIZE = 64 * 1024 * 1024
+REFERENCES_SUFFIX = ".json"
+# Default maximum number of files read concurrently by read_block
+MAX_FILE_READERS = 8
+
+
+@dataclass
+class _FileInfo:
+    filename: str
+    start: float  # timestamp of the first sample
+    nsamples: int
+    dtype: np.dtype
+
 
 class DASH5DataStore(RawDataStore):
     """
     A data store implementation to read from a directory of HDF5 (.h5) files.
-    Every file is a minute recording and each .h5 file contains the data for all channel.
+    Each .h5 file contains the data for all channels, starting at the time in its name. Timespans
+    can cover several files: their data is stitched together and gaps are masked.
     """
 
     def __init__(
@@ -30,24 +60,53 @@ class DASH5DataStore(RawDataStore):
         array_name: str = "DAS",
         date_range: DateTimeRange = None,
         storage_options: dict = {},
+        block_cache_bytes: int = BLOCK_CACHE_BYTES,
+        reference_dir: str = None,
+        max_file_readers: int = MAX_FILE_READERS,
     ):
         """
         Parameters:
-            path: path to look for h5 files. Must be a local file directory
+            path: path to look for h5 files. Can be a local file directory or an s3://... url path
             sampling_rate: sampling rate of the data
             file_naming: a string format to parse the file name. Must contain a datetime format
             channel_numbers: a list of channel numbers to read
             array_name: name of the array
+            block_cache_bytes: maximum size of the blocks of channels cached by read_data
+            reference_dir: Optional directory with kerchunk reference files (see ``generate_references``).
+                           Files with a reference are read as zarr arrays with direct range requests.
+            max_file_readers: maximum number of files of a timespan read concurrently
         """
         super().__init__()
         self.fs = get_filesystem(path, storage_options=storage_options)
+        self.storage_options = storage_options.get(urlparse(path).scheme, storage_options)
+        self.reference_dir = reference_dir
+        self._references: Dict[str, Optional[dict]] = {}
+        # size of the blocks read from remote files, set from the chunk layout of the first file read
+        self.read_block_size: Optional[int] = None
         self.sampling_rate = sampling_rate
         self.array_name = array_name
         self.channel_numbers = channel_numbers
         self.file_naming = file_naming
-        self.path = os.path.abspath(path)
-        self.paths = {}
-        self.channels = defaultdict(list)
+        self.path = path if _is_remote(path) else os.path.abspath(path)
+        # start time -> file name
+        self.paths: Dict[datetime, str] = {}
+        self._starts: List[datetime] = []
+        self._file_infos: Dict[str, _FileInfo] = {}
+        self._listed = False
+        # read_data serves single channels from a block with all the channel_numbers of a file
+        self.blocks = ByteLRUCache(block_cache_bytes)
+        self._block_locks: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+        self._block_locks_lock = threading.Lock()
+        # The files of a timespan are read on a pool owned by the store, which is never exposed to callers:
+        # read_block can then be called from tasks running on any executor without waiting on per-file reads
+        # that can't be scheduled. It is only created on the first read.
+        self.max_file_readers = max_file_readers
+        self._file_executor: Optional[ThreadPoolExecutor] = None
+        self._file_executor_lock = threading.Lock()
+        self._block_rows = {n: i for i, n in enumerate(channel_numbers)}
+        self._channels = [self._parse_channel(n) for n in channel_numbers]
+        for ch in self._channels:
+            self._validate_station(ch.station)
         if date_range is not None and date_range.start_datetime.tzinfo is None:
             start_datetime = date_range.start_datetime.replace(tzinfo=timezone.utc)
             end_datetime = date_range.end_datetime.replace(tzinfo=timezone.utc)
@@ -56,80 +115,283 @@ class DASH5DataStore(RawDataStore):
         self.date_range = date_range
 
         if date_range is None:
-            for file in self.fs.glob(fs_join(self.path, "*.h5")):
-                self._load_channels(file)
+            self._ensure_array_loaded(None)
 
     def _load_channels(self, full_path: str):
         tlog = TimeLogger(logger=logger, level=logging.DEBUG, prefix="LOAD H5")
         msfiles = [f for f in self.fs.glob(full_path)]
-        tlog.log(f"loading {len(msfiles)} files from {full_path}")
+        tlog.log(f"listing {len(msfiles)} files from {full_path}")
         for f in msfiles:
             timespan = self._parse_timespan(os.path.basename(f))
-            self.paths[timespan.start_datetime] = full_path
-            for idx in self.channel_numbers:
-                channel = self._parse_channel(idx)
-                key = str(timespan)  # DataTimeFrame is not hashable
-                self.channels[key].append(channel)
-        tlog.log(
-            f"loading {len(self.channels)} timespans and {len(set([str(i) for ch in self.channels.values() for i in ch]))} channels"
-        )
+            if self.date_range is not None and timespan.start_datetime >= self.date_range.end_datetime:
+                continue
+            self.paths[timespan.start_datetime] = f
+        self._starts = sorted(self.paths.keys())
+        tlog.log(f"loading {len(self.paths)} files and {len(self.channel_numbers)} channels")
 
     def _ensure_array_loaded(self, date_range: DateTimeRange):
-        key = str(date_range)
-        if key not in self.channels or date_range.start_datetime not in self.paths:
-            dt = date_range.end_datetime - date_range.start_datetime
-            for d in range(0, dt.seconds // 60):
-                date = date_range.start_datetime + timedelta(minutes=d)
-                if self.date_range is None or date not in self.date_range:
-                    continue
-                date_path = self._get_datepath(date)
-                full_path = fs_join(self.path, date_path)
-                self._load_channels(full_path)
+        # the directory is only listed once
+        if not self._listed:
+            self._load_channels(fs_join(self.path, "*.h5"))
+            self._listed = True
+
+    def _get_files(self, timespan: DateTimeRange) -> List[str]:
+        """
+        Returns the files that may have data for the timespan: the last one starting before it and all the
+        ones starting within it.
+        """
+        self._ensure_array_loaded(timespan)
+        first = max(bisect.bisect_right(self._starts, timespan.start_datetime) - 1, 0)
+        last = bisect.bisect_left(self._starts, timespan.end_datetime)
+        return [self.paths[s] for s in self._starts[first:last]]
 
     def get_channels(self, date_range: DateTimeRange) -> List[Channel]:
-        self._ensure_array_loaded(date_range)
-        tmp_channels = self.channels.get(str(date_range), [])
-        stations = set(map(lambda c: c.station, tmp_channels))
-        _ = list(map(lambda s: self._validate_station(s), stations))
+        files = self._get_files(date_range)
+        tmp_channels = list(self._channels) if len(files) > 0 else []
         logger.info(f"Getting {len(tmp_channels)} channels for {date_range}")
         return tmp_channels
 
     def get_timespans(self) -> List[DateTimeRange]:
+        return list(self.iter_timespans())
+
+    def iter_timespans(self, chunk: timedelta = None) -> Iterator[DateTimeRange]:
+        """
+        Lazily yields the timespans of the store. With a ``date_range`` these are consecutive timespans
+        of length ``chunk`` (one minute by default) over the range. Otherwise they are the nominal timespans
+        of the files or, if ``chunk`` is given, consecutive timespans of that length from the first file on.
+        Use ``utils.timespan_epochs`` for a compact array version.
+        """
         if self.date_range is not None:
-            minutes = (
-                int((self.date_range.end_datetime - self.date_range.start_datetime).total_seconds()) // 60
-            )
-            return [
-                DateTimeRange(
-                    self.date_range.start_datetime.replace(tzinfo=timezone.utc) + timedelta(minutes=d),
-                    self.date_range.start_datetime.replace(tzinfo=timezone.utc) + timedelta(minutes=d + 1),
-                )
-                for d in range(0, minutes)
-            ]
-        return list([DateTimeRange.from_range_text(d) for d in sorted(self.channels.keys())])
+            yield from iter_timespans(self.date_range, chunk or timedelta(minutes=1))
+            return
+        files = self._list_files()
+        if chunk is None:
+            for f in files:
+                yield self._parse_timespan(os.path.basename(f))
+        elif len(files) > 0:
+            first = self._parse_timespan(os.path.basename(files[0]))
+            last = self._parse_timespan(os.path.basename(files[-1]))
+            # include a last partial chunk
+            end = last.end_datetime + chunk - timedelta(microseconds=1)
+            yield from iter_timespans(DateTimeRange(first.start_datetime, end), chunk)
 
-    def read_data(self, timespan: DateTimeRange, chan: Channel) -> ChannelData:
+    def read_data(self, timespan: DateTimeRange, chan: Channel, window: DateTimeRange = None) -> ChannelData:
         self._ensure_array_loaded(timespan)
-        # reconstruct the file name from the channel parameters
-        filename = self._get_filename(timespan)
         number = int(chan.station.name)
-        if not self.fs.exists(filename):
-            logger.warning(f"Could not find file {filename}")
+        row = self._block_rows.get(number, None)
+        if window is not None:
+            block = self.blocks.get(str(timespan))
+            if block is not None and row is not None:
+                return slice_window(
+                    ChannelData.from_array(block[0][row], block[2], block[1], chan), window, chan
+                )
+            # only read the samples of the window
+            block = self.read_block(window, [number])
+            row = 0
+        elif row is None:
+            block = self.read_block(timespan, [number])
+            row = 0
+        else:
+            block = self._get_cached_block(timespan)
+        if block is None:
             return ChannelData.empty()
+        data, starttime, fs = block
+        return ChannelData.from_array(data[row], fs, starttime, chan)
+
+    def read_data_bulk(self, timespan: DateTimeRange, channels: List[Channel]) -> List[ChannelData]:
+        block = self.read_channel_block(timespan, channels)
+        if block is None:
+            return [ChannelData.empty() for _ in channels]
+        return block.channel_data()
+
+    def read_channel_block(self, timespan: DateTimeRange, channels: List[Channel]) -> Optional[ChannelBlock]:
+        """
+        Reads the data of several channels into a single ChannelBlock, or None if there is no file for
+        the timespan
+        """
+        block = self.read_block(timespan, [int(ch.station.name) for ch in channels])
+        if block is None:
+            return None
+        data, starttime, fs = block
+        return ChannelBlock(data, channels, fs, starttime)
+
+    def read_block(
+        self, timespan: DateTimeRange, channel_numbers: List[int]
+    ) -> Optional[Tuple[np.ndarray, float, float]]:
+        """
+        Reads the data of several channels at once, stitching together all the files that overlap the
+        timespan into a preallocated array. Contiguous ranges of channel numbers are read with a single
+        hyperslab selection per file. Samples that are not covered by any file are masked.
+
+        Returns:
+            A tuple of (data[nchan, nsamp], start timestamp, sampling rate), with the rows in the same order
+            as ``channel_numbers``, or None if there are no files for the timespan
+        """
+        files = self._get_files(timespan)
+        file_executor = self._get_file_executor()
+        infos = [i for i in file_executor.map(self._get_file_info, files) if i is not None]
+        start = timespan.start_datetime.timestamp()
+        end = timespan.end_datetime.timestamp()
+        infos = [i for i in infos if i.start < end and i.start + i.nsamples / self.sampling_rate > start]
+        if len(infos) == 0:
+            logger.warning(f"Could not find files for {timespan}")
+            return None
+
+        numbers = np.asarray(channel_numbers, dtype=int)
+        unique, inverse = np.unique(numbers, return_inverse=True)
+        runs = _contiguous_runs(unique)
+        nsamples = int(round((end - start) * self.sampling_rate))
+        # a single file that matches the timespan exactly is returned as is
+        if (
+            len(infos) == 1
+            and round((infos[0].start - start) * self.sampling_rate) == 0
+            and infos[0].nsamples == nsamples
+        ):
+            block = self._read_file(infos[0].filename, unique, runs, 0, infos[0].nsamples)
+            starttime = infos[0].start
+        else:
+            block = np.zeros((len(unique), nsamples), dtype=infos[0].dtype)
+            gaps = np.ones(nsamples, dtype=bool)
+
+            def read(info: _FileInfo):
+                offset = int(round((info.start - start) * self.sampling_rate))
+                first = max(0, -offset)
+                last = min(info.nsamples, nsamples - offset)
+                if first >= last:
+                    return
+                block[:, offset + first : offset + last] = self._read_file(
+                    info.filename, unique, runs, first, last
+                )
+                gaps[offset + first : offset + last] = False
+
+            list(file_executor.map(read, infos))
+            if np.any(gaps):
+                block = np.ma.MaskedArray(block, mask=np.broadcast_to(gaps, block.shape))
+            starttime = start
+        if len(unique) != len(numbers) or np.any(unique != numbers):
+            block = block[inverse]
+        return block, starttime, self.sampling_rate
+
+    def _get_file_executor(self) -> ThreadPoolExecutor:
+        with self._file_executor_lock:
+            if self._file_executor is None:
+                self._file_executor = ThreadPoolExecutor(max_workers=self.max_file_readers)
+            return self._file_executor
 
-        with h5py.File(filename, "r") as f:
-            data = f["/Acquisition/Raw[0]/RawData"][:, number]
-            starttime = f["/Acquisition/Raw[0]/RawDataTime"][0] / 1e6
-            trace = obspy.Trace(data)
-            trace.stats.network = chan.station.network
-            trace.stats.station = chan.station.name
-            trace.stats.channel = chan.type.name
-            trace.stats.sampling_rate = self.sampling_rate
-            trace.stats.starttime = starttime  # no need to fill end time: read only
-            stream = obspy.Stream([trace])
-        data = ChannelData(stream)
+    def _read_file(
+        self, filename: str, unique: np.ndarray, runs: List[Tuple[int, int]], first: int, last: int
+    ) -> np.ndarray:
+        with self._open(filename) as f:
+            dset = f[RAW_DATA]
+            data = np.empty((len(unique), last - first), dtype=dset.dtype)
+            for start, end in runs:
+                data[start:end] = dset[first:last, unique[start] : unique[end - 1] + 1].T
         return data
 
+    def _get_file_info(self, filename: str) -> Optional[_FileInfo]:
+        info = self._file_infos.get(filename, None)
+        if info is None:
+            if not self.fs.exists(filename):
+                logger.warning(f"Could not find file {filename}")
+                return None
+            with self._open(filename) as f:
+                dset = f[RAW_DATA]
+                info = _FileInfo(filename, f[RAW_DATA_TIME][0] / 1e6, dset.shape[0], dset.dtype)
+                if self.read_block_size is None:
+                    self.read_block_size = _read_block_size(dset)
+            self._file_infos[filename] = info
+        return info
+
+    @contextmanager
+    def _open(self, filename: str) -> Iterator[Any]:
+        """
+        Opens a data file as an HDF5 file, or as a zarr group if there is a reference file for it
+        """
+        refs = self._get_references(filename)
+        if refs is not None:
+            ref_fs = fsspec.filesystem(
+                "reference", fo=refs, remote_protocol=_protocol(self.fs), remote_options=self.storage_options
+            )
+            yield zarr.open_group(ref_fs.get_mapper(""), mode="r")
+        elif not _is_remote(self.path):
+            with h5py.File(filename, "r") as f:
+                yield f
+        else:
+            # HDF5 reads are small and scattered, so cache whole blocks sized to the chunks
+            block_size = self.read_block_size or MIN_READ_BLOCK_SIZE
+            with self.fs.open(filename, "rb", block_size=block_size, cache_type="blockcache") as fo:
+                with h5py.File(fo, "r") as f:
+                    yield f
+
+    def _get_references(self, filename: str) -> Optional[dict]:
+        if self.reference_dir is None:
+            return None
+        if filename not in self._references:
+            ref_file = fs_join(self.reference_dir, os.path.basename(filename) + REFERENCES_SUFFIX)
+            ref_fs = get_filesystem(ref_file, storage_options=self.storage_options)
+            refs = None
+            if ref_fs.exists(ref_file):
+                with ref_fs.open(ref_file, "r") as f:
+                    refs = json.load(f)
+            self._references[filename] = refs
+        return self._references[filename]
+
+    def generate_references(self, reference_dir: str = None, timespan: DateTimeRange = None) -> List[str]:
+        """
+        Writes a kerchunk reference file for each data file (in the timespan, if given), so later reads can
+        go straight to the chunks with range requests instead of walking the HDF5 metadata. Requires the
+        ``kerchunk`` package.
+
+        Parameters:
+            reference_dir: Directory for the reference files. Defaults to the store's ``reference_dir``
+            timespan: Optional timespan to restrict the files
+        Returns:
+            The paths of the reference files written
+        """
+        try:
+            from kerchunk.hdf import SingleHdf5ToZarr
+        except ImportError as e:
+            raise ImportError(
+                "The kerchunk package is required to generate references: pip install kerchunk"
+            ) from e
+        reference_dir = reference_dir or self.reference_dir
+        error_if(reference_dir is None, "A reference_dir is required to generate references", ValueError)
+        files = self._get_files(timespan) if timespan is not None else self._list_files()
+        ref_fs = get_filesystem(reference_dir, storage_options=self.storage_options)
+        ref_fs.makedirs(reference_dir, exist_ok=True)
+        written = []
+        for filename in files:
+            with self.fs.open(filename, "rb") as fo:
+                refs = SingleHdf5ToZarr(fo, self.fs.unstrip_protocol(filename)).translate()
+            ref_file = fs_join(reference_dir, os.path.basename(filename) + REFERENCES_SUFFIX)
+            with ref_fs.open(ref_file, "w") as f:
+                json.dump(refs, f)
+            self._references.pop(filename, None)
+            written.append(ref_file)
+        return written
+
+    def _list_files(self) -> List[str]:
+        self._ensure_array_loaded(None)
+        return [self.paths[s] for s in self._starts]
+
+    def _get_cached_block(self, timespan: DateTimeRange) -> Optional[Tuple[np.ndarray, float, float]]:
+        key = str(timespan)
+        block = self.blocks.get(key)
+        if block is not None:
+            return block
+        # only one thread reads a given block, the others wait for it
+        with self._block_locks_lock:
+            lock = self._block_locks[key]
+        with lock:
+            block = self.blocks.get(key)
+            if block is None:
+                block = self.read_block(timespan, self.channel_numbers)
+                if block is not None:
+                    self.blocks.put(key, block, block[0].nbytes)
+        with self._block_locks_lock:
+            self._block_locks.pop(key, None)
+        return block
+
     def _parse_channel(self, cha_number: int) -> Channel:
         cha_number = str(cha_number).zfill(5)
         return Channel(
@@ -139,14 +401,8 @@ class DASH5DataStore(RawDataStore):
 
     def _parse_timespan(self, filename: str) -> DateTimeRange:
         starttime = datetime.strptime(filename, self.file_naming).replace(tzinfo=timezone.utc)
-        return DateTimeRange(starttime, starttime + timedelta(minutes=1))  # assuming one minute file
-
-    def _get_filename(self, timespan: DateTimeRange) -> str:
-        filename = self.paths[timespan.start_datetime]
-        return filename
-
-    def _get_datepath(self, date: datetime) -> str:
-        return fs_join(self.path, datetime.strftime(date, self.file_naming))
+        # nominal one minute file, the actual duration is read from the file when reading the data
+        return DateTimeRange(starttime, starttime + timedelta(minutes=1))
 
     def _validate_station(self, station: Station):
         # to pass Station.valid(), otherwise no channel is returned
@@ -157,3 +413,33 @@ class DASH5DataStore(RawDataStore):
     def get_inventory(self, ts, station) -> obspy.Inventory:
         # return an empty inventory
         return obspy.Inventory()
+
+
+def _is_remote(path: str) -> bool:
+    return urlparse(path).scheme not in ["", "file"]
+
+
+def _protocol(fs: fsspec.AbstractFileSystem) -> str:
+    return fs.protocol if isinstance(fs.protocol, str) else fs.protocol[0]
+
+
+def _read_block_size(dset: h5py.Dataset) -> int:
+    """
+    Size of the blocks to read from remote files: one HDF5 chunk, or the maximum for contiguous datasets
+    """
+    if dset.chunks is None:
+        return MAX_READ_BLOCK_SIZE
+    chunk_bytes = int(np.prod(dset.chunks)) * dset.dtype.itemsize
+    return int(np.clip(chunk_bytes, MIN_READ_BLOCK_SIZE, MAX_READ_BLOCK_SIZE))
+
+
+def _contiguous_runs(numbers: np.ndarray) -> List[Tuple[int, int]]:
+    """
+    Returns the [start, end) index ranges of the runs of consecutive values in a sorted array
+    """
+    if len(numbers) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(numbers) != 1) + 1
+    starts = np.concatenate([[0], breaks])
+    ends = np.concatenate([breaks, [len(numbers)]])
+    return list(zip(starts.tolist(), ends.tolist()))
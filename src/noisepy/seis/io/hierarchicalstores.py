@@ -3,7 +3,7 @@ import threading
 from abc import ABC, abstractmethod
 from bisect import bisect
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Executor, ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
@@ -12,12 +12,14 @@ import fsspec
 import numpy as np
 from datetimerange import DateTimeRange
 
-from .datatypes import AnnotatedData, Station
-from .stores import timespan_str
-from .utils import TimeLogger, fs_join, get_filesystem, io_retry, unstack
+from .datatypes import AnnotatedData, Station, unpack_ragged
+from .stores import PRODUCTS_DIR, lag_slice, row_slice, timespan_str
+from .utils import TimeLogger, error_if, fs_join, get_filesystem, get_results, io_retry, unstack
 
 META_ATTR = "metadata"
 VERSION_ATTR = "version"
+# offsets and shapes of the arrays of the ragged layout (see AnnotatedData.pack_ragged)
+LAYOUT_ATTR = "layout"
 FAKE_STA = "FAKE_STATION"
 
 logger = logging.getLogger(__name__)
@@ -28,6 +30,9 @@ class ArrayStore(ABC):
     An interface definition for reading and writing arrays with metadata
     """
 
+    # whether read_items reads only the selected items rather than the whole array
+    partial_reads = False
+
     def __init__(self, root_dir: str, storage_options={}) -> None:
         super().__init__()
         self.root_dir = root_dir
@@ -41,6 +46,29 @@ class ArrayStore(ABC):
     def read(self, path: str) -> Optional[Tuple[np.ndarray, Dict[str, Any]]]:
         pass
 
+    def read_items(
+        self, path: str, select: Callable[[Dict[str, Any]], List[Tuple[int, Tuple]]]
+    ) -> Optional[Tuple[List[np.ndarray], Dict[str, Any]]]:
+        """
+        Reads some of the items (first axis) of an array, each sliced. ``select`` gets the metadata and returns
+        the (item, index within the item) to read, e.g. (2, (Ellipsis, slice(10, 20))). This implementation
+        reads the whole array and slices it.
+        """
+        tuple = self.read(path)
+        if not tuple:
+            return None
+        array, metadata = tuple
+        return [
+            get_item(lambda key: array[key], metadata, i, index) for i, index in select(metadata)
+        ], metadata
+
+    def read_attrs(self, path: str) -> Optional[Dict[str, Any]]:
+        """
+        Reads only the metadata stored with an array. Implementations should avoid reading the array data.
+        """
+        tuple = self.read(path)
+        return tuple[1] if tuple else None
+
     @abstractmethod
     def parse_path(path: str) -> Optional[Tuple[str, DateTimeRange]]:
         """
@@ -54,6 +82,20 @@ class ArrayStore(ABC):
         return self.root_dir
 
 
+def get_item(
+    get: Callable[[Tuple], np.ndarray], metadata: Dict[str, Any], i: int, index: Tuple
+) -> np.ndarray:
+    """
+    Reads the ``index`` of the i-th array of a packed array, in either layout. ``get`` reads a key of the
+    packed array.
+    """
+    layout = metadata.get(LAYOUT_ATTR, None)
+    if layout is None:
+        return get((i, *index))
+    offsets = layout["offsets"]
+    return get((slice(offsets[i], offsets[i + 1]),)).reshape(layout["shapes"][i])[index]
+
+
 class PairDirectoryCache:
     """
     Data structure to store the timespans for each station pair. The data is stored in a nested dictionary:
@@ -200,11 +242,18 @@ class HierarchicalStoreBase(Generic[T]):
         self,
         helper: ArrayStore,
         loader_func: Callable[[List[Tuple[np.ndarray, Dict[str, Any]]]], List[T]],
+        ragged: bool = False,
     ) -> None:
+        """
+        Args:
+            ragged: write the arrays concatenated, without NaN padding, instead of stacked. Both layouts
+                can be read regardless of this setting.
+        """
         super().__init__()
         self.helper = helper
         self.dir_cache = PairDirectoryCache()
         self.loader_func = loader_func
+        self.ragged = ragged
 
     def contains(self, src_sta: Station, rec_sta: Station, timespan: DateTimeRange) -> bool:
         src = str(src_sta)
@@ -238,9 +287,18 @@ class HierarchicalStoreBase(Generic[T]):
 
     def append(self, timespan: DateTimeRange, src: Station, rec: Station, data: List[T]):
         path = self._get_path(src, rec, timespan)
-        packed_data, metadata = AnnotatedData.pack(data)
         tlog = TimeLogger(logger=logger, level=logging.DEBUG, prefix="APPEND")
-        self.helper.append(path, {META_ATTR: metadata, VERSION_ATTR: 1.0}, packed_data)
+        if self.ragged:
+            packed_data, offsets, shapes, metadata = AnnotatedData.pack_ragged(data)
+            attrs = {
+                META_ATTR: metadata,
+                VERSION_ATTR: 1.0,
+                LAYOUT_ATTR: {"offsets": offsets, "shapes": shapes},
+            }
+        else:
+            packed_data, metadata = AnnotatedData.pack(data)
+            attrs = {META_ATTR: metadata, VERSION_ATTR: 1.0}
+        self.helper.append(path, attrs, packed_data)
         tlog.log(f"writing {len(data)} arrays to {path}")
         self.dir_cache.add(str(src), str(rec), [timespan])
 
@@ -267,16 +325,190 @@ class HierarchicalStoreBase(Generic[T]):
         pairs = [(Station.parse(Path(p).parts[-2]), Station.parse(Path(p).parts[-1])) for p in sub_ls]
         return [p for p in pairs if p[0] and p[1]]
 
-    def read(self, timespan: DateTimeRange, src: Station, rec: Station) -> List[T]:
+    def read(
+        self,
+        timespan: DateTimeRange,
+        src: Station,
+        rec: Station,
+        components: List[str] = None,
+        lag_window: Tuple[float, float] = None,
+    ) -> List[T]:
         path = self._get_path(src, rec, timespan)
+        if components is not None or lag_window is not None:
+            return self._read_selection(path, components, lag_window)
         tuple = self.helper.read(path)
         if not tuple:
             return []
         array, metadata = tuple
-        arrays = unstack(array)
+        layout = metadata.get(LAYOUT_ATTR, None)
+        arrays = (
+            unstack(array) if layout is None else unpack_ragged(array, layout["offsets"], layout["shapes"])
+        )
         meta = metadata[META_ATTR]
         tuples = list(zip(arrays, meta))
         return self.loader_func(tuples)
 
+    def read_substacks(
+        self,
+        timespan: DateTimeRange,
+        src: Station,
+        rec: Station,
+        rows: Tuple[int, int] = None,
+        window: DateTimeRange = None,
+        components: List[str] = None,
+        lag_window: Tuple[float, float] = None,
+    ) -> List[T]:
+        """
+        See ``CrossCorrelationDataStore.read_substacks``. Only for data with one row per substack.
+        """
+        path = self._get_path(src, rec, timespan)
+        return self._read_selection(path, components, lag_window, lambda p: row_slice(p, rows, window))
+
+    def _read_selection(
+        self,
+        path: str,
+        components: Optional[List[str]],
+        lag_window: Optional[Tuple[float, float]],
+        row_select: Callable[[Dict[str, Any]], Tuple[slice, Dict[str, Any]]] = None,
+    ) -> List[T]:
+        selected_meta = []
+
+        def select(metadata: Dict[str, Any]) -> List[Tuple[int, Tuple]]:
+            meta = metadata[META_ATTR]
+            items = []
+            for i, (item, m) in enumerate(zip(self._load_empty(meta), meta)):
+                if components is not None and item.get_component() not in components:
+                    continue
+                lags, params = lag_slice(item.parameters, lag_window)
+                index = (Ellipsis, lags)
+                if row_select is not None:
+                    rows, params = row_select(params)
+                    index = (rows, lags)
+                # the parameters are the last element of the metadata tuples
+                selected_meta.append((*m[:-1], params))
+                items.append((i, index))
+            return items
+
+        tuple = self.helper.read_items(path, select)
+        if not tuple:
+            return []
+        return self.loader_func(list(zip(tuple[0], selected_meta)))
+
+    def read_lazy(self, timespan: DateTimeRange, src: Station, rec: Station) -> List[T]:
+        path = self._get_path(src, rec, timespan)
+        metadata = self.helper.read_attrs(path)
+        if not metadata:
+            return []
+        meta = metadata[META_ATTR]
+        items = self._load_empty(meta)
+        # without partial reads, the first item accessed loads all the items of the file
+        shared = None if self.helper.partial_reads else _PathLoader(self, path, meta)
+        for i, (item, m) in enumerate(zip(items, meta)):
+            item.set_loader(_ItemLoader(self, path, i, m, shared))
+        return items
+
+    def materialize(self, items: List[T], executor: Executor = ThreadPoolExecutor()) -> List[T]:
+        """
+        Loads the data of lazily read instances, reading each file once for all of its instances
+        """
+        tlog = TimeLogger(logger=logger, level=logging.DEBUG, prefix="MATERIALIZE")
+        by_path = defaultdict(list)
+        others = []
+        for item in items:
+            if item.is_loaded():
+                continue
+            loader = item.get_loader()
+            if isinstance(loader, _ItemLoader) and loader.store is self:
+                by_path[loader.path].append(item)
+            else:
+                others.append(item)
+
+        def load(path: str, path_items: List[T]):
+            loaders = [item.get_loader() for item in path_items]
+            arrays = self._load_items(path, [(ld.index, ld.meta) for ld in loaders])
+            for item, array in zip(path_items, arrays):
+                item.data = array
+
+        futures = [executor.submit(load, path, path_items) for path, path_items in by_path.items()]
+        futures += [executor.submit(lambda item: item.data, item) for item in others]
+        get_results(futures, "Loading data")
+        tlog.log(f"loading {sum(map(len, by_path.values())) + len(others)} arrays from {len(by_path)} files")
+        return items
+
+    def _load_items(self, path: str, items: List[Tuple[int, Tuple]]) -> List[np.ndarray]:
+        tuple = self.helper.read_items(path, lambda _: [(i, (Ellipsis,)) for i, _ in items])
+        error_if(tuple is None, f"Could not read {path}")
+        loaded = self.loader_func([(array, m) for array, (_, m) in zip(tuple[0], items)])
+        return [item.data for item in loaded]
+
+    def read_metadata(self, timespan: DateTimeRange, src: Station, rec: Station) -> List[T]:
+        path = self._get_path(src, rec, timespan)
+        metadata = self.helper.read_attrs(path)
+        if not metadata:
+            return []
+        return self._load_empty(metadata[META_ATTR])
+
+    def _load_empty(self, meta: List[Tuple]) -> List[T]:
+        # the loaders trim NaN padding, so an empty 2D array works for both 1D and 2D data
+        empty = np.empty((0, 0), dtype=np.float32)
+        return self.loader_func([(empty, m) for m in meta])
+
+    def append_product(self, name: str, timespan: DateTimeRange, params: Dict[str, Any], data: np.ndarray):
+        """
+        Writes a derived product (e.g. a moveout stack) computed from the data of the given timespan,
+        replacing it if it already exists.
+        """
+        path = self._get_product_path(name, timespan)
+        full_path = fs_join(self.helper.get_root_dir(), path)
+        if self.helper.get_fs().exists(full_path):
+            self.helper.get_fs().rm(full_path, recursive=True)
+        self.helper.append(path, params, data)
+
+    def read_product(self, name: str, timespan: DateTimeRange) -> Optional[Tuple[np.ndarray, Dict[str, Any]]]:
+        return self.helper.read(self._get_product_path(name, timespan))
+
+    def _get_product_path(self, name: str, timespan: DateTimeRange) -> str:
+        return f"{PRODUCTS_DIR}/{name}/{timespan_str(timespan)}"
+
     def _get_path(self, src: Station, rec: Station, timespan: DateTimeRange) -> str:
         return f"{src}/{rec}/{timespan_str(timespan)}"
+
+
+class _ItemLoader:
+    """
+    Loads one item of a packed array of a HierarchicalStoreBase
+    """
+
+    def __init__(
+        self, store: HierarchicalStoreBase, path: str, index: int, meta: Tuple, shared: "_PathLoader" = None
+    ) -> None:
+        self.store = store
+        self.path = path
+        self.index = index
+        self.meta = meta
+        self.shared = shared
+
+    def __call__(self) -> np.ndarray:
+        if self.shared is not None:
+            return self.shared.get(self.index)
+        return self.store._load_items(self.path, [(self.index, self.meta)])[0]
+
+
+class _PathLoader:
+    """
+    Loads all the items of a packed array of a HierarchicalStoreBase at once, for array stores that read whole
+    files anyway (see ArrayStore.partial_reads)
+    """
+
+    def __init__(self, store: HierarchicalStoreBase, path: str, meta: List[Tuple]) -> None:
+        self.store = store
+        self.path = path
+        self.meta = meta
+        self._arrays = None
+        self._lock = threading.Lock()
+
+    def get(self, index: int) -> np.ndarray:
+        with self._lock:
+            if self._arrays is None:
+                self._arrays = self.store._load_items(self.path, list(enumerate(self.meta)))
+        return self._arrays[index]
@@ -0,0 +1,190 @@
+import logging
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from datetimerange import DateTimeRange
+
+from .datatypes import Stack, Station, to_json_types
+from .stores import StackStore
+from .utils import TimeLogger, bandpass_2d
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MoveoutStack:
+    """
+    Distance-binned average of the (band-pass filtered) stacks of all the station pairs, for one component,
+    stack method and filter band.
+
+    Attributes:
+        distances: center of each non-empty distance bin (km)
+        counts: number of station pairs averaged in each bin
+        data: (nbin, nlag) average stack of each bin, over the full lag range
+    """
+
+    component: str
+    stack_name: str
+    freqmin: float
+    freqmax: float
+    dist_inc: float
+    dt: float
+    maxlag: float
+    distances: np.ndarray
+    counts: np.ndarray
+    data: np.ndarray
+
+    def product_name(component: str, stack_name: str, freqmin: float, freqmax: float, dist_inc: float) -> str:
+        return f"moveout_{stack_name}_{component}_{freqmin:g}-{freqmax:g}Hz_{dist_inc:g}km"
+
+    def get_name(self) -> str:
+        return MoveoutStack.product_name(
+            self.component, self.stack_name, self.freqmin, self.freqmax, self.dist_inc
+        )
+
+    def get_parameters(self) -> Dict[str, Any]:
+        return to_json_types(
+            {
+                "component": self.component,
+                "stack_name": self.stack_name,
+                "freqmin": self.freqmin,
+                "freqmax": self.freqmax,
+                "dist_inc": self.dist_inc,
+                "dt": self.dt,
+                "maxlag": self.maxlag,
+                "distances": self.distances,
+                "counts": self.counts,
+            }
+        )
+
+    def from_product(data: np.ndarray, params: Dict[str, Any]) -> "MoveoutStack":
+        return MoveoutStack(
+            params["component"],
+            params["stack_name"],
+            params["freqmin"],
+            params["freqmax"],
+            params["dist_inc"],
+            params["dt"],
+            params["maxlag"],
+            np.array(params["distances"], dtype=np.float32),
+            np.array(params["counts"], dtype=np.int64),
+            data,
+        )
+
+
+def compute_moveout(
+    sta_stacks: List[Tuple[Tuple[Station, Station], List[Stack]]],
+    stack_name: str,
+    component: str,
+    freqmin: float,
+    freqmax: float,
+    dist_inc: float,
+) -> Optional[MoveoutStack]:
+    """
+    Filters the stacks of all the pairs at once and averages them in distance bins of ``dist_inc`` km
+
+    Args:
+        sta_stacks: stacks of all the station pairs, e.g. as returned by StackStore.read_bulk
+        stack_name: e.g. 'Allstack_linear'
+        component: cross component, e.g. 'ZZ'
+        freqmin, freqmax: band-pass filter corners
+        dist_inc: width of the distance bins (km)
+    """
+    dist = []
+    rows = []
+    params = None
+    for (src, rec), stacks in sta_stacks:
+        stacks = [st for st in stacks if st.name == stack_name and st.component == component]
+        if len(stacks) == 0:
+            logger.warning(f"No data available for {src}_{rec}/{stack_name}/{component}")
+            continue
+        if len(stacks[0].parameters) == 0 or stacks[0].data.size == 0:
+            continue
+        params = params or stacks[0].parameters
+        dist.append(stacks[0].parameters["dist"])
+        rows.append(stacks[0].data)
+    if len(rows) == 0:
+        logger.error(f"No data available for {stack_name}/{component}")
+        return None
+
+    dt, maxlag = (params[p] for p in ["dt", "maxlag"])
+    dist = np.array(dist, dtype=np.float32)
+    data = bandpass_2d(np.stack(rows), freqmin, freqmax, int(1 / dt))
+
+    # the last bin is dropped, as it has always been when plotting the moveout
+    nbins = max(int(np.round(np.max(dist) + 0.51) / dist_inc) - 1, 0)
+    bins = np.floor(dist / dist_inc).astype(np.int64)
+    keep = bins < nbins
+    sums = np.zeros((nbins, data.shape[1]), dtype=np.float64)
+    np.add.at(sums, bins[keep], data[keep])
+    counts = np.bincount(bins[keep], minlength=nbins)
+    nonempty = np.flatnonzero(counts)
+    return MoveoutStack(
+        component,
+        stack_name,
+        freqmin,
+        freqmax,
+        dist_inc,
+        dt,
+        maxlag,
+        ((nonempty + 0.5) * dist_inc).astype(np.float32),
+        counts[nonempty],
+        (sums[nonempty] / counts[nonempty, None]).astype(np.float32),
+    )
+
+
+def compute_moveout_products(
+    stack_store: StackStore,
+    timespan: DateTimeRange,
+    stack_names: List[str],
+    components: List[str],
+    bands: List[Tuple[float, float]],
+    dist_inc: float,
+    pairs: List[Tuple[Station, Station]] = None,
+    executor: Executor = ThreadPoolExecutor(),
+) -> List[MoveoutStack]:
+    """
+    Reads the stacks of all the pairs once, then computes and persists in the store the moveout of every
+    (stack name, component, filter band) combination, so they can be plotted without reading the stacks again.
+    """
+    tlog = TimeLogger(logger=logger, level=logging.INFO, prefix="MOVEOUT")
+    if pairs is None:
+        pairs = stack_store.get_station_pairs()
+    sta_stacks = stack_store.read_bulk(timespan, pairs, executor, components)
+    tlog.log(f"reading {len(pairs)} pairs")
+    moveouts = []
+    for stack_name in stack_names:
+        for component in components:
+            for freqmin, freqmax in bands:
+                moveout = compute_moveout(sta_stacks, stack_name, component, freqmin, freqmax, dist_inc)
+                if moveout is None:
+                    continue
+                write_moveout(stack_store, timespan, moveout)
+                moveouts.append(moveout)
+    tlog.log(f"computing {len(moveouts)} moveout stacks")
+    return moveouts
+
+
+def write_moveout(stack_store: StackStore, timespan: DateTimeRange, moveout: MoveoutStack):
+    stack_store.append_product(moveout.get_name(), timespan, moveout.get_parameters(), moveout.data)
+
+
+def read_moveout(
+    stack_store: StackStore,
+    timespan: DateTimeRange,
+    stack_name: str,
+    component: str,
+    freqmin: float,
+    freqmax: float,
+    dist_inc: float,
+) -> Optional[MoveoutStack]:
+    """
+    Reads a moveout stack persisted by ``compute_moveout_products``, or None if it hasn't been computed
+    """
+    name = MoveoutStack.product_name(component, stack_name, freqmin, freqmax, dist_inc)
+    product = stack_store.read_product(name, timespan)
+    if product is None:
+        return None
+    return MoveoutStack.from_product(*product)
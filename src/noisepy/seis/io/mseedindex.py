@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import io
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+import fsspec
+import numpy as np
+from datetimerange import DateTimeRange
+from obspy.io.mseed.util import get_record_information
+
+from .datatypes import ChannelData
+from .stores import read_mseed
+from .utils import TimeLogger, file_version, get_filesystem, iter_timespans
+
+logger = logging.getLogger(__name__)
+
+INDEX_SUFFIX = ".idx.npz"
+
+
+@dataclass
+class RecordIndex:
+    """
+    Header-only index of the records of a miniSEED file
+
+    Attributes:
+        offsets: byte offset of each record
+        lengths: length in bytes of each record
+        starts: timestamp of the first sample of each record
+        ends: timestamp right after the last sample of each record
+        npts: number of samples in each record
+        sampling_rates: sampling rate of each record
+        version: version of the file the index was built from (see ``utils.file_version``)
+    """
+
+    offsets: np.ndarray
+    lengths: np.ndarray
+    starts: np.ndarray
+    ends: np.ndarray
+    npts: np.ndarray
+    sampling_rates: np.ndarray
+    version: str = ""
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def build(file: BinaryIO, version: str = "") -> RecordIndex:
+        """
+        Scans the headers of all the records in a miniSEED file, without decoding their data
+        """
+        file.seek(0, os.SEEK_END)
+        size = file.tell()
+        records = []
+        offset = 0
+        while offset < size:
+            # get_record_information reads the record at the current position (plus its offset argument)
+            file.seek(offset)
+            info = get_record_information(file)
+            npts = info["npts"]
+            rate = info["samp_rate"]
+            start = info["starttime"].timestamp
+            end = info["endtime"].timestamp + (1.0 / rate if rate > 0 else 0.0)
+            records.append((offset, info["record_length"], start, end, npts, rate))
+            offset += info["record_length"]
+        cols = list(zip(*records)) if len(records) > 0 else [[]] * 6
+        return RecordIndex(
+            np.array(cols[0], dtype=np.int64),
+            np.array(cols[1], dtype=np.int64),
+            np.array(cols[2], dtype=np.float64),
+            np.array(cols[3], dtype=np.float64),
+            np.array(cols[4], dtype=np.int64),
+            np.array(cols[5], dtype=np.float64),
+            version,
+        )
+
+    def select(self, window: DateTimeRange) -> np.ndarray:
+        """
+        Returns a boolean mask of the records that overlap the [start, end) window
+        """
+        return (self.starts < window.end_datetime.timestamp()) & (
+            self.ends > window.start_datetime.timestamp()
+        )
+
+    def byte_ranges(self, window: DateTimeRange) -> List[Tuple[int, int]]:
+        """
+        Returns the [start, end) byte ranges of the records that overlap the window, merging adjacent records
+        """
+        mask = self.select(window)
+        ranges = []
+        for offset, length in zip(self.offsets[mask].tolist(), self.lengths[mask].tolist()):
+            if len(ranges) > 0 and ranges[-1][1] == offset:
+                ranges[-1] = (ranges[-1][0], offset + length)
+            else:
+                ranges.append((offset, offset + length))
+        return ranges
+
+    def gaps(self, tolerance: float = 0.5) -> List[Tuple[float, float]]:
+        """
+        Returns the (end, start) timestamps around the gaps between consecutive records. A gap is a jump
+        of more than ``tolerance`` samples.
+        """
+        if len(self) < 2:
+            return []
+        order = np.argsort(self.starts, kind="stable")
+        starts = self.starts[order]
+        ends = self.ends[order]
+        delta = 1.0 / self.sampling_rates[order][:-1]
+        idx = np.flatnonzero(np.abs(starts[1:] - ends[:-1]) > tolerance * delta)
+        return [(ends[i], starts[i + 1]) for i in idx.tolist()]
+
+    def save(self, file: BinaryIO):
+        np.savez(
+            file,
+            offsets=self.offsets,
+            lengths=self.lengths,
+            starts=self.starts,
+            ends=self.ends,
+            npts=self.npts,
+            sampling_rates=self.sampling_rates,
+            version=np.array(self.version),
+        )
+
+    def load(file: BinaryIO) -> RecordIndex:
+        with np.load(file) as npz:
+            return RecordIndex(
+                npz["offsets"],
+                npz["lengths"],
+                npz["starts"],
+                npz["ends"],
+                npz["npts"],
+                npz["sampling_rates"],
+                str(npz["version"]),
+            )
+
+
+class MiniSeedIndex:
+    """
+    Builds, persists and caches the ``RecordIndex`` of miniSEED files, and uses them to read only the
+    byte ranges of the records that overlap a time window. This is the same approach the PNW store takes
+    with its tsindex database, for stores that don't have one.
+
+    Index files are written in ``index_dir`` or, if it's not given, next to local data files as hidden
+    files (.<file name>.idx.npz). Indexes of remote files without an ``index_dir`` are only kept in memory.
+    A persisted index is rebuilt when the size or modification time (or ETag) of its data file changes.
+    """
+
+    def __init__(self, fs: fsspec.AbstractFileSystem, index_dir: str = None, storage_options: dict = {}):
+        self.fs = fs
+        self.index_dir = index_dir
+        self.index_fs = get_filesystem(index_dir, storage_options=storage_options) if index_dir else None
+        self.indexes: Dict[str, RecordIndex] = {}
+        self._lock = threading.Lock()
+
+    def get(self, filename: str) -> RecordIndex:
+        index = self.indexes.get(filename, None)
+        if index is not None:
+            return index
+        version = file_version(self.fs.info(filename))
+        index_file, index_fs = self._index_file(filename)
+        if index_file is not None and index_fs.exists(index_file):
+            try:
+                with index_fs.open(index_file, "rb") as f:
+                    index = RecordIndex.load(f)
+            except Exception as e:
+                logger.warning(f"Could not load the record index {index_file}: {e}")
+            if index is not None and index.version != version:
+                index = None
+        if index is None:
+            tlog = TimeLogger(logger=logger, level=logging.DEBUG, prefix="MSEED INDEX")
+            with self.fs.open(filename, "rb") as f:
+                index = RecordIndex.build(f, version)
+            tlog.log(f"indexing {len(index)} records of {filename}")
+            if index_file is not None:
+                self._save(index, index_file, index_fs)
+        with self._lock:
+            self.indexes[filename] = index
+        return index
+
+    def read_bytes(self, filename: str, window: DateTimeRange) -> bytes:
+        """
+        Reads only the records of the file that overlap the window
+        """
+        ranges = self.get(filename).byte_ranges(window)
+        return b"".join(self.fs.cat_file(filename, start, end) for start, end in ranges)
+
+    def read_data(self, filename: str, window: DateTimeRange) -> ChannelData:
+        """
+        Reads and decodes only the records of the file that overlap the window
+        """
+        buffer = self.read_bytes(filename, window)
+        if len(buffer) == 0:
+            return ChannelData.empty()
+        stream = read_mseed(io.BytesIO(buffer), window)
+        if len(stream) == 0:
+            return ChannelData.empty()
+        return ChannelData(stream)
+
+    def iter_windows(
+        self, filename: str, timespan: DateTimeRange, length: float, step: float = None
+    ) -> Iterator[ChannelData]:
+        """
+        Yields the data of consecutive windows, fetching only the records of each window.
+        See ``RawDataStore.iter_windows``.
+        """
+        for window in iter_timespans(timespan, timedelta(seconds=step or length), timedelta(seconds=length)):
+            data = self.read_data(filename, window)
+            if len(data.data) > 0:
+                yield data
+
+    def _index_file(self, filename: str) -> Tuple[Optional[str], Optional[fsspec.AbstractFileSystem]]:
+        if self.index_fs is not None:
+            # flatten the data path into a single file name
+            name = self.fs._strip_protocol(filename).strip("/").replace("/", "_")
+            return self.index_fs.sep.join([self.index_dir.rstrip("/"), name + INDEX_SUFFIX]), self.index_fs
+        protocols = (self.fs.protocol,) if isinstance(self.fs.protocol, str) else self.fs.protocol
+        if "file" in protocols:
+            return (
+                os.path.join(os.path.dirname(filename), "." + os.path.basename(filename) + INDEX_SUFFIX),
+                self.fs,
+            )
+        return None, None
+
+    def _save(self, index: RecordIndex, index_file: str, index_fs: fsspec.AbstractFileSystem):
+        try:
+            index_fs.makedirs(os.path.dirname(index_file), exist_ok=True)
+            with index_fs.open(index_file, "wb") as f:
+                index.save(f)
+        except Exception as e:
+            logger.warning(f"Could not save the record index {index_file}: {e}")
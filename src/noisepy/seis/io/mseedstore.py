@@ -2,15 +2,17 @@ import glob
 import logging
 import os
 from datetime import datetime, timedelta, timezone
-from typing import Callable, List
+from typing import Callable, Iterator, List, Tuple
 
 import obspy
 from datetimerange import DateTimeRange
 from tqdm.autonotebook import tqdm
 
+from .channel_filter_store import name_mask
 from .channelcatalog import ChannelCatalog
 from .datatypes import Channel, ChannelData, ChannelType, Station
-from .stores import RawDataStore
+from .mseedindex import MiniSeedIndex, RecordIndex
+from .stores import RawDataStore, iter_mseed_windows, read_mseed
 from .utils import fs_join, get_filesystem
 
 logger = logging.getLogger(__name__)
@@ -50,6 +52,8 @@ class MiniSeedDataStore(RawDataStore):
         chan_catalog: ChannelCatalog,
         chan_filter: Callable[[Channel], bool] = None,
         date_range: DateTimeRange = None,
+        use_index: bool = False,
+        index_dir: str = None,
     ):
         """
         Parameters:
@@ -58,9 +62,13 @@ class MiniSeedDataStore(RawDataStore):
             chan_filter: Optional function to decide whether a channel should be used or not,
                             if None, all channels are used
             date_range: Optional date range to filter the data
+            use_index: Whether windowed reads should use a header-only record index of the files to only
+                       read the records in the window (see ``MiniSeedIndex``)
+            index_dir: Optional directory to persist the record indexes, instead of next to the files
         """
         super().__init__()
         self.fs = get_filesystem(path)
+        self.index = MiniSeedIndex(self.fs, index_dir) if use_index else None
         self.chan_catalog = chan_catalog
         self.path = os.path.abspath(path)
         self.paths = {}
@@ -79,15 +87,20 @@ class MiniSeedDataStore(RawDataStore):
         year, doy = full_path.split(os.path.sep)[-2:]
         doy = doy[-3:]
 
-        for i in glob.glob(fs_join(full_path, "*")):
-            basename = os.path.basename(i)
-            if basename.startswith("."):
-                continue
-            timespan = MiniSeedDataStore._parse_timespan(int(year), int(doy))
-            key = str(timespan)
+        timespan = MiniSeedDataStore._parse_timespan(int(year), int(doy))
+        key = str(timespan)
+        basenames = [os.path.basename(i) for i in glob.glob(fs_join(full_path, "*"))]
+        basenames = [b for b in basenames if not b.startswith(".")]
+        if len(basenames) > 0:
             self.paths[timespan.start_datetime] = full_path
-            channel = MiniSeedDataStore._parse_channel(basename)
-            if not chan_filter(channel):
+        names = [MiniSeedDataStore._parse_names(b) for b in basenames]
+        # filter on the names before creating any Channel objects
+        mask = name_mask(chan_filter, names)
+        for i, n in enumerate(names):
+            if mask is not None and not mask[i]:
+                continue
+            channel = MiniSeedDataStore._create_channel(*n)
+            if mask is None and not chan_filter(channel):
                 continue
             if key not in self.channels:
                 self.channels[key] = [channel]
@@ -111,16 +124,38 @@ class MiniSeedDataStore(RawDataStore):
 
     def get_channels(self, timespan: DateTimeRange) -> List[Channel]:
         tmp_channels = self.channels.get(str(timespan), [])
-        return list(map(lambda c: self.chan_catalog.get_full_channel(timespan, c), tmp_channels))
+        return self.chan_catalog.get_full_channels(timespan, tmp_channels)
 
     def get_timespans(self) -> List[DateTimeRange]:
         return list([DateTimeRange.from_range_text(d) for d in sorted(self.channels.keys())])
 
-    def read_data(self, timespan: DateTimeRange, chan: Channel) -> ChannelData:
+    def read_data(self, timespan: DateTimeRange, chan: Channel, window: DateTimeRange = None) -> ChannelData:
         filename = fs_join(self.paths[timespan.start_datetime], self.get_filename(timespan, chan))
-        stream = obspy.read(filename)
+        if window is not None and self.index is not None:
+            return self.index.read_data(filename, window)
+        stream = read_mseed(filename, window)
+        if len(stream) == 0:
+            return ChannelData.empty()
         return ChannelData(stream)
 
+    def iter_windows(
+        self, timespan: DateTimeRange, chan: Channel, length: float, step: float = None
+    ) -> Iterator[ChannelData]:
+        filename = fs_join(self.paths[timespan.start_datetime], self.get_filename(timespan, chan))
+        if self.index is not None:
+            yield from self.index.iter_windows(filename, timespan, length, step)
+            return
+        with open(filename, "rb") as f:
+            buffer = f.read()
+        yield from iter_mseed_windows(buffer, timespan, length, step)
+
+    def get_record_index(self, timespan: DateTimeRange, chan: Channel) -> RecordIndex:
+        """
+        Returns the header-only record index of a channel's file, e.g. to find gaps without decoding the data
+        """
+        index = self.index or MiniSeedIndex(self.fs)
+        return index.get(fs_join(self.paths[timespan.start_datetime], self.get_filename(timespan, chan)))
+
     def get_inventory(self, timespan: DateTimeRange, station: Station) -> obspy.Inventory:
         return self.chan_catalog.get_inventory(timespan, station)
 
@@ -129,10 +164,16 @@ class MiniSeedDataStore(RawDataStore):
         return DateTimeRange(jan1 + timedelta(days=doy - 1), jan1 + timedelta(days=doy))
 
     def _parse_channel(filename: str) -> Channel:
+        return MiniSeedDataStore._create_channel(*MiniSeedDataStore._parse_names(filename))
+
+    def _parse_names(filename: str) -> Tuple[str, str, str, str]:
         network = filename[:2]
         station = filename[2:7].rstrip("_")
         channel = filename[7:10]
         location = filename[10:12].strip("_")
+        return network, station, channel, location
+
+    def _create_channel(network: str, station: str, channel: str, location: str) -> Channel:
         return Channel(
             ChannelType(channel, location),
             # lat/lon/elev will be populated later
@@ -51,8 +51,9 @@ class NumpyArrayStore(ArrayStore):
                     with io.BytesIO() as jsf:
                         jsf.write(js.encode("utf-8"))
 
-                        add_file_bytes(tar, FILE_ARRAY_NPY, npyf)
+                        # params first, so they can be read without decompressing the array
                         add_file_bytes(tar, FILE_PARAMS_JSON, jsf)
+                        add_file_bytes(tar, FILE_ARRAY_NPY, npyf)
 
     def parse_path(self, path: str) -> Optional[Tuple[str, DateTimeRange]]:
         if not path.endswith(TAR_GZ_EXTENSION):
@@ -88,16 +89,37 @@ class NumpyArrayStore(ArrayStore):
             logger.error(f"Error reading {file}: {e}")
             return None
 
+    def read_attrs(self, path: str) -> Optional[Dict[str, Any]]:
+        file = fs_join(self.root_path, path + TAR_GZ_EXTENSION)
+        if not self.get_fs().exists(file):
+            return None
+
+        try:
+            with self.get_fs().open(file, "rb") as f:
+                # stream the members and stop at the params, which are stored first in newer files
+                with tarfile.open(fileobj=f, mode="r|gz") as tar:
+                    for member in tar:
+                        if member.name == FILE_PARAMS_JSON:
+                            with tar.extractfile(member) as f:
+                                return json.load(f)
+            logger.error(f"Missing {FILE_PARAMS_JSON} in {file}")
+            return None
+        except Exception as e:
+            logger.error(f"Error reading {file}: {e}")
+            return None
+
 
 class NumpyStackStore(HierarchicalStoreBase[Stack], StackStore):
-    def __init__(self, root_dir: str, mode: str = "a", storage_options={}):
+    def __init__(self, root_dir: str, mode: str = "a", storage_options={}, ragged: bool = False):
         super().__init__(
-            NumpyArrayStore(root_dir, mode, storage_options=storage_options), Stack.load_instances
+            NumpyArrayStore(root_dir, mode, storage_options=storage_options), Stack.load_instances, ragged
         )
 
 
 class NumpyCCStore(HierarchicalStoreBase[CrossCorrelation], CrossCorrelationDataStore):
-    def __init__(self, root_dir: str, mode: str = "a", storage_options={}):
+    def __init__(self, root_dir: str, mode: str = "a", storage_options={}, ragged: bool = False):
         super().__init__(
-            NumpyArrayStore(root_dir, mode, storage_options=storage_options), CrossCorrelation.load_instances
+            NumpyArrayStore(root_dir, mode, storage_options=storage_options),
+            CrossCorrelation.load_instances,
+            ragged,
         )
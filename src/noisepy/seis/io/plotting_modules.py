@@ -1,6 +1,7 @@
 import logging
 import os
-from typing import List, Tuple
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -8,15 +9,25 @@ import obspy
 import pyasdf
 import scipy
 from datetimerange import DateTimeRange
-from obspy.signal.filter import bandpass
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
 from scipy.fftpack import next_fast_len
 
 from .datatypes import Stack, Station
-from .stores import CrossCorrelationDataStore, RawDataStore
+from .moveout import MoveoutStack, compute_moveout, compute_moveout_products, read_moveout
+from .stores import LAG_WINDOW_PARAM, CrossCorrelationDataStore, RawDataStore, StackStore, lag_slice
+from .utils import bandpass_2d, error_if, get_results, normalize_rows
 
 logging.getLogger("matplotlib.font_manager").disabled = True
 logger = logging.getLogger(__name__)
 
+# resolution of the saved figures for each supported format
+FIGURE_DPI = {"pdf": 400, "png": 72}
+# number of station pairs read at once through the stores' read_bulk
+BULK_READ_SIZE = 64
+SUBSTACK_CC_FIGSIZE = (10, 6)
+MOVEOUT_9COMP = ["ZR", "ZT", "ZZ", "RR", "RT", "RZ", "TR", "TT", "TZ"]
+
 """
 Ensembles of plotting functions to display intermediate/final waveforms from the NoisePy package.
 by Chengxin Jiang @Harvard (May.04.2019)
@@ -26,6 +37,9 @@ Specifically, this plotting module includes functions of:
     2) plot_substack_cc  -> plot 2D matrix of the CC functions for one time-chunk (e.g., 2 days)
     3) plot_substack_all -> plot 2D matrix of the CC functions for all time-chunk (e.g., every 1 day in 1 year)
     4) plot_all_moveout  -> plot the moveout of the stacked CC functions for all time-chunk
+
+The *_store variants of the functions that take ASDF file paths read from a CrossCorrelationDataStore or
+StackStore instead, so they work with any store (Zarr, Numpy, S3, ...).
 """
 
 
@@ -76,7 +90,7 @@ def plot_waveform(
         npts = tr[0].stats.npts
         tt = np.arange(0, npts) * dt
         data = tr[0].data
-        data = bandpass(data, freqmin, freqmax, int(1 / dt), corners=4, zerophase=True)
+        data = bandpass_2d(data, freqmin, freqmax, int(1 / dt))
         plt.figure(figsize=(9, 3))
         plt.plot(tt, data, "k-", linewidth=1)
         plt.title(
@@ -102,7 +116,7 @@ def plot_waveform(
         data = np.zeros(shape=(number_of_channels, npts), dtype=np.float32)
         for ii in range(number_of_channels):
             data[ii] = raw_data_store.read_data(ts, channels[ii]).stream[0].data
-            data[ii] = bandpass(data[ii], freqmin, freqmax, int(1 / dt), corners=4, zerophase=True)
+        data[:] = bandpass_2d(data, freqmin, freqmax, int(1 / dt))
         plt.figure(figsize=(9, 6))
         plt.subplot(311)
         plt.plot(tt, data[0], "k-", linewidth=1)
@@ -142,6 +156,10 @@ def plot_substack_cc(
     disp_lag=None,
     savefig=True,
     sdir="./",
+    fmt: str = "pdf",
+    multipage: bool = False,
+    executor: Executor = ThreadPoolExecutor(),
+    render_executor: Executor = None,
 ):
     """
     display the 2D matrix of the cross-correlation functions for a certain time-chunk.
@@ -153,8 +171,12 @@ def plot_substack_cc(
     freqmin: min frequency to be filtered
     freqmax: max frequency to be filtered
     disp_lag: time ranges for display
-    savefig: Whether to save the figures as a PDF on disk
+    savefig: Whether to save the figures on disk
     sdir: Save directory
+    fmt: 'pdf' or 'png' (low resolution thumbnails)
+    multipage: Save all the figures as the pages of a single substack_cc.pdf
+    executor: Executor used to read the station pairs concurrently
+    render_executor: Optional executor (e.g. a ProcessPoolExecutor) to render the saved figures in parallel
 
     Note: IMPORTANT!!!! this script only works for cross-correlation with sub-stacks being set to True in S1.
     """
@@ -168,7 +190,7 @@ def plot_substack_cc(
         logger.error("No data available for plotting")
         return
 
-    ccs = cc_store.read(ts, sta_pairs[0][0], sta_pairs[0][1])
+    ccs = cc_store.read_metadata(ts, sta_pairs[0][0], sta_pairs[0][1])
     if len(ccs) == 0:
         logger.error(f"No data available for plotting in {ts}/{sta_pairs[0]}")
         return
@@ -181,87 +203,94 @@ def plot_substack_cc(
     if not substack_flag:
         raise ValueError("seems no substacks have been done! not suitable for this plotting function")
 
-    # lags for display
-    if not disp_lag:
-        disp_lag = maxlag
-    if disp_lag > maxlag:
-        raise ValueError("lag exceeds maxlag!")
+    # lags for display, only these are read from the store
+    lag_window = _lag_window(disp_lag)
+    disp_lag, _, _ = _lag_indices(disp_lag, maxlag, dt)
 
     # t is the time labels for plotting
     t = np.arange(-int(disp_lag), int(disp_lag) + dt, step=int(2 * int(disp_lag) / 4))
-    # windowing the data
-    indx1 = int((maxlag - disp_lag) / dt)
-    indx2 = indx1 + 2 * int(disp_lag / dt) + 1
-
-    # for spair in spairs:
-    for src_sta, rec_sta in sta_pairs:
-        ccs = cc_store.read(ts, src_sta, rec_sta)
-        for cc in ccs:
-            src_cha, rec_cha, params, all_data = cc.src, cc.rec, cc.parameters, cc.data
-            try:
-                dist, ngood, ttime = (params[p] for p in ["dist", "ngood", "time"])
-                timestamp = np.empty(len(ttime), dtype="datetime64[s]")
-            except Exception as e:
-                logger.warning(f"continue! something wrong with {src_sta}_{rec_sta}/{src_cha}_{rec_cha}: {e}")
-                continue
-
-            # cc matrix
-            data = all_data[:, indx1:indx2]
-            nwin = data.shape[0]
-            amax = np.zeros(nwin, dtype=np.float32)
-            if nwin == 0 or len(ngood) == 1:
-                print("continue! no enough substacks!")
-                continue
-
-            tmarks = []
-            # load cc for each station-pair
-            for ii in range(nwin):
-                data[ii] = bandpass(data[ii], freqmin, freqmax, int(1 / dt), corners=4, zerophase=True)
-                amax[ii] = max(data[ii])
-                data[ii] /= amax[ii]
-                timestamp[ii] = obspy.UTCDateTime(ttime[ii])
-                tmarks.append(obspy.UTCDateTime(ttime[ii]).strftime("%H:%M:%S"))
-
-            # plotting
-            if nwin > 10:
-                tick_inc = int(nwin / 5)
-            else:
-                tick_inc = 2
-            fig, (
-                ax1,
-                ax2,
-            ) = plt.subplots(2, 1, gridspec_kw={"height_ratios": [1, 3]}, figsize=(10, 6))
-            ax1.matshow(
-                data,
-                cmap="seismic",
-                extent=[-disp_lag, disp_lag, nwin, 0],
-                aspect="auto",
-            )
-            ax1.set_title(f"{src_sta}.{src_cha} {rec_sta}.{rec_cha}  dist:{dist:5.2f}km")
-            ax1.set_xlabel("time [s]")
-            ax1.set_xticks(t)
-            ax1.set_yticks(np.arange(0, nwin, step=tick_inc))
-            ax1.set_yticklabels(timestamp[0::tick_inc])
-            ax1.xaxis.set_ticks_position("bottom")
-            ax2.set_title("stacked and filtered at %4.2f-%4.2f Hz" % (freqmin, freqmax))
-            ax2.plot(
-                np.arange(-disp_lag, disp_lag + dt, dt),
-                np.mean(data, axis=0),
-                "k-",
-                linewidth=1,
-            )
-            ax2.set_xticks(t)
-            fig.tight_layout()
 
-            # save figure or just show
-            if savefig:
-                if not os.path.isdir(sdir):
-                    os.mkdir(sdir)
-                outfname = os.path.join(sdir, f"{src_sta}.{src_cha}_{rec_sta}.{rec_cha}.pdf")
-                fig.savefig(outfname, format="pdf", dpi=400)
-                plt.close()
-            else:
-                plt.show()
+    # read the pairs in batches through the store's bulk reader and render their figures as they are ready
+    saver = _FigureSaver(sdir, fmt, multipage, "substack_cc", render_executor) if savefig else None
+    for ibatch in range(0, len(sta_pairs), BULK_READ_SIZE):
+        for (src_sta, rec_sta), ccs in cc_store.read_bulk(
+            ts, sta_pairs[ibatch : ibatch + BULK_READ_SIZE], executor, lag_window=lag_window
+        ):
+            for cc in ccs:
+                src_cha, rec_cha, params, all_data = cc.src, cc.rec, cc.parameters, cc.data
+                try:
+                    dist, ngood, ttime = (params[p] for p in ["dist", "ngood", "time"])
+                except Exception as e:
+                    logger.warning(
+                        f"continue! something wrong with {src_sta}_{rec_sta}/{src_cha}_{rec_cha}: {e}"
+                    )
+                    continue
+
+                # cc matrix
+                _, indx1, indx2 = _data_lag_indices(params, disp_lag)
+                data = all_data[:, indx1:indx2]
+                nwin = data.shape[0]
+                if nwin == 0 or len(ngood) == 1:
+                    print("continue! no enough substacks!")
+                    continue
+
+                # filter and normalize all the substacks at once
+                data = normalize_rows(bandpass_2d(data, freqmin, freqmax, int(1 / dt)), absolute=False)
+                timestamp = np.array(
+                    [obspy.UTCDateTime(tt).datetime for tt in ttime[:nwin]], dtype="datetime64[s]"
+                )
+                kwargs = dict(
+                    data=data,
+                    timestamp=timestamp,
+                    title=f"{src_sta}.{src_cha} {rec_sta}.{rec_cha}  dist:{dist:5.2f}km",
+                    disp_lag=disp_lag,
+                    dt=dt,
+                    t=t,
+                    freqmin=freqmin,
+                    freqmax=freqmax,
+                )
+                if saver is not None:
+                    saver.save(
+                        _draw_substack_cc,
+                        kwargs,
+                        f"{src_sta}.{src_cha}_{rec_sta}.{rec_cha}",
+                        SUBSTACK_CC_FIGSIZE,
+                    )
+                else:
+                    _draw_substack_cc(plt.figure(figsize=SUBSTACK_CC_FIGSIZE), **kwargs)
+                    plt.show()
+    if saver is not None:
+        saver.close()
+
+
+def _draw_substack_cc(fig, data, timestamp, title, disp_lag, dt, t, freqmin, freqmax):
+    nwin = data.shape[0]
+    if nwin > 10:
+        tick_inc = int(nwin / 5)
+    else:
+        tick_inc = 2
+    ax1, ax2 = fig.subplots(2, 1, gridspec_kw={"height_ratios": [1, 3]})
+    ax1.matshow(
+        data,
+        cmap="seismic",
+        extent=[-disp_lag, disp_lag, nwin, 0],
+        aspect="auto",
+    )
+    ax1.set_title(title)
+    ax1.set_xlabel("time [s]")
+    ax1.set_xticks(t)
+    ax1.set_yticks(np.arange(0, nwin, step=tick_inc))
+    ax1.set_yticklabels(timestamp[0::tick_inc])
+    ax1.xaxis.set_ticks_position("bottom")
+    ax2.set_title("stacked and filtered at %4.2f-%4.2f Hz" % (freqmin, freqmax))
+    ax2.plot(
+        np.arange(-disp_lag, disp_lag + dt, dt),
+        np.mean(data, axis=0),
+        "k-",
+        linewidth=1,
+    )
+    ax2.set_xticks(t)
+    fig.tight_layout()
 
 
 def plot_substack_cc_spect(sfile, freqmin, freqmax, disp_lag=None, savefig=True, sdir="./"):
@@ -330,57 +359,23 @@ def plot_substack_cc_spect(sfile, freqmin, freqmax, disp_lag=None, savefig=True,
             # cc matrix
             data = ds.auxiliary_data[spair][ipath].data[:, indx1:indx2]
             nwin = data.shape[0]
-            amax = np.zeros(nwin, dtype=np.float32)
-            spec = np.zeros(shape=(nwin, nfft // 2), dtype=np.complex64)
             if nwin == 0 or len(ngood) == 1:
                 print("continue! no enough substacks!")
                 continue
 
-            # load cc for each station-pair
+            # spectra, filtering and normalization of all the substacks at once
+            spec = scipy.fftpack.fft(data, nfft, axis=1)[:, : nfft // 2].astype(np.complex64)
+            normalize_rows(spec)
+            data = bandpass_2d(data, freqmin, freqmax, int(1 / dt))
+            amax = np.max(data, axis=1)
+            normalize_rows(data, absolute=False)
             for ii in range(nwin):
-                spec[ii] = scipy.fftpack.fft(data[ii], nfft, axis=0)[: nfft // 2]
-                spec[ii] /= np.max(np.abs(spec[ii]), axis=0)
-                data[ii] = bandpass(data[ii], freqmin, freqmax, int(1 / dt), corners=4, zerophase=True)
-                amax[ii] = max(data[ii])
-                data[ii] /= amax[ii]
                 timestamp[ii] = obspy.UTCDateTime(ttime[ii])
 
             # plotting
-            if nwin > 10:
-                tick_inc = int(nwin / 5)
-            else:
-                tick_inc = 2
-            fig, ax = plt.subplots(3, sharex=False)
-            ax[0].matshow(
-                data,
-                cmap="seismic",
-                extent=[-disp_lag, disp_lag, nwin, 0],
-                aspect="auto",
-            )
-            ax[0].set_title(
-                "%s.%s.%s  %s.%s.%s  dist:%5.2f km" % (net1, sta1, chan1, net2, sta2, chan2, dist)
-            )
-            ax[0].set_xlabel("time [s]")
-            ax[0].set_xticks(t)
-            ax[0].set_yticks(np.arange(0, nwin, step=tick_inc))
-            ax[0].set_yticklabels(timestamp[0::tick_inc])
-            ax[0].xaxis.set_ticks_position("bottom")
-            ax[1].matshow(
-                np.abs(spec),
-                cmap="seismic",
-                extent=[freq[0], freq[-1], nwin, 0],
-                aspect="auto",
-            )
-            ax[1].set_xlabel("freq [Hz]")
-            ax[1].set_ylabel("amplitudes")
-            ax[1].set_yticks(np.arange(0, nwin, step=tick_inc))
-            ax[1].xaxis.set_ticks_position("bottom")
-            ax[2].plot(amax / min(amax), "r-")
-            ax[2].plot(ngood, "b-")
-            ax[2].set_xlabel("waveform number")
-            # ax[1].set_xticks(np.arange(0,nwin,int(nwin/5)))
-            ax[2].legend(["relative amp", "ngood"], loc="upper right")
-            fig.tight_layout()
+            fig = plt.figure()
+            title = "%s.%s.%s  %s.%s.%s  dist:%5.2f km" % (net1, sta1, chan1, net2, sta2, chan2, dist)
+            _draw_substack_cc_spect(fig, data, spec, freq, amax, ngood, timestamp, title, disp_lag, t)
 
             # save figure or just show
             if savefig:
@@ -397,6 +392,130 @@ def plot_substack_cc_spect(sfile, freqmin, freqmax, disp_lag=None, savefig=True,
                 plt.show()
 
 
+def plot_substack_cc_spect_store(
+    cc_store: CrossCorrelationDataStore,
+    ts: DateTimeRange,
+    freqmin,
+    freqmax,
+    pairs: List[Tuple[Station, Station]] = None,
+    components: List[str] = None,
+    disp_lag=None,
+    savefig=True,
+    sdir="./",
+    executor: Executor = ThreadPoolExecutor(),
+):
+    """
+    Same as plot_substack_cc_spect, but reading the cross-correlations from a CrossCorrelationDataStore.
+
+    PARAMETERS:
+    -----------------------
+    cc_store: Store to read CC data from
+    ts: Timespan to plot
+    freqmin: min frequency to be filtered
+    freqmax: max frequency to be filtered
+    pairs: station pairs to plot, defaults to all the pairs in the store
+    components: cross components to plot (e.g. ['ZZ', 'ZR']), defaults to all of them
+    disp_lag: time ranges for display
+    savefig: Whether to save the figures as PDFs on disk
+    sdir: Save directory
+    executor: Executor used to read the station pairs concurrently
+    """
+    if savefig and sdir is None:
+        raise ValueError("sdir argument must be provided if savefig=True")
+    if pairs is None:
+        pairs = cc_store.get_station_pairs()
+
+    for ibatch in range(0, len(pairs), BULK_READ_SIZE):
+        for (src_sta, rec_sta), ccs in cc_store.read_bulk(
+            ts, pairs[ibatch : ibatch + BULK_READ_SIZE], executor, components, _lag_window(disp_lag)
+        ):
+            for cc in ccs:
+                params = cc.parameters
+                try:
+                    substack, dt, maxlag, dist, ngood, ttime = (
+                        params[p] for p in ["substack", "dt", "maxlag", "dist", "ngood", "time"]
+                    )
+                except Exception as e:
+                    logger.warning(
+                        f"continue! something wrong with {src_sta}_{rec_sta}/{cc.src}_{cc.rec}: {e}"
+                    )
+                    continue
+                # only works for cross-correlation with substacks generated
+                if not substack:
+                    raise ValueError(
+                        "seems no substacks have been done! not suitable for this plotting function"
+                    )
+                pair_lag, indx1, indx2 = _data_lag_indices(params, disp_lag)
+                t = np.arange(-int(pair_lag), int(pair_lag) + dt, step=int(2 * int(pair_lag) / 4))
+                nfft = int(next_fast_len(indx2 - indx1))
+                freq = scipy.fftpack.fftfreq(nfft, d=dt)[: nfft // 2]
+
+                data = cc.data[:, indx1:indx2]
+                nwin = data.shape[0]
+                if nwin == 0 or len(ngood) == 1:
+                    logger.warning(f"continue! no enough substacks for {src_sta}_{rec_sta}/{cc.src}_{cc.rec}")
+                    continue
+
+                # spectra, filtering and normalization of all the substacks at once
+                spec = normalize_rows(
+                    scipy.fftpack.fft(data, nfft, axis=1)[:, : nfft // 2].astype(np.complex64)
+                )
+                data = bandpass_2d(data, freqmin, freqmax, int(1 / dt))
+                amax = np.max(data, axis=1)
+                normalize_rows(data, absolute=False)
+                timestamp = np.array(
+                    [obspy.UTCDateTime(tt).datetime for tt in ttime[:nwin]], dtype="datetime64[s]"
+                )
+
+                fig = plt.figure()
+                title = f"{src_sta}.{cc.src}  {rec_sta}.{cc.rec}  dist:{dist:5.2f} km"
+                _draw_substack_cc_spect(fig, data, spec, freq, amax, ngood, timestamp, title, pair_lag, t)
+                if savefig:
+                    os.makedirs(sdir, exist_ok=True)
+                    outfname = os.path.join(sdir, f"{src_sta}.{cc.src}_{rec_sta}.{cc.rec}.pdf")
+                    fig.savefig(outfname, format="pdf", dpi=FIGURE_DPI["pdf"])
+                    plt.close(fig)
+                else:
+                    plt.show()
+
+
+def _draw_substack_cc_spect(fig, data, spec, freq, amax, ngood, timestamp, title, disp_lag, t):
+    nwin = data.shape[0]
+    if nwin > 10:
+        tick_inc = int(nwin / 5)
+    else:
+        tick_inc = 2
+    ax = fig.subplots(3, sharex=False)
+    ax[0].matshow(
+        data,
+        cmap="seismic",
+        extent=[-disp_lag, disp_lag, nwin, 0],
+        aspect="auto",
+    )
+    ax[0].set_title(title)
+    ax[0].set_xlabel("time [s]")
+    ax[0].set_xticks(t)
+    ax[0].set_yticks(np.arange(0, nwin, step=tick_inc))
+    ax[0].set_yticklabels(timestamp[0::tick_inc])
+    ax[0].xaxis.set_ticks_position("bottom")
+    ax[1].matshow(
+        np.abs(spec),
+        cmap="seismic",
+        extent=[freq[0], freq[-1], nwin, 0],
+        aspect="auto",
+    )
+    ax[1].set_xlabel("freq [Hz]")
+    ax[1].set_ylabel("amplitudes")
+    ax[1].set_yticks(np.arange(0, nwin, step=tick_inc))
+    ax[1].xaxis.set_ticks_position("bottom")
+    ax[2].plot(amax / min(amax), "r-")
+    ax[2].plot(ngood, "b-")
+    ax[2].set_xlabel("waveform number")
+    # ax[1].set_xticks(np.arange(0,nwin,int(nwin/5)))
+    ax[2].legend(["relative amp", "ngood"], loc="upper right")
+    fig.tight_layout()
+
+
 #############################################################################
 # #############PLOTTING FUNCTIONS FOR FILES FROM S2##########################
 #############################################################################
@@ -474,9 +593,6 @@ def plot_substack_all(
             # timestamp[ii] = obspy.UTCDateTime(ttime[ii])
             # cc matrix
             data[ii] = ds.auxiliary_data[itype][paths].data[indx1:indx2]
-            data[ii] = bandpass(data[ii], freqmin, freqmax, int(1 / dt), corners=4, zerophase=True)
-            amax[ii] = np.max(data[ii])
-            data[ii] /= amax[ii]
         except Exception as e:
             print(e)
             continue
@@ -484,18 +600,89 @@ def plot_substack_all(
         if len(ngood) == 1:
             raise ValueError("seems no substacks have been done! not suitable for this plotting function")
 
+    # filter and normalize all the substacks at once
+    data[:] = bandpass_2d(data, freqmin, freqmax, int(1 / dt))
+    amax[:] = np.max(data, axis=1)
+    normalize_rows(data, absolute=False)
+
     # plotting
+    fig = plt.figure(figsize=figsize)
+    title = "%s dist:%5.2f km filtered at %4.2f-%4.2fHz" % (sfile.split("/")[-1], dist, freqmin, freqmax)
+    _draw_substack_all(fig, data, amax, ngood, timestamp, title, disp_lag, t)
+    # save figure or just show
+    if savefig:
+        if sdir is None:
+            sdir = sfile.split(".")[0]
+        if not os.path.isdir(sdir):
+            os.mkdir(sdir)
+        outfname = sdir + "/{0:s}_{1:4.2f}_{2:4.2f}Hz.pdf".format(sfile.split("/")[-1], freqmin, freqmax)
+        fig.savefig(outfname, format="pdf", dpi=400)
+        plt.close()
+    else:
+        plt.show()
+
+
+def plot_substack_all_store(
+    stack_store: StackStore,
+    ts: DateTimeRange,
+    src: Station,
+    rec: Station,
+    freqmin,
+    freqmax,
+    ccomp,
+    disp_lag=None,
+    savefig=False,
+    sdir=None,
+    figsize=(14, 14),
+):
+    """
+    Same as plot_substack_all, but reading the substacks of a station pair from a StackStore.
+
+    PARAMETERS:
+    ---------------------
+    stack_store: Store to read the stacks from
+    ts: Timespan of the stacks
+    src, rec: source and receiver stations
+    freqmin: min frequency to be filtered
+    freqmax: max frequency to be filtered
+    ccomp: cross component of the targeted cc functions
+    disp_lag: time ranges for display
+    savefig: set True to save the figures (in pdf format)
+    sdir: directory to save the figure
+    """
+    data, ngood, timestamp, dist, dt, disp_lag = _read_substacks(stack_store, ts, src, rec, ccomp, disp_lag)
+    t = np.arange(-int(disp_lag), int(disp_lag) + dt, step=int(2 * int(disp_lag) / 4))
+
+    # filter and normalize all the substacks at once
+    data = bandpass_2d(data, freqmin, freqmax, int(1 / dt))
+    amax = np.max(data, axis=1)
+    normalize_rows(data, absolute=False)
+
+    name = f"{src}_{rec}_{ccomp}"
+    fig = plt.figure(figsize=figsize)
+    title = "%s dist:%5.2f km filtered at %4.2f-%4.2fHz" % (name, dist, freqmin, freqmax)
+    _draw_substack_all(fig, data, amax, ngood, timestamp, title, disp_lag, t)
+    if savefig:
+        error_if(sdir is None, "sdir argument must be provided if savefig=True", ValueError)
+        os.makedirs(sdir, exist_ok=True)
+        outfname = os.path.join(sdir, "{0:s}_{1:4.2f}_{2:4.2f}Hz.pdf".format(name, freqmin, freqmax))
+        fig.savefig(outfname, format="pdf", dpi=FIGURE_DPI["pdf"])
+        plt.close(fig)
+    else:
+        plt.show()
+
+
+def _draw_substack_all(fig, data, amax, ngood, timestamp, title, disp_lag, t):
+    nwin = data.shape[0]
     if nwin > 100:
         tick_inc = int(nwin / 10)
     elif nwin > 10:
         tick_inc = int(nwin / 5)
     else:
         tick_inc = 2
-    fig, ax = plt.subplots(2, sharex=False, figsize=figsize)
+    ax = fig.subplots(2, sharex=False)
     ax[0].matshow(data, cmap="seismic", extent=[-disp_lag, disp_lag, nwin, 0], aspect="auto")
-    ax[0].set_title(
-        "%s dist:%5.2f km filtered at %4.2f-%4.2fHz" % (sfile.split("/")[-1], dist, freqmin, freqmax)
-    )
+    ax[0].set_title(title)
     ax[0].set_xlabel("time [s]")
     ax[0].set_ylabel("wavefroms")
     ax[0].set_xticks(t)
@@ -508,19 +695,32 @@ def plot_substack_all(
     ax2.set_ylabel("ngood", color="b")
     ax[1].set_ylabel("relative amp", color="r")
     ax[1].set_xlabel("waveform number")
-    ax[1].set_xticks(np.arange(0, nwin, nwin // 5))
+    ax[1].set_xticks(np.arange(0, nwin, max(nwin // 5, 1)))
     ax[1].legend(["relative amp", "ngood"], loc="upper right")
-    # save figure or just show
-    if savefig:
-        if sdir is None:
-            sdir = sfile.split(".")[0]
-        if not os.path.isdir(sdir):
-            os.mkdir(sdir)
-        outfname = sdir + "/{0:s}_{1:4.2f}_{2:4.2f}Hz.pdf".format(sfile.split("/")[-1], freqmin, freqmax)
-        fig.savefig(outfname, format="pdf", dpi=400)
-        plt.close()
-    else:
-        plt.show()
+
+
+def _read_substacks(
+    stack_store: StackStore, ts: DateTimeRange, src: Station, rec: Station, ccomp: str, disp_lag
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, float, float, float]:
+    """
+    Reads the substacks (i.e. not the 'Allstack_*' stacks) of one component of a station pair, reading only
+    the displayed lags. Returns the (nwin, nlag) data, ngood, timestamps, distance, sampling interval and
+    display lag.
+    """
+    stacks = stack_store.read(ts, src, rec, components=[ccomp], lag_window=_lag_window(disp_lag))
+    stacks = [st for st in stacks if "stack" not in st.name]
+    if len(stacks) < 2:
+        raise ValueError(f"seems no substacks have been done for {src}_{rec}/{ccomp}")
+    stacks.sort(key=lambda st: float(st.name[1:]))
+    params = stacks[0].parameters
+    dt, dist = (params[p] for p in ["dt", "dist"])
+    disp_lag, indx1, indx2 = _data_lag_indices(params, disp_lag)
+    data = np.stack([st.data[indx1:indx2] for st in stacks]).astype(np.float32)
+    ngood = np.array([st.parameters["ngood"] for st in stacks], dtype=np.int16)
+    timestamp = np.array(
+        [obspy.UTCDateTime(float(st.name[1:])).datetime for st in stacks], dtype="datetime64[s]"
+    )
+    return data, ngood, timestamp, dist, dt, disp_lag
 
 
 def plot_substack_all_spect(
@@ -597,12 +797,7 @@ def plot_substack_all_spect(
             ttime[ii] = ds.auxiliary_data[itype][paths].parameters["time"]
             # timestamp[ii] = obspy.UTCDateTime(ttime[ii])
             # cc matrix
-            tdata = ds.auxiliary_data[itype][paths].data[indx1:indx2]
-            spec[ii] = scipy.fftpack.fft(tdata, nfft, axis=0)[: nfft // 2]
-            spec[ii] /= np.max(np.abs(spec[ii]))
-            data[ii] = bandpass(tdata, freqmin, freqmax, int(1 / dt), corners=4, zerophase=True)
-            amax[ii] = np.max(data[ii])
-            data[ii] /= amax[ii]
+            data[ii] = ds.auxiliary_data[itype][paths].data[indx1:indx2]
         except Exception as e:
             print(e)
             continue
@@ -610,11 +805,78 @@ def plot_substack_all_spect(
         if len(ngood) == 1:
             raise ValueError("seems no substacks have been done! not suitable for this plotting function")
 
+    # spectra, filtering and normalization of all the substacks at once
+    spec[:] = scipy.fftpack.fft(data, nfft, axis=1)[:, : nfft // 2]
+    normalize_rows(spec)
+    data[:] = bandpass_2d(data, freqmin, freqmax, int(1 / dt))
+    amax[:] = np.max(data, axis=1)
+    normalize_rows(data, absolute=False)
+
     # plotting
+    fig = plt.figure(figsize=figsize)
+    title = "%s dist:%5.2f km" % (sfile.split("/")[-1], dist)
+    _draw_substack_all_spect(fig, data, spec, freq, amax, ngood, timestamp, title, disp_lag, t)
+    # save figure or just show
+    if savefig:
+        if sdir is None:
+            sdir = sfile.split(".")[0]
+        if not os.path.isdir(sdir):
+            os.mkdir(sdir)
+        outfname = sdir + "/{0:s}.pdf".format(sfile.split("/")[-1])
+        fig.savefig(outfname, format="pdf", dpi=400)
+        plt.close()
+    else:
+        plt.show()
+
+
+def plot_substack_all_spect_store(
+    stack_store: StackStore,
+    ts: DateTimeRange,
+    src: Station,
+    rec: Station,
+    freqmin,
+    freqmax,
+    ccomp,
+    disp_lag=None,
+    savefig=False,
+    sdir=None,
+    figsize=(14, 14),
+):
+    """
+    Same as plot_substack_all_spect, but reading the substacks of a station pair from a StackStore.
+    See plot_substack_all_store for the parameters.
+    """
+    data, ngood, timestamp, dist, dt, disp_lag = _read_substacks(stack_store, ts, src, rec, ccomp, disp_lag)
+    t = np.arange(-int(disp_lag), int(disp_lag) + dt, step=int(2 * int(disp_lag) / 4))
+    nfft = int(next_fast_len(data.shape[1]))
+    freq = scipy.fftpack.fftfreq(nfft, d=dt)[: nfft // 2]
+
+    # spectra, filtering and normalization of all the substacks at once
+    spec = normalize_rows(scipy.fftpack.fft(data, nfft, axis=1)[:, : nfft // 2].astype(np.complex64))
+    data = bandpass_2d(data, freqmin, freqmax, int(1 / dt))
+    amax = np.max(data, axis=1)
+    normalize_rows(data, absolute=False)
+
+    name = f"{src}_{rec}_{ccomp}"
+    fig = plt.figure(figsize=figsize)
+    _draw_substack_all_spect(
+        fig, data, spec, freq, amax, ngood, timestamp, f"{name} dist:{dist:5.2f} km", disp_lag, t
+    )
+    if savefig:
+        error_if(sdir is None, "sdir argument must be provided if savefig=True", ValueError)
+        os.makedirs(sdir, exist_ok=True)
+        fig.savefig(os.path.join(sdir, f"{name}.pdf"), format="pdf", dpi=FIGURE_DPI["pdf"])
+        plt.close(fig)
+    else:
+        plt.show()
+
+
+def _draw_substack_all_spect(fig, data, spec, freq, amax, ngood, timestamp, title, disp_lag, t):
+    nwin = data.shape[0]
     tick_inc = 50
-    fig, ax = plt.subplots(3, sharex=False, figsize=figsize)
+    ax = fig.subplots(3, sharex=False)
     ax[0].matshow(data, cmap="seismic", extent=[-disp_lag, disp_lag, nwin, 0], aspect="auto")
-    ax[0].set_title("%s dist:%5.2f km" % (sfile.split("/")[-1], dist))
+    ax[0].set_title(title)
     ax[0].set_xlabel("time [s]")
     ax[0].set_ylabel("wavefroms")
     ax[0].set_xticks(t)
@@ -630,19 +892,8 @@ def plot_substack_all_spect(
     ax[2].plot(amax / max(amax), "r-")
     ax[2].plot(ngood, "b-")
     ax[2].set_xlabel("waveform number")
-    ax[2].set_xticks(np.arange(0, nwin, nwin // 15))
+    ax[2].set_xticks(np.arange(0, nwin, max(nwin // 15, 1)))
     ax[2].legend(["relative amp", "ngood"], loc="upper right")
-    # save figure or just show
-    if savefig:
-        if sdir is None:
-            sdir = sfile.split(".")[0]
-        if not os.path.isdir(sdir):
-            os.mkdir(sdir)
-        outfname = sdir + "/{0:s}.pdf".format(sfile.split("/")[-1])
-        fig.savefig(outfname, format="pdf", dpi=400)
-        plt.close()
-    else:
-        plt.show()
 
 
 def plot_all_moveout(
@@ -655,21 +906,23 @@ def plot_all_moveout(
     disp_lag=None,
     savefig=False,
     sdir=None,
+    fmt: str = "pdf",
 ):
     """
     display the moveout (2D matrix) of the cross-correlation functions stacked for all time chuncks.
 
     PARAMETERS:
     ---------------------
-    store: StackStore to read stacked data
+    sta_stacks: stacks of all the station pairs, e.g. as returned by StackStore.read_bulk
     stack_name: datatype either 'Allstack0pws' or 'Allstack_linear'
     freqmin: min frequency to be filtered
     freqmax: max frequency to be filtered
     ccomp:   cross component
     dist_inc: distance bins to stack over
     disp_lag: lag times for displaying
-    savefig: set True to save the figures (in pdf format)
+    savefig: set True to save the figures
     sdir: diresied directory to save the figure (if not provided, save to default dir)
+    fmt: 'pdf' or 'png' (low resolution thumbnail)
 
     USAGE:
     ----------------------
@@ -696,57 +949,67 @@ def plot_all_moveout(
         logger.error(f"No data available for plotting {stack_name}/{ccomp}")
         return
 
-    dt, maxlag = (params[p] for p in ["dt", "maxlag"])
-    stack_method = stack_name.split("0")[-1]
-    logger.info(f"Plotting {len(sta_stacks)} pairs from {stack_method}")
-
-    # lags for display
-    if not disp_lag:
-        disp_lag = maxlag
-    if disp_lag > maxlag:
-        raise ValueError("lag exceeds maxlag!")
-    t = np.arange(-int(disp_lag), int(disp_lag) + dt, step=(int(2 * int(disp_lag) / 4)))
-    indx1 = int((maxlag - disp_lag) / dt)
-    indx2 = indx1 + 2 * int(disp_lag / dt) + 1
+    logger.info(f"Plotting {len(sta_stacks)} pairs from {stack_name}")
+    _lag_indices(disp_lag, params["maxlag"], params["dt"])
+    moveout = compute_moveout(sta_stacks, stack_name, ccomp, freqmin, freqmax, dist_inc)
+    if moveout is None:
+        return
+    plot_moveout(moveout, disp_lag, savefig, sdir, fmt)
 
-    # cc matrix
-    nwin = len(sta_stacks)
-    data = np.zeros(shape=(nwin, indx2 - indx1), dtype=np.float32)
-    dist = np.zeros(nwin, dtype=np.float32)
-    ngood = np.zeros(nwin, dtype=np.int16)
 
-    # load cc and parameter matrix
-    def load(ii):
-        (src, rec), stacks = sta_stacks[ii]
-        stacks = list(filter(lambda x: x.name == stack_name and x.component == ccomp, stacks))
-        if len(stacks) == 0:
-            logger.warning(f"No data available for {src}_{rec}/{stack_name}/{ccomp}")
+def plot_moveout_store(
+    stack_store: StackStore,
+    ts: DateTimeRange,
+    stack_name,
+    freqmin,
+    freqmax,
+    ccomp,
+    dist_inc,
+    disp_lag=None,
+    savefig=False,
+    sdir=None,
+    fmt: str = "pdf",
+):
+    """
+    Same as plot_all_moveout, but rendering the moveout stack persisted in the StackStore by
+    moveout.compute_moveout_products. It's computed (and persisted) from all the pairs if it doesn't exist yet.
+    """
+    moveout = read_moveout(stack_store, ts, stack_name, ccomp, freqmin, freqmax, dist_inc)
+    if moveout is None:
+        moveouts = compute_moveout_products(
+            stack_store, ts, [stack_name], [ccomp], [(freqmin, freqmax)], dist_inc
+        )
+        if len(moveouts) == 0:
+            logger.error(f"No data available for plotting {stack_name}/{ccomp}")
             return
-        params, all_data = stacks[0].parameters, stacks[0].data
-        dist[ii] = params["dist"]
-        ngood[ii] = params["ngood"]
-        crap = bandpass(all_data, freqmin, freqmax, int(1 / dt), corners=4, zerophase=True)
-        data[ii] = crap[indx1:indx2]
-
-    for i in range(nwin):
-        load(i)
-
-    # average cc
-    ntrace = int(np.round(np.max(dist) + 0.51) / dist_inc)
-    ndata = np.zeros(shape=(ntrace, indx2 - indx1), dtype=np.float32)
-    ndist = np.zeros(ntrace, dtype=np.float32)
-    for td in range(0, ntrace - 1):
-        tindx = np.where((dist >= td * dist_inc) & (dist < (td + 1) * dist_inc))[0]
-        if len(tindx):
-            ndata[td] = np.mean(data[tindx], axis=0)
-            ndist[td] = (td + 0.5) * dist_inc
+        moveout = moveouts[0]
+    plot_moveout(moveout, disp_lag, savefig, sdir, fmt)
+
+
+def plot_moveout(moveout: MoveoutStack, disp_lag=None, savefig=False, sdir=None, fmt: str = "pdf"):
+    """
+    display a distance-binned moveout stack (see moveout.compute_moveout)
+
+    PARAMETERS:
+    ---------------------
+    moveout: the moveout stack
+    disp_lag: lag times for displaying
+    savefig: set True to save the figures
+    sdir: diresied directory to save the figure
+    fmt: 'pdf' or 'png' (low resolution thumbnail)
+    """
+    if savefig and sdir is None:
+        raise ValueError("sdir argument must be provided if savefig=True")
+    dt, freqmin, freqmax = moveout.dt, moveout.freqmin, moveout.freqmax
+    stack_method = moveout.stack_name.split("0")[-1]
+
+    # lags for display
+    disp_lag, indx1, indx2 = _lag_indices(disp_lag, moveout.maxlag, dt)
+    t = np.arange(-int(disp_lag), int(disp_lag) + dt, step=(int(2 * int(disp_lag) / 4)))
 
     # normalize waveforms
-    indx = np.where(ndist > 0)[0]
-    ndata = ndata[indx]
-    ndist = ndist[indx]
-    for ii in range(ndata.shape[0]):
-        ndata[ii] /= np.max(np.abs(ndata[ii]))
+    ndata = normalize_rows(moveout.data[:, indx1:indx2].astype(np.float32))
+    ndist = moveout.distances
 
     if ndata.shape[0] >= 10:
         # plotting figures
@@ -763,13 +1026,11 @@ def plot_all_moveout(
         ax.set_ylabel("distance [km]")
         ax.set_xticks(t)
         ax.xaxis.set_ticks_position("bottom")
-        # ax.text(np.ones(len(ndist))*(disp_lag-5),dist[ndist],ngood[ndist],fontsize=8)
     else:
         fig, ax = plt.subplots(figsize=(10, 6))
-        print(disp_lag, ndata.shape[1])
         tt = 2 * np.linspace(0, disp_lag, ndata.shape[1]) - disp_lag
         for ii in range(len(ndata)):
-            ax.plot(tt, ndata[ii] / np.max(np.abs(ndata[ii])) * 10 + ndist[ii], "k")
+            ax.plot(tt, ndata[ii] * 10 + ndist[ii], "k")
             ax.set_title("stacked %s (%5.3f-%5.2f Hz)" % (stack_method, freqmin, freqmax))
             ax.set_xlabel("time [s]")
             ax.set_ylabel("distance [km]")
@@ -778,8 +1039,13 @@ def plot_all_moveout(
 
     # save figure or show
     if savefig:
-        outfname = sdir + "/moveout_stack_" + str(stack_method) + "_" + str(dist_inc) + "kmbin.pdf"
-        fig.savefig(outfname, format="pdf", dpi=400)
+        error_if(
+            fmt not in FIGURE_DPI,
+            f"Unsupported figure format {fmt}, must be one of {list(FIGURE_DPI)}",
+            ValueError,
+        )
+        outfname = sdir + "/moveout_stack_" + str(stack_method) + "_" + str(moveout.dist_inc) + "kmbin." + fmt
+        fig.savefig(outfname, format=fmt, dpi=FIGURE_DPI[fmt])
         plt.close()
     else:
         plt.show()
@@ -833,40 +1099,70 @@ def plot_all_moveout_1D_1comp(
         raise Exception("exit! cannot open %s to read" % sfiles[0])
 
     # lags for display
-    if not disp_lag:
-        disp_lag = maxlag
-    if disp_lag > maxlag:
-        raise ValueError("lag exceeds maxlag!")
-    tt = np.arange(-int(disp_lag), int(disp_lag) + dt, dt)
-    indx1 = int((maxlag - disp_lag) / dt)
-    indx2 = indx1 + 2 * int(disp_lag / dt) + 1
+    disp_lag, indx1, indx2 = _lag_indices(disp_lag, maxlag, dt)
 
     # load cc and parameter matrix
+    traces = _load_moveout_traces(sfiles, receiver, dtype, ccomp, indx1, indx2)
+    traces = _filter_moveout_traces(traces, freqmin, freqmax, dt)
+    _draw_moveout_1D_1comp(
+        traces, sta, stack_method, freqmin, freqmax, ccomp, disp_lag, dt, savefig, sdir, figsize
+    )
+
+
+def plot_all_moveout_1D_1comp_store(
+    stack_store: StackStore,
+    ts: DateTimeRange,
+    sta: Station,
+    stack_name,
+    freqmin,
+    freqmax,
+    ccomp,
+    pairs: List[Tuple[Station, Station]] = None,
+    disp_lag=None,
+    savefig=False,
+    sdir=None,
+    figsize=(14, 11),
+    executor: Executor = ThreadPoolExecutor(),
+):
+    """
+    Same as plot_all_moveout_1D_1comp, but reading the stacks of all the pairs of a station from a StackStore.
+
+    PARAMETERS:
+    ---------------------
+    stack_store: Store to read the stacks from
+    ts: Timespan of the stacks
+    sta: source station
+    stack_name: either 'Allstack_pws' or 'Allstack_linear'
+    freqmin: min frequency to be filtered
+    freqmax: max frequency to be filtered
+    ccomp:   cross component
+    pairs: station pairs to plot, defaults to all the pairs of the store that include ``sta``
+    disp_lag: lag times for displaying
+    savefig: set True to save the figures (in pdf format)
+    sdir: diresied directory to save the figure (if not provided, save to default dir)
+    executor: Executor used to read the station pairs concurrently
+    """
+    traces = _read_moveout_traces(stack_store, ts, sta, stack_name, [ccomp], pairs, disp_lag, executor)
+    if traces is None:
+        return
+    disp_lag, dt, comp_traces = traces
+    stack_method = stack_name.split("_")[-1]
+    traces = _filter_moveout_traces(comp_traces[ccomp], freqmin, freqmax, dt)
+    _draw_moveout_1D_1comp(
+        traces, str(sta), stack_method, freqmin, freqmax, ccomp, disp_lag, dt, savefig, sdir, figsize
+    )
+
+
+def _draw_moveout_1D_1comp(
+    traces, sta, stack_method, freqmin, freqmax, ccomp, disp_lag, dt, savefig, sdir, figsize
+):
+    tt = np.arange(-int(disp_lag), int(disp_lag) + dt, dt)
     mdist = 0
     if not figsize:
         plt.figure()
     else:
         plt.figure(figsize=figsize)
-    for ii in range(len(sfiles)):
-        sfile = sfiles[ii]
-        iflip = 0
-        treceiver = sfile.split("_")[-1]
-        if treceiver == receiver:
-            iflip = 1
-
-        ds = pyasdf.ASDFDataSet(sfile, mode="r")
-        try:
-            # load data to variables
-            dist = ds.auxiliary_data[dtype][ccomp].parameters["dist"]
-            tdata = ds.auxiliary_data[dtype][ccomp].data[indx1:indx2]
-
-        except Exception:
-            print("continue! cannot read %s " % sfile)
-            continue
-
-        tdata = bandpass(tdata, freqmin, freqmax, int(1 / dt), corners=4, zerophase=True)
-        tdata /= np.max(tdata, axis=0)
-
+    for treceiver, iflip, dist, tdata in traces:
         if iflip:
             plt.plot(tt, np.flip(tdata, axis=0) + dist, "k", linewidth=0.8)
         else:
@@ -928,57 +1224,75 @@ def plot_all_moveout_1D_9comp(
 
     receiver = sta + ".h5"
     stack_method = dtype.split("_")[-1]
-    ccomp = ["ZR", "ZT", "ZZ", "RR", "RT", "RZ", "TR", "TT", "TZ"]
 
     # extract common variables
     try:
         ds = pyasdf.ASDFDataSet(sfiles[0], mode="r")
-        dt = ds.auxiliary_data[dtype][ccomp[0]].parameters["dt"]
-        maxlag = ds.auxiliary_data[dtype][ccomp[0]].parameters["maxlag"]
+        dt = ds.auxiliary_data[dtype][MOVEOUT_9COMP[0]].parameters["dt"]
+        maxlag = ds.auxiliary_data[dtype][MOVEOUT_9COMP[0]].parameters["maxlag"]
     except Exception:
         raise Exception("exit! cannot open %s to read" % sfiles[0])
 
     # lags for display
-    if not disp_lag:
-        disp_lag = maxlag
-    if disp_lag > maxlag:
-        raise ValueError("lag exceeds maxlag!")
-    tt = np.arange(-int(disp_lag), int(disp_lag) + dt, dt)
-    indx1 = int((maxlag - disp_lag) / dt)
-    indx2 = indx1 + 2 * int(disp_lag / dt) + 1
+    disp_lag, indx1, indx2 = _lag_indices(disp_lag, maxlag, dt)
 
     # load cc and parameter matrix
+    comp_traces = {
+        comp: _filter_moveout_traces(
+            _load_moveout_traces(sfiles, receiver, dtype, comp, indx1, indx2, mdist), freqmin, freqmax, dt
+        )
+        for comp in MOVEOUT_9COMP
+    }
+    _draw_moveout_1D_9comp(
+        comp_traces, sta, stack_method, freqmin, freqmax, mdist, disp_lag, dt, savefig, sdir, figsize
+    )
+
+
+def plot_all_moveout_1D_9comp_store(
+    stack_store: StackStore,
+    ts: DateTimeRange,
+    sta: Station,
+    stack_name,
+    freqmin,
+    freqmax,
+    mdist,
+    pairs: List[Tuple[Station, Station]] = None,
+    disp_lag=None,
+    savefig=False,
+    sdir=None,
+    figsize=(14, 11),
+    executor: Executor = ThreadPoolExecutor(),
+):
+    """
+    Same as plot_all_moveout_1D_9comp, but reading the stacks of all the pairs of a station from a StackStore.
+    See plot_all_moveout_1D_1comp_store for the parameters.
+    """
+    traces = _read_moveout_traces(stack_store, ts, sta, stack_name, MOVEOUT_9COMP, pairs, disp_lag, executor)
+    if traces is None:
+        return
+    disp_lag, dt, comp_traces = traces
+    stack_method = stack_name.split("_")[-1]
+    comp_traces = {
+        comp: _filter_moveout_traces([t for t in comp_traces[comp] if t[2] <= mdist], freqmin, freqmax, dt)
+        for comp in MOVEOUT_9COMP
+    }
+    _draw_moveout_1D_9comp(
+        comp_traces, str(sta), stack_method, freqmin, freqmax, mdist, disp_lag, dt, savefig, sdir, figsize
+    )
+
+
+def _draw_moveout_1D_9comp(
+    comp_traces, sta, stack_method, freqmin, freqmax, mdist, disp_lag, dt, savefig, sdir, figsize
+):
+    tt = np.arange(-int(disp_lag), int(disp_lag) + dt, dt)
     if not figsize:
         plt.figure()
     else:
         plt.figure(figsize=figsize)
-    for ic in range(len(ccomp)):
-        comp = ccomp[ic]
-        tmp = "33" + str(ic + 1)
-        plt.subplot(tmp)
-
-        for ii in range(len(sfiles)):
-            sfile = sfiles[ii]
-            iflip = 0
-            treceiver = sfile.split("_")[-1]
-            if treceiver == receiver:
-                iflip = 1
-
-            ds = pyasdf.ASDFDataSet(sfile, mode="r")
-            try:
-                # load data to variables
-                dist = ds.auxiliary_data[dtype][comp].parameters["dist"]
-                tdata = ds.auxiliary_data[dtype][comp].data[indx1:indx2]
-
-            except Exception:
-                print("continue! cannot read %s " % sfile)
-                continue
-
-            if dist > mdist:
-                continue
-            tdata = bandpass(tdata, freqmin, freqmax, int(1 / dt), corners=4, zerophase=True)
-            tdata /= np.max(tdata, axis=0)
+    for ic, comp in enumerate(MOVEOUT_9COMP):
+        plt.subplot(3, 3, ic + 1)
 
+        for treceiver, iflip, dist, tdata in comp_traces[comp]:
             if iflip:
                 plt.plot(tt, np.flip(tdata, axis=0) + dist, "k", linewidth=0.8)
             else:
@@ -1004,3 +1318,168 @@ def plot_all_moveout_1D_9comp(
         plt.close()
     else:
         plt.show()
+
+
+def _lag_indices(disp_lag, maxlag, dt) -> Tuple[float, int, int]:
+    """
+    Returns the display lag (defaults to maxlag) and the indices of the [-disp_lag, disp_lag] window
+    """
+    if not disp_lag:
+        disp_lag = maxlag
+    if disp_lag > maxlag:
+        raise ValueError("lag exceeds maxlag!")
+    # rounded like the lag windows read from the stores, so full and windowed reads show the same samples
+    lags, _ = lag_slice({"dt": dt, "maxlag": maxlag}, (-disp_lag, disp_lag))
+    return disp_lag, lags.start, lags.stop
+
+
+def _lag_window(disp_lag) -> Optional[Tuple[float, float]]:
+    """
+    Returns the lag window to read from the stores to display ``disp_lag``, or None to read all the lags
+    """
+    return (-disp_lag, disp_lag) if disp_lag else None
+
+
+def _data_lag_indices(params: Dict, disp_lag) -> Tuple[float, int, int]:
+    """
+    Same as _lag_indices, for data read from a store, which is already restricted to the window in its
+    LAG_WINDOW_PARAM parameter if the store read only that window
+    """
+    maxlag, dt = params["maxlag"], params["dt"]
+    disp_lag, indx1, indx2 = _lag_indices(disp_lag, maxlag, dt)
+    window = params.get(LAG_WINDOW_PARAM, None)
+    if window is not None:
+        # the window is aligned to the samples by lag_slice, so these are exact
+        first = int(round((window[0] + maxlag) / dt))
+        last = int(round((window[1] + maxlag) / dt)) + 1
+        if indx1 < first or indx2 > last:
+            raise ValueError(
+                f"The lag window {window} read from the store does not contain the lags ±{disp_lag}"
+            )
+        indx1, indx2 = indx1 - first, indx2 - first
+    return disp_lag, indx1, indx2
+
+
+def _load_moveout_traces(
+    sfiles, receiver, dtype, ccomp, indx1, indx2, mdist=None
+) -> List[Tuple[str, bool, float, np.ndarray]]:
+    """
+    Reads one component of the stacks of all the files. Returns a (receiver, flip, distance, trace) tuple per
+    readable file.
+    """
+    traces = []
+    for sfile in sfiles:
+        treceiver = sfile.split("_")[-1]
+        ds = pyasdf.ASDFDataSet(sfile, mode="r")
+        try:
+            # load data to variables
+            dist = ds.auxiliary_data[dtype][ccomp].parameters["dist"]
+            tdata = ds.auxiliary_data[dtype][ccomp].data[indx1:indx2]
+        except Exception:
+            print("continue! cannot read %s " % sfile)
+            continue
+        if mdist is not None and dist > mdist:
+            continue
+        traces.append((treceiver, treceiver == receiver, dist, tdata))
+    return traces
+
+
+def _read_moveout_traces(
+    stack_store: StackStore,
+    ts: DateTimeRange,
+    sta: Station,
+    stack_name: str,
+    components: List[str],
+    pairs: List[Tuple[Station, Station]],
+    disp_lag,
+    executor: Executor,
+) -> Optional[Tuple[float, float, Dict[str, List[Tuple[str, bool, float, np.ndarray]]]]]:
+    """
+    Reads the given components of a stack of all the pairs of a station, reading only the displayed lags.
+    Returns the display lag, the sampling interval and the traces of each component (see _load_moveout_traces).
+    """
+    if pairs is None:
+        pairs = [p for p in stack_store.get_station_pairs() if sta in p]
+    pair_stacks = [
+        (pair, [st for st in stacks if st.name == stack_name and st.component in components])
+        for pair, stacks in stack_store.read_bulk(ts, pairs, executor, components, _lag_window(disp_lag))
+    ]
+    first = next((stacks[0] for _, stacks in pair_stacks if len(stacks) > 0), None)
+    if first is None:
+        logger.error(f"No data available for plotting {stack_name}/{components} of {sta}")
+        return None
+    dt = first.parameters["dt"]
+    disp_lag, indx1, indx2 = _data_lag_indices(first.parameters, disp_lag)
+
+    comp_traces = {comp: [] for comp in components}
+    for (src, rec), stacks in pair_stacks:
+        # flip the stacks where the station is the receiver
+        other, iflip = (src, True) if rec == sta else (rec, False)
+        for st in stacks:
+            comp_traces[st.component].append((str(other), iflip, st.parameters["dist"], st.data[indx1:indx2]))
+    return disp_lag, dt, comp_traces
+
+
+def _filter_moveout_traces(
+    traces: List[Tuple[str, bool, float, np.ndarray]], freqmin, freqmax, dt
+) -> List[Tuple[str, bool, float, np.ndarray]]:
+    """
+    Filters and normalizes the traces of all the pairs at once
+    """
+    if len(traces) == 0:
+        return traces
+    data = bandpass_2d(np.stack([t[3] for t in traces]), freqmin, freqmax, int(1 / dt))
+    normalize_rows(data, absolute=False)
+    return [(treceiver, iflip, dist, tdata) for (treceiver, iflip, dist, _), tdata in zip(traces, data)]
+
+
+class _FigureSaver:
+    """
+    Saves figures either as one file per figure, rendered in the ``render_executor`` when one is given,
+    or as the pages of a single ``<name>.pdf`` file. Figures are drawn on plain ``Figure`` objects (Agg),
+    without pyplot, so they can be rendered in other threads or processes.
+    """
+
+    def __init__(self, sdir: str, fmt: str, multipage: bool, name: str, render_executor: Executor = None):
+        error_if(
+            fmt not in FIGURE_DPI,
+            f"Unsupported figure format {fmt}, must be one of {list(FIGURE_DPI)}",
+            ValueError,
+        )
+        error_if(
+            multipage and fmt != "pdf", "Multi-page figures are only supported for the pdf format", ValueError
+        )
+        os.makedirs(sdir, exist_ok=True)
+        self.sdir = sdir
+        self.fmt = fmt
+        self.render_executor = render_executor
+        self.futures: List[Future] = []
+        self.pdf = PdfPages(os.path.join(sdir, f"{name}.pdf")) if multipage else None
+
+    def save(self, draw: Callable, kwargs: Dict, name: str, figsize: Tuple[float, float]):
+        if self.pdf is not None:
+            fig = Figure(figsize=figsize)
+            draw(fig, **kwargs)
+            self.pdf.savefig(fig, dpi=FIGURE_DPI[self.fmt])
+            return
+        outfname = os.path.join(self.sdir, f"{name}.{self.fmt}")
+        if self.render_executor is None:
+            _render_figure(draw, kwargs, figsize, outfname, self.fmt)
+        else:
+            self.futures.append(
+                self.render_executor.submit(_render_figure, draw, kwargs, figsize, outfname, self.fmt)
+            )
+
+    def close(self):
+        if self.pdf is not None:
+            self.pdf.close()
+        get_results(self.futures, "Rendering figures")
+
+
+def _render_figure(
+    draw: Callable, kwargs: Dict, figsize: Tuple[float, float], outfname: str, fmt: str
+) -> str:
+    fig = Figure(figsize=figsize)
+    draw(fig, **kwargs)
+    fig.savefig(outfname, format=fmt, dpi=FIGURE_DPI[fmt])
+    return outfname
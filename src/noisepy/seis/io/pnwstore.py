@@ -2,16 +2,16 @@ import io
 import logging
 import os
 import sqlite3
-from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Callable, List, Tuple
+from typing import Callable, Iterator, List, Optional, Tuple
 
 import obspy
 from datetimerange import DateTimeRange
 
+from .channel_filter_store import ChannelFilter, name_mask
 from .channelcatalog import ChannelCatalog
 from .datatypes import Channel, ChannelData, ChannelType, Station
-from .stores import RawDataStore
+from .stores import RawDataStore, iter_mseed_windows, read_mseed
 from .utils import fs_join, get_filesystem
 
 logger = logging.getLogger(__name__)
@@ -76,12 +76,20 @@ class PNWDataStore(RawDataStore):
             cmd += f" AND network = '{net}'"
         else:
             logger.warning("Data path contains wildcards. Channel query might be slow.")
+        # push the channel filter down to the query when possible
+        if isinstance(chan_filter, ChannelFilter):
+            condition = chan_filter.sql_condition()
+            if condition:
+                cmd += f" AND {condition}"
         rst = self._dbquery(cmd)
-        for i in rst:
+        mask = name_mask(chan_filter, rst)
+        for idx, i in enumerate(rst):
             timespan = PNWDataStore._parse_timespan(os.path.basename(i[4]))
             self.paths[timespan.start_datetime] = full_path
+            if mask is not None and not mask[idx]:
+                continue
             channel = PNWDataStore._parse_channel(i)
-            if not chan_filter(channel):
+            if mask is None and not chan_filter(channel):
                 continue
             key = str(timespan)
             if key not in self.channels:
@@ -91,16 +99,36 @@ class PNWDataStore(RawDataStore):
 
     def get_channels(self, date_range: DateTimeRange) -> List[Channel]:
         tmp_channels = self.channels.get(str(date_range), [])
-        executor = ThreadPoolExecutor()
-        stations = set(map(lambda c: c.station, tmp_channels))
-        _ = list(executor.map(lambda s: self.chan_catalog.get_inventory(date_range, s), stations))
         logger.info(f"Getting {len(tmp_channels)} channels for {date_range}")
-        return list(executor.map(lambda c: self.chan_catalog.get_full_channel(date_range, c), tmp_channels))
+        return self.chan_catalog.get_full_channels(date_range, tmp_channels)
 
     def get_timespans(self) -> List[DateTimeRange]:
         return list([DateTimeRange.from_range_text(d) for d in sorted(self.channels.keys())])
 
-    def read_data(self, timespan: DateTimeRange, chan: Channel) -> ChannelData:
+    def read_data(self, timespan: DateTimeRange, chan: Channel, window: DateTimeRange = None) -> ChannelData:
+        chunks = self._read_chunks(timespan, chan)
+        if chunks is None:
+            return ChannelData.empty()
+        stream = obspy.Stream()
+        for chunk in chunks:
+            stream += read_mseed(io.BytesIO(chunk), window)
+        if len(stream) == 0:
+            return ChannelData.empty()
+        return ChannelData(stream)
+
+    def iter_windows(
+        self, timespan: DateTimeRange, chan: Channel, length: float, step: float = None
+    ) -> Iterator[ChannelData]:
+        chunks = self._read_chunks(timespan, chan)
+        if chunks is None:
+            return
+        # the chunks are whole miniSEED records, so they can be decoded as a single buffer
+        yield from iter_mseed_windows(b"".join(chunks), timespan, length, step)
+
+    def _read_chunks(self, timespan: DateTimeRange, chan: Channel) -> Optional[List[bytes]]:
+        """
+        Reads the (undecoded) miniSEED bytes of the channel for the timespan, or None if there is no data
+        """
         assert (
             timespan.start_datetime.year == timespan.end_datetime.year
         ), "Did not expect timespans to cross years"
@@ -117,11 +145,11 @@ class PNWDataStore(RawDataStore):
 
         if len(rst) == 0:
             logger.warning(f"Could not find file {timespan}/{chan} in the database")
-            return ChannelData.empty()
+            return None
         elif len(rst) > 10:
             # skip if stream has more than 10 gaps
             logger.warning(f"Too many gaps (>10) from {timespan}/{chan}")
-            return ChannelData.empty()
+            return None
 
         # reconstruct the file name from the channel parameters
         chan_str = f"{chan.station.name}.{chan.station.network}.{timespan.start_datetime.strftime('%Y.%j')}"
@@ -130,15 +158,14 @@ class PNWDataStore(RawDataStore):
         )
         if not self.fs.exists(filename):
             logger.warning(f"Could not find file {filename}")
-            return ChannelData.empty()
+            return None
 
-        stream = obspy.Stream()
+        chunks = []
         with self.fs.open(filename, "rb") as f:
             for byteoffset, bytes in rst:
                 f.seek(byteoffset)
-                buff = io.BytesIO(f.read(bytes))
-                stream += obspy.read(buff)
-        return ChannelData(stream)
+                chunks.append(f.read(bytes))
+        return chunks
 
     def get_inventory(self, timespan: DateTimeRange, station: Station) -> obspy.Inventory:
         return self.chan_catalog.get_inventory(timespan, station)
@@ -3,17 +3,18 @@ import os
 import re
 from abc import abstractmethod
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Callable, List
+from typing import Callable, Iterator, List, Tuple
 
 import obspy
 from datetimerange import DateTimeRange
 
+from .channel_filter_store import name_mask
 from .channelcatalog import ChannelCatalog
 from .datatypes import Channel, ChannelData, ChannelType, Station
-from .stores import RawDataStore
-from .utils import TimeLogger, fs_join, get_filesystem
+from .mseedindex import MiniSeedIndex, RecordIndex
+from .stores import RawDataStore, iter_mseed_windows, read_mseed
+from .utils import TimeLogger, fs_join, get_filesystem, iter_timespans
 
 logger = logging.getLogger(__name__)
 
@@ -32,6 +33,8 @@ class MiniSeedS3DataStore(RawDataStore):
         date_range: DateTimeRange = None,
         file_name_regex: str = None,
         storage_options: dict = {},
+        use_index: bool = False,
+        index_dir: str = None,
     ):
         """
         Parameters:
@@ -39,10 +42,14 @@ class MiniSeedS3DataStore(RawDataStore):
             chan_catalog: ChannelCatalog to retrieve inventory information for the channels
             chan_filter: Function to decide whether a channel should be used or not,
                             if None, all channels are used
+            use_index: Whether windowed reads should use a header-only record index of the files to only
+                       fetch the records in the window (see ``MiniSeedIndex``)
+            index_dir: Optional directory to persist the record indexes
         """
         super().__init__()
         self.file_re = re.compile(file_name_regex, re.IGNORECASE)
         self.fs = get_filesystem(path, storage_options=storage_options)
+        self.index = MiniSeedIndex(self.fs, index_dir, storage_options) if use_index else None
         self.chan_catalog = chan_catalog
         self.path = path
         self.paths = {}
@@ -63,11 +70,16 @@ class MiniSeedS3DataStore(RawDataStore):
         tlog = TimeLogger(logger=logger, level=logging.DEBUG, prefix="LOAD CHANNELS")
         msfiles = [f for f in self.fs.glob(fs_join(full_path, "*")) if self.file_re.match(f) is not None]
         tlog.log(f"listing {len(msfiles)} files from {full_path}")
-        for f in msfiles:
+        names = [self._parse_names(os.path.basename(f)) for f in msfiles]
+        # filter on the names before creating any Channel objects
+        mask = name_mask(chan_filter, names)
+        for i, f in enumerate(msfiles):
             timespan = self._parse_timespan(f)
             self.paths[timespan.start_datetime] = full_path
-            channel = self._parse_channel(os.path.basename(f))
-            if not chan_filter(channel):
+            if mask is not None and not mask[i]:
+                continue
+            channel = _create_channel(*names[i])
+            if mask is None and not chan_filter(channel):
                 continue
             key = str(timespan)  # DataTimeFrame is not hashable
             self.channels[key].append(channel)
@@ -90,25 +102,23 @@ class MiniSeedS3DataStore(RawDataStore):
     def get_channels(self, date_range: DateTimeRange) -> List[Channel]:
         self._ensure_channels_loaded(date_range)
         tmp_channels = self.channels.get(str(date_range), [])
-        executor = ThreadPoolExecutor()
-        stations = set(map(lambda c: c.station, tmp_channels))
-        _ = list(executor.map(lambda s: self.chan_catalog.get_inventory(date_range, s), stations))
         logger.info(f"Getting {len(tmp_channels)} channels for {date_range}")
-        return list(executor.map(lambda c: self.chan_catalog.get_full_channel(date_range, c), tmp_channels))
+        return self.chan_catalog.get_full_channels(date_range, tmp_channels)
 
     def get_timespans(self) -> List[DateTimeRange]:
+        return list(self.iter_timespans())
+
+    def iter_timespans(self) -> Iterator[DateTimeRange]:
+        """
+        Lazily yields the (daily) timespans of the store. Use ``utils.timespan_epochs`` for a compact array
+        version of a date range.
+        """
         if self.date_range is not None:
-            days = (self.date_range.end_datetime - self.date_range.start_datetime).days
-            return [
-                DateTimeRange(
-                    self.date_range.start_datetime.replace(tzinfo=timezone.utc) + timedelta(days=d),
-                    self.date_range.start_datetime.replace(tzinfo=timezone.utc) + timedelta(days=d + 1),
-                )
-                for d in range(0, days)
-            ]
-        return list([DateTimeRange.from_range_text(d) for d in sorted(self.channels.keys())])
-
-    def read_data(self, timespan: DateTimeRange, chan: Channel) -> ChannelData:
+            yield from iter_timespans(self.date_range, timedelta(days=1))
+        else:
+            yield from (DateTimeRange.from_range_text(d) for d in sorted(self.channels.keys()))
+
+    def read_data(self, timespan: DateTimeRange, chan: Channel, window: DateTimeRange = None) -> ChannelData:
         self._ensure_channels_loaded(timespan)
         # reconstruct the file name from the channel parameters
         filename = self._get_filename(timespan, chan)
@@ -116,11 +126,39 @@ class MiniSeedS3DataStore(RawDataStore):
             logger.warning(f"Could not find file {filename}")
             return ChannelData.empty()
 
+        if window is not None and self.index is not None:
+            return self.index.read_data(filename, window)
         with self.fs.open(filename) as f:
-            stream = obspy.read(f)
+            stream = read_mseed(f, window)
+        if len(stream) == 0:
+            return ChannelData.empty()
         data = ChannelData(stream)
         return data
 
+    def iter_windows(
+        self, timespan: DateTimeRange, chan: Channel, length: float, step: float = None
+    ) -> Iterator[ChannelData]:
+        self._ensure_channels_loaded(timespan)
+        filename = self._get_filename(timespan, chan)
+        if not self.fs.exists(filename):
+            logger.warning(f"Could not find file {filename}")
+            return
+        if self.index is not None:
+            yield from self.index.iter_windows(filename, timespan, length, step)
+            return
+        # fetch the (compressed) file once and only decode one window at a time
+        with self.fs.open(filename) as f:
+            buffer = f.read()
+        yield from iter_mseed_windows(buffer, timespan, length, step)
+
+    def get_record_index(self, timespan: DateTimeRange, chan: Channel) -> RecordIndex:
+        """
+        Returns the header-only record index of a channel's file, e.g. to find gaps without decoding the data
+        """
+        self._ensure_channels_loaded(timespan)
+        index = self.index or MiniSeedIndex(self.fs)
+        return index.get(self._get_filename(timespan, chan))
+
     def get_inventory(self, timespan: DateTimeRange, station: Station) -> obspy.Inventory:
         return self.chan_catalog.get_inventory(timespan, station)
 
@@ -136,6 +174,13 @@ class MiniSeedS3DataStore(RawDataStore):
     def _parse_channel(self, filename: str) -> Channel:
         pass
 
+    @abstractmethod
+    def _parse_names(self, filename: str) -> Tuple[str, str, str, str]:
+        """
+        Returns the (network, station, channel, location) names encoded in the file name
+        """
+        pass
+
     @abstractmethod
     def _parse_timespan(self, filename: str) -> DateTimeRange:
         pass
@@ -149,6 +194,8 @@ class SCEDCS3DataStore(MiniSeedS3DataStore):
         chan_filter: Callable[[Channel], bool] = lambda s: True,  # noqa: E731
         date_range: DateTimeRange = None,
         storage_options: dict = {},
+        use_index: bool = False,
+        index_dir: str = None,
     ):
         super().__init__(
             path,
@@ -158,21 +205,15 @@ class SCEDCS3DataStore(MiniSeedS3DataStore):
             # for checking the filename has the form: CIGMR__LHN___2022002.ms
             file_name_regex=r".*[0-9]{7}\.ms$",
             storage_options=storage_options,
+            use_index=use_index,
+            index_dir=index_dir,
         )
 
     def _parse_channel(self, filename: str) -> Channel:
-        # e.g.
-        # CIGMR__LHN___2022002
-        # CE13884HNZ10_2022002
-        network = filename[:2]
-        station = filename[2:7].rstrip("_")
-        channel = filename[7:10]
-        location = filename[10:12].strip("_")
-        return Channel(
-            ChannelType(channel, location),
-            # lat/lon/elev will be populated later
-            Station(network, station, location=location),
-        )
+        return _create_channel(*_parse_scedc_names(filename))
+
+    def _parse_names(self, filename: str) -> Tuple[str, str, str, str]:
+        return _parse_scedc_names(filename)
 
     def _parse_timespan(self, filename: str) -> DateTimeRange:
         # The SCEDC S3 bucket stores files in the form: CIGMR__LHN___2022002.ms
@@ -203,6 +244,8 @@ class NCEDCS3DataStore(MiniSeedS3DataStore):
         chan_filter: Callable[[Channel], bool] = lambda s: True,  # noqa: E731
         date_range: DateTimeRange = None,
         storage_options: dict = {},
+        use_index: bool = False,
+        index_dir: str = None,
     ):
         super().__init__(
             path,
@@ -212,23 +255,15 @@ class NCEDCS3DataStore(MiniSeedS3DataStore):
             # for checking the filename has the form: AAS.NC.EHZ..D.2020.002
             file_name_regex=r".*[0-9]{4}.*[0-9]{3}$",
             storage_options=storage_options,
+            use_index=use_index,
+            index_dir=index_dir,
         )
 
     def _parse_channel(self, filename: str) -> Channel:
-        # e.g.
-        # AAS.NC.EHZ..D.2020.002
-        split_fn = filename.split(".")
-        network = split_fn[1]
-        station = split_fn[0]
-        channel = split_fn[2]
-        location = split_fn[3]
-        if len(channel) > 3:
-            channel = channel[:3]
-        return Channel(
-            ChannelType(channel, location),
-            # lat/lon/elev will be populated later
-            Station(network, station, location=location),
-        )
+        return _create_channel(*_parse_ncedc_names(filename))
+
+    def _parse_names(self, filename: str) -> Tuple[str, str, str, str]:
+        return _parse_ncedc_names(filename)
 
     def _parse_timespan(self, filename: str) -> DateTimeRange:
         # The NCEDC S3 bucket stores files in the form: AAS.NC.EHZ..D.2020.002
@@ -247,3 +282,35 @@ class NCEDCS3DataStore(MiniSeedS3DataStore):
         return fs_join(
             self.paths[timespan.start_datetime], f"{chan_str}.{timespan.start_datetime.strftime('%Y.%j')}"
         )
+
+
+def _create_channel(network: str, station: str, channel: str, location: str) -> Channel:
+    return Channel(
+        ChannelType(channel, location),
+        # lat/lon/elev will be populated later
+        Station(network, station, location=location),
+    )
+
+
+def _parse_scedc_names(filename: str) -> Tuple[str, str, str, str]:
+    # e.g.
+    # CIGMR__LHN___2022002
+    # CE13884HNZ10_2022002
+    network = filename[:2]
+    station = filename[2:7].rstrip("_")
+    channel = filename[7:10]
+    location = filename[10:12].strip("_")
+    return network, station, channel, location
+
+
+def _parse_ncedc_names(filename: str) -> Tuple[str, str, str, str]:
+    # e.g.
+    # AAS.NC.EHZ..D.2020.002
+    split_fn = filename.split(".")
+    network = split_fn[1]
+    station = split_fn[0]
+    channel = split_fn[2]
+    location = split_fn[3]
+    if len(channel) > 3:
+        channel = channel[:3]
+    return network, station, channel, location
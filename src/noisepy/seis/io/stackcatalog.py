@@ -0,0 +1,229 @@
+import logging
+import sqlite3
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from datetimerange import DateTimeRange
+
+from .datatypes import Stack, Station
+from .stores import StackStore
+from .utils import TimeLogger
+
+logger = logging.getLogger(__name__)
+
+# stack parameters (see channelcatalog.cc_parameters) copied into the catalog
+PARAM_COLUMNS = ["dist", "azi", "baz", "ngood", "lonS", "latS", "lonR", "latR"]
+
+_CREATE_TABLE = (
+    "CREATE TABLE IF NOT EXISTS stacks ("
+    "src TEXT NOT NULL, rec TEXT NOT NULL, component TEXT NOT NULL, name TEXT NOT NULL, "
+    "start_ts REAL NOT NULL, end_ts REAL NOT NULL, "
+    + ", ".join(f"{c} REAL" for c in PARAM_COLUMNS)
+    + ", PRIMARY KEY (src, rec, component, name, start_ts, end_ts))"
+)
+_CREATE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS stacks_dist ON stacks (component, dist)",
+    "CREATE INDEX IF NOT EXISTS stacks_azi ON stacks (component, azi)",
+]
+
+
+@dataclass
+class StackEntry:
+    """
+    A catalog row: the key of a stack in its store plus the parameters used to select it
+    """
+
+    src: Station
+    rec: Station
+    component: str
+    name: str
+    timespan: DateTimeRange
+    dist: Optional[float]
+    azi: Optional[float]
+    baz: Optional[float]
+    ngood: Optional[float]
+    lonS: Optional[float]
+    latS: Optional[float]
+    lonR: Optional[float]
+    latR: Optional[float]
+
+
+class StackCatalog:
+    """
+    A SQLite side catalog with one row per (src, rec, component, stack name, timespan) and the distance,
+    azimuth, back azimuth, ngood and coordinates of the stack, so stacks can be selected without listing
+    the store or reading any arrays. The DB file must be on a local file system.
+    """
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        with self._connect() as db:
+            db.execute(_CREATE_TABLE)
+            for cmd in _CREATE_INDEXES:
+                db.execute(cmd)
+        db.close()
+
+    def add(self, timespan: DateTimeRange, src: Station, rec: Station, stacks: List[Stack]):
+        """
+        Adds (or replaces) the rows of the stacks of a station pair
+        """
+        start = timespan.start_datetime.timestamp()
+        end = timespan.end_datetime.timestamp()
+        rows = [
+            (str(src), str(rec), st.component, st.name, start, end, *_param_values(st.parameters))
+            for st in stacks
+        ]
+        placeholders = ", ".join(["?"] * (6 + len(PARAM_COLUMNS)))
+        with self._lock:
+            with self._connect() as db:
+                db.executemany(f"INSERT OR REPLACE INTO stacks VALUES ({placeholders})", rows)
+            db.close()
+
+    def index(
+        self,
+        store: StackStore,
+        pairs: List[Tuple[Station, Station]] = None,
+        executor: Executor = ThreadPoolExecutor(),
+    ):
+        """
+        Adds the stacks already in a store to the catalog, reading only their parameters
+        """
+        tlog = TimeLogger(logger=logger, level=logging.INFO, prefix="STACK CATALOG")
+        if pairs is None:
+            pairs = store.get_station_pairs()
+        timespans = {}
+        for src, rec in pairs:
+            for ts in store.get_timespans(src, rec):
+                timespans.setdefault(str(ts), (ts, []))[1].append((src, rec))
+        count = 0
+        for ts, ts_pairs in timespans.values():
+            for (src, rec), stacks in store.read_metadata_bulk(ts, ts_pairs, executor):
+                self.add(ts, src, rec, stacks)
+                count += len(stacks)
+        tlog.log(f"indexing {count} stacks of {len(pairs)} pairs")
+
+    def query(
+        self,
+        components: List[str] = None,
+        names: List[str] = None,
+        dist_range: Tuple[float, float] = None,
+        azi_range: Tuple[float, float] = None,
+        timespan: DateTimeRange = None,
+        src: Station = None,
+        rec: Station = None,
+    ) -> List[StackEntry]:
+        """
+        Returns the entries that match all the given conditions. Ranges are inclusive (in km and degrees)
+        and an azimuth range with min > max wraps around north, e.g. (350, 10). With a ``timespan``, the
+        entries that overlap it are returned.
+        """
+        conditions = []
+        args: List[Any] = []
+        for column, values in [("component", components), ("name", names)]:
+            if values is not None:
+                conditions.append(f"{column} IN ({', '.join(['?'] * len(values))})")
+                args.extend(values)
+        if dist_range is not None:
+            conditions.append("dist BETWEEN ? AND ?")
+            args.extend(dist_range)
+        if azi_range is not None:
+            op = "AND" if azi_range[0] <= azi_range[1] else "OR"
+            conditions.append(f"(azi >= ? {op} azi <= ?)")
+            args.extend(azi_range)
+        if timespan is not None:
+            conditions.append("start_ts < ? AND end_ts > ?")
+            args.extend([timespan.end_datetime.timestamp(), timespan.start_datetime.timestamp()])
+        for column, sta in [("src", src), ("rec", rec)]:
+            if sta is not None:
+                conditions.append(f"{column} = ?")
+                args.append(str(sta))
+        cmd = "SELECT * FROM stacks"
+        if len(conditions) > 0:
+            cmd += " WHERE " + " AND ".join(conditions)
+        cmd += " ORDER BY src, rec, start_ts, name, component"
+        with self._connect() as db:
+            rows = db.execute(cmd, args).fetchall()
+        db.close()
+        return [_parse_row(r) for r in rows]
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_file)
+
+
+class CatalogStackStore(StackStore):
+    """
+    This 'store' wraps another stack store and keeps a ``StackCatalog`` up to date with every ``append``
+    """
+
+    def __init__(self, store: StackStore, catalog: StackCatalog):
+        super().__init__()
+        self.store = store
+        self.catalog = catalog
+
+    def contains(self, src: Station, rec: Station, timespan: DateTimeRange) -> bool:
+        return self.store.contains(src, rec, timespan)
+
+    def append(self, timespan: DateTimeRange, src: Station, rec: Station, stacks: List[Stack]):
+        self.store.append(timespan, src, rec, stacks)
+        self.catalog.add(timespan, src, rec, stacks)
+
+    def get_timespans(self, src: Station, rec: Station) -> List[DateTimeRange]:
+        return self.store.get_timespans(src, rec)
+
+    def get_station_pairs(self) -> List[Tuple[Station, Station]]:
+        return self.store.get_station_pairs()
+
+    def read(
+        self,
+        timespan: DateTimeRange,
+        src: Station,
+        rec: Station,
+        components: List[str] = None,
+        lag_window: Tuple[float, float] = None,
+    ) -> List[Stack]:
+        return self.store.read(timespan, src, rec, components, lag_window)
+
+    def read_metadata(self, timespan: DateTimeRange, src: Station, rec: Station) -> List[Stack]:
+        return self.store.read_metadata(timespan, src, rec)
+
+    def read_lazy(self, timespan: DateTimeRange, src: Station, rec: Station) -> List[Stack]:
+        return self.store.read_lazy(timespan, src, rec)
+
+    def materialize(self, items: List[Stack], executor: Executor = ThreadPoolExecutor()) -> List[Stack]:
+        return self.store.materialize(items, executor)
+
+    def append_product(self, name: str, timespan: DateTimeRange, params: Dict[str, Any], data: np.ndarray):
+        self.store.append_product(name, timespan, params, data)
+
+    def read_product(self, name: str, timespan: DateTimeRange) -> Optional[Tuple[np.ndarray, Dict[str, Any]]]:
+        return self.store.read_product(name, timespan)
+
+    def query(self, *args, **kwargs) -> List[StackEntry]:
+        """
+        See ``StackCatalog.query``
+        """
+        return self.catalog.query(*args, **kwargs)
+
+
+def _param_values(params: Dict[str, Any]) -> List[Optional[float]]:
+    values = []
+    for col in PARAM_COLUMNS:
+        value = params.get(col, None)
+        if value is not None:
+            # ngood can be a list (one value per substack)
+            value = float(np.sum(value))
+        values.append(value)
+    return values
+
+
+def _parse_row(row: Tuple) -> StackEntry:
+    src, rec, component, name, start, end = row[:6]
+    timespan = DateTimeRange(
+        datetime.fromtimestamp(start, timezone.utc), datetime.fromtimestamp(end, timezone.utc)
+    )
+    return StackEntry(Station.parse(src), Station.parse(rec), component, name, timespan, *row[6:])
@@ -1,17 +1,22 @@
 import datetime
+import io
 import logging
 import os
 import re
 from abc import ABC, abstractmethod
 from concurrent.futures import Executor, ThreadPoolExecutor
-from typing import Generic, List, Optional, Tuple, TypeVar
+from typing import Any, Dict, Generic, Iterator, List, Optional, Tuple, TypeVar
 
+import numpy as np
 import obspy
 from datetimerange import DateTimeRange
 
 from .constants import DATE_FORMAT
 from .datatypes import AnnotatedData, Channel, ChannelData, CrossCorrelation, Stack, Station
-from .utils import TimeLogger, get_results
+from .utils import TimeLogger, get_results, iter_timespans
+
+# parameter with the [tmin, tmax] lags of data read with a lag window
+LAG_WINDOW_PARAM = "lag_window"
 
 
 class DataStore(ABC):
@@ -35,17 +40,96 @@ class RawDataStore(DataStore):
     """
 
     @abstractmethod
-    def read_data(self, timespan: DateTimeRange, chan: Channel) -> ChannelData:
+    def read_data(self, timespan: DateTimeRange, chan: Channel, window: DateTimeRange = None) -> ChannelData:
+        """
+        Reads the data of a channel for a timespan. If a ``window`` is given, only the data within it is
+        returned.
+        """
         pass
 
+    def iter_windows(
+        self, timespan: DateTimeRange, chan: Channel, length: float, step: float = None
+    ) -> Iterator[ChannelData]:
+        """
+        Yields the data of consecutive windows of ``length`` seconds every ``step`` seconds (defaults to
+        ``length``) within the timespan. Windows without data are skipped. This implementation reads the
+        whole timespan once and yields views of it.
+        """
+        data = self.read_data(timespan, chan)
+        for window in iter_timespans(
+            timespan, datetime.timedelta(seconds=step or length), datetime.timedelta(seconds=length)
+        ):
+            win_data = slice_window(data, window, chan)
+            if len(win_data.data) > 0:
+                yield win_data
+
     @abstractmethod
     def get_inventory(self, timespan: DateTimeRange, station: Station) -> obspy.Inventory:
         pass
 
+    def read_data_bulk(
+        self, timespan: DateTimeRange, channels: List[Channel], executor: Executor = ThreadPoolExecutor()
+    ) -> List[ChannelData]:
+        """
+        Reads the data for all the given channels (and timespan) in parallel. The results are in the
+        same order as the channels.
+        """
+        tlog = TimeLogger(level=logging.DEBUG, prefix="READ DATA BULK")
+        futures = [executor.submit(self.read_data, timespan, ch) for ch in channels]
+        results = get_results(futures, "Reading raw data")
+        tlog.log(f"loading {len(channels)} channels")
+        return results
+
 
 T = TypeVar("T", bound=AnnotatedData)
 
 
+def slice_window(data: ChannelData, window: Optional[DateTimeRange], chan: Channel = None) -> ChannelData:
+    """
+    Returns the samples of ``data`` within the [start, end) window as a view, or ``data`` if window is None
+    """
+    if window is None:
+        return data
+    start = window.start_datetime.timestamp() - data.start_timestamp
+    end = window.end_datetime.timestamp() - data.start_timestamp
+    first = min(max(0, int(np.ceil(start * data.sampling_rate - 1e-6))), len(data.data))
+    last = min(max(0, int(np.ceil(end * data.sampling_rate - 1e-6))), len(data.data))
+    last = max(first, last)
+    return ChannelData.from_array(
+        data.data[first:last], data.sampling_rate, data.start_timestamp + first / data.sampling_rate, chan
+    )
+
+
+def read_mseed(file: Any, window: DateTimeRange = None) -> obspy.Stream:
+    """
+    Reads a miniSEED file (path or file-like object). With a ``window``, only the records that overlap it
+    are decoded and the stream is trimmed to the [start, end) window.
+    """
+    if window is None:
+        return obspy.read(file)
+    start = obspy.UTCDateTime(window.start_datetime)
+    # the end time is inclusive in obspy
+    end = obspy.UTCDateTime(window.end_datetime) - 1e-6
+    stream = obspy.read(file, starttime=start, endtime=end)
+    stream.trim(start, end, nearest_sample=False)
+    return obspy.Stream([tr for tr in stream if tr.stats.npts > 0])
+
+
+def iter_mseed_windows(
+    buffer: bytes, timespan: DateTimeRange, length: float, step: float = None
+) -> Iterator[ChannelData]:
+    """
+    Yields the data of consecutive windows from the (undecoded) bytes of a miniSEED file, decoding only the
+    records that overlap each window. See ``RawDataStore.iter_windows``.
+    """
+    for window in iter_timespans(
+        timespan, datetime.timedelta(seconds=step or length), datetime.timedelta(seconds=length)
+    ):
+        stream = read_mseed(io.BytesIO(buffer), window)
+        if len(stream) > 0:
+            yield ChannelData(stream)
+
+
 class ComputedDataStore(Generic[T]):
     """
     A class for reading and writing cross-correlation data
@@ -74,7 +158,22 @@ class ComputedDataStore(Generic[T]):
         pass
 
     @abstractmethod
-    def read(self, timespan: DateTimeRange, src_sta: Station, rec_sta: Station) -> List[T]:
+    def read(
+        self,
+        timespan: DateTimeRange,
+        src_sta: Station,
+        rec_sta: Station,
+        components: List[str] = None,
+        lag_window: Tuple[float, float] = None,
+    ) -> List[T]:
+        """
+        Reads the data of a station pair for a timespan.
+
+        Args:
+            components: only read the data of these cross components (e.g. ['ZZ', 'ZR'])
+            lag_window: only read the lags within this [tmin, tmax] window (in seconds). The actual window,
+                aligned to the samples, is added to the parameters under ``lag_window`` (see ``lag_slice``).
+        """
         pass
 
     def read_bulk(
@@ -82,19 +181,97 @@ class ComputedDataStore(Generic[T]):
         timespan: DateTimeRange,
         pairs: List[Tuple[Station, Station]],
         executor: Executor = ThreadPoolExecutor(),
+        components: List[str] = None,
+        lag_window: Tuple[float, float] = None,
     ) -> List[Tuple[Tuple[Station, Station], List[T]]]:
         """
-        Reads the data for all the given station pairs (and timespan) in parallel.
+        Reads the data for all the given station pairs (and timespan) in parallel. See ``read``.
         """
         tlog = TimeLogger(level=logging.DEBUG, prefix="READ BULK")
-        futures = [executor.submit(self.read, timespan, p[0], p[1]) for p in pairs]
+        # only pass the selection when there is one, for stores that don't support it
+        selection = {
+            k: v for k, v in [("components", components), ("lag_window", lag_window)] if v is not None
+        }
+        futures = [executor.submit(self.read, timespan, p[0], p[1], **selection) for p in pairs]
         results = get_results(futures, "Reading data")
         tlog.log(f"loading {len(pairs)} stacks")
         return list(zip(pairs, results))
 
+    def read_lazy(self, timespan: DateTimeRange, src_sta: Station, rec_sta: Station) -> List[T]:
+        """
+        Reads the parameters of the data of a station pair and defers loading the arrays until their ``data``
+        is first accessed (see ``materialize`` to load many of them at once). Stores that can't defer the
+        loading return the loaded data.
+        """
+        return self.read(timespan, src_sta, rec_sta)
+
+    def materialize(self, items: List[T], executor: Executor = ThreadPoolExecutor()) -> List[T]:
+        """
+        Loads the data of lazily read instances in parallel and returns them. Instances that are already loaded
+        are left as they are.
+        """
+        tlog = TimeLogger(level=logging.DEBUG, prefix="MATERIALIZE")
+        pending = [item for item in items if not item.is_loaded()]
+        futures = [executor.submit(lambda item: item.data, item) for item in pending]
+        get_results(futures, "Loading data")
+        tlog.log(f"loading {len(pending)} arrays")
+        return items
+
+    def read_metadata(self, timespan: DateTimeRange, src_sta: Station, rec_sta: Station) -> List[T]:
+        """
+        Reads the parameters (e.g. dist, azi, ngood) of the data of a station pair, without its arrays.
+        The returned instances have an empty ``data`` array. Stores that can't read the parameters on their
+        own should override this; the default implementation reads the full data and drops it.
+        """
+        items = self.read(timespan, src_sta, rec_sta)
+        for item in items:
+            item.data = np.empty((0,) * item.data.ndim, dtype=item.data.dtype)
+        return items
+
+    def read_metadata_bulk(
+        self,
+        timespan: DateTimeRange,
+        pairs: List[Tuple[Station, Station]],
+        executor: Executor = ThreadPoolExecutor(),
+    ) -> List[Tuple[Tuple[Station, Station], List[T]]]:
+        """
+        Reads the parameters of all the given station pairs (and timespan) in parallel. See ``read_metadata``.
+        """
+        tlog = TimeLogger(level=logging.DEBUG, prefix="READ METADATA BULK")
+        futures = [executor.submit(self.read_metadata, timespan, p[0], p[1]) for p in pairs]
+        results = get_results(futures, "Reading metadata")
+        tlog.log(f"loading metadata of {len(pairs)} pairs")
+        return list(zip(pairs, results))
+
 
 class CrossCorrelationDataStore(ComputedDataStore[CrossCorrelation]):
-    pass
+    def read_substacks(
+        self,
+        timespan: DateTimeRange,
+        src_sta: Station,
+        rec_sta: Station,
+        rows: Tuple[int, int] = None,
+        window: DateTimeRange = None,
+        components: List[str] = None,
+        lag_window: Tuple[float, float] = None,
+    ) -> List[CrossCorrelation]:
+        """
+        Reads some of the rows (substacks) of the cross-correlations of a station pair: either the [first, last)
+        ``rows`` or the rows whose start ``time`` is within the ``window``. The ``time`` and ``ngood`` parameters
+        are sliced accordingly. This implementation reads all the rows and slices them.
+        """
+        selection = {
+            k: v for k, v in [("components", components), ("lag_window", lag_window)] if v is not None
+        }
+        ccs = self.read(timespan, src_sta, rec_sta, **selection)
+        for cc in ccs:
+            sl, cc.parameters = row_slice(cc.parameters, rows, window)
+            cc.data = cc.data[sl]
+        return ccs
+
+
+# directory for derived products (e.g. moveout stacks), not a station name so it's not listed as a pair
+PRODUCTS_DIR = "_products"
 
 
 class StackStore(ComputedDataStore[Stack]):
@@ -102,7 +279,66 @@ class StackStore(ComputedDataStore[Stack]):
     A class for reading and writing stack data
     """
 
-    pass
+    def append_product(self, name: str, timespan: DateTimeRange, params: Dict[str, Any], data: np.ndarray):
+        """
+        Writes a product derived from the stacks of a timespan, e.g. a moveout stack. Implemented by the ASDF,
+        Zarr and Numpy stack stores, other stores raise NotImplementedError.
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support derived products")
+
+    def read_product(self, name: str, timespan: DateTimeRange) -> Optional[Tuple[np.ndarray, Dict[str, Any]]]:
+        raise NotImplementedError(f"{type(self).__name__} does not support derived products")
+
+
+def lag_slice(
+    params: Dict[str, Any], lag_window: Optional[Tuple[float, float]]
+) -> Tuple[slice, Dict[str, Any]]:
+    """
+    Returns the slice of the lag axis within the [tmin, tmax] window (in seconds) of data with the given ``dt``
+    and ``maxlag`` parameters, and a copy of the parameters with the window aligned to the samples under
+    ``lag_window``. Without a window, returns the full slice and the parameters unchanged.
+    """
+    if lag_window is None:
+        return slice(None), params
+    if "dt" not in params or "maxlag" not in params:
+        raise ValueError("The dt and maxlag parameters are needed to select a lag window")
+    dt, maxlag = params["dt"], params["maxlag"]
+    nlag = int(round(2 * maxlag / dt)) + 1
+    first = min(max(int(np.ceil((lag_window[0] + maxlag) / dt - 1e-6)), 0), nlag)
+    last = min(max(int(np.floor((lag_window[1] + maxlag) / dt + 1e-6)) + 1, first), nlag)
+    params = {**params, LAG_WINDOW_PARAM: [-maxlag + first * dt, -maxlag + (last - 1) * dt]}
+    return slice(first, last), params
+
+
+def row_slice(
+    params: Dict[str, Any], rows: Optional[Tuple[int, int]], window: Optional[DateTimeRange]
+) -> Tuple[slice, Dict[str, Any]]:
+    """
+    Returns the slice of the substack rows to read, either the [first, last) ``rows`` or the rows whose start
+    time (``time`` parameter) is within the [start, end) ``window``, and a copy of the parameters with the
+    per-row ``time`` and ``ngood`` values sliced.
+    """
+    if rows is not None and window is not None:
+        raise ValueError("Either rows or a time window can be selected, not both")
+    if rows is None and window is None:
+        return slice(None), params
+    times = np.atleast_1d(np.asarray(params.get("time", []), dtype=np.float64))
+    if rows is not None:
+        sl = slice(*rows)
+    else:
+        if "time" not in params:
+            raise ValueError("The time parameter is needed to select a time window")
+        idx = np.flatnonzero(
+            (times >= window.start_datetime.timestamp()) & (times < window.end_datetime.timestamp())
+        )
+        sl = slice(int(idx[0]), int(idx[-1]) + 1) if len(idx) > 0 else slice(0, 0)
+    params = dict(params)
+    for key in ["time", "ngood"]:
+        value = params.get(key, None)
+        # only the per-row values, i.e. not the scalars of a single stack
+        if isinstance(value, (list, np.ndarray)) and len(value) == len(times):
+            params[key] = value[sl]
+    return sl, params
 
 
 def timespan_str(timespan: DateTimeRange) -> str:
@@ -1,15 +1,21 @@
 import errno
+import functools
 import logging
 import os
 import posixpath
+import threading
 import time
+from collections import OrderedDict
 from concurrent.futures import Future
-from typing import Any, Callable, Iterable, List
+from datetime import timedelta
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List
 from urllib.parse import urlparse
 
 import fsspec
 import numpy as np
 import psutil
+from datetimerange import DateTimeRange
+from scipy.signal import butter, sosfilt
 from tqdm.autonotebook import tqdm
 from tqdm.contrib.logging import logging_redirect_tqdm
 
@@ -68,6 +74,99 @@ def io_retry(func: Callable, *args, **kwargs) -> Any:
             time.sleep(FIND_RETRY_SLEEP * i)
 
 
+class ByteLRUCache:
+    """
+    A thread-safe least-recently-used cache bounded by the total size (in bytes) of its entries rather
+    than by the number of entries. The size of each entry is given by the caller when it is added, so
+    expensive objects (e.g. a parsed ``obspy.Inventory``) can be weighed by a cheap proxy such as the
+    size of the file they were read from.
+    """
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._items
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._items.get(key, None)
+            if item is None:
+                return default
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key: Hashable, value: Any, nbytes: int):
+        """
+        Add an entry to the cache, evicting the least recently used entries until it fits. Entries larger
+        than the cache itself are not stored.
+        """
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self._items[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._items.popitem(last=False)
+                self.nbytes -= evicted_bytes
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+
+class RateLimiter:
+    """
+    A thread-safe token bucket rate limiter. Tokens are added at ``rate`` per second up to ``burst`` and
+    each call to ``acquire()`` consumes one, blocking until a token is available. A single instance can be
+    shared by all the threads issuing requests to a service.
+    """
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        error_if(rate <= 0, f"The rate must be positive, got {rate}", ValueError)
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Take a token from the bucket, sleeping if needed. Returns the time spent waiting (in seconds).
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # Reserve the token even if it's not available yet so waiting threads are served in order
+            self._tokens -= 1
+            wait = 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+def file_version(info: Dict[str, Any]) -> str:
+    """
+    Given the ``fs.info()`` dictionary of a file, return a string that changes whenever the contents of
+    the file change: the ETag for object stores and the modification time for local files.
+    """
+    for key in ["ETag", "etag", "mtime", "LastModified", "last_modified", "created"]:
+        if info.get(key) is not None:
+            return f"{info[key]}-{info.get('size', '')}"
+    return str(info.get("size", ""))
+
+
 class TimeLogger:
     """
     A utility class to measure and log the time spent in code fragments. The basic usage is to call::
@@ -171,3 +270,83 @@ def remove_nan_rows(a: np.ndarray) -> np.ndarray:
     Remove rows from a 2D array that contain NaN values
     """
     return a[~np.isnan(a).any(axis=1)]
+
+
+@functools.lru_cache(maxsize=64)
+def bandpass_sos(freqmin: float, freqmax: float, df: float, corners: int = 4) -> np.ndarray:
+    """
+    Designs a Butterworth band-pass filter as second-order sections, the same way as
+    ``obspy.signal.filter.bandpass``. Designs are cached per (freqmin, freqmax, df, corners), so the returned
+    array is shared and must not be modified.
+    """
+    fe = 0.5 * df
+    low = freqmin / fe
+    high = freqmax / fe
+    error_if(low > 1, "Selected low corner frequency is above Nyquist.", ValueError)
+    if high - 1.0 > -1e-6:
+        utils_logger.warning(
+            f"Selected high corner frequency ({freqmax}) of bandpass is at or above Nyquist ({fe}). "
+            "Applying a high-pass instead."
+        )
+        return butter(corners, low, btype="highpass", output="sos")
+    return butter(corners, [low, high], btype="bandpass", output="sos")
+
+
+def bandpass_2d(
+    data: np.ndarray,
+    freqmin: float,
+    freqmax: float,
+    df: float,
+    corners: int = 4,
+    zerophase: bool = True,
+    axis: int = -1,
+) -> np.ndarray:
+    """
+    Band-pass filters all the traces of ``data`` at once along ``axis`` (e.g. a (ntrace, nlag) matrix of
+    cross-correlations). Equivalent to calling ``obspy.signal.filter.bandpass`` on each trace, but the filter
+    is designed only once and the filtering is vectorized.
+    """
+    sos = bandpass_sos(float(freqmin), float(freqmax), float(df), corners)
+    filtered = sosfilt(sos, data, axis=axis)
+    if zerophase:
+        filtered = np.flip(sosfilt(sos, np.flip(filtered, axis=axis), axis=axis), axis=axis)
+    return filtered
+
+
+def normalize_rows(data: np.ndarray, absolute: bool = True) -> np.ndarray:
+    """
+    Divides each row of a 2D array by its maximum (absolute) value, in place. Rows with a maximum of 0 are
+    left unchanged.
+    """
+    amax = np.max(np.abs(data) if absolute else data, axis=1, keepdims=True)
+    amax[amax == 0] = 1
+    data /= amax
+    return data
+
+
+def iter_timespans(
+    date_range: DateTimeRange, step: timedelta, length: timedelta = None
+) -> Iterator[DateTimeRange]:
+    """
+    Lazily yields timespans of ``length`` (defaults to ``step``) every ``step``, starting at the beginning of
+    ``date_range``. A last timespan that would extend past the end of the range is not included.
+    """
+    error_if(step <= timedelta(0), f"The step must be positive, got {step}", ValueError)
+    length = length or step
+    start = date_range.start_datetime
+    while start + length <= date_range.end_datetime:
+        yield DateTimeRange(start, start + length)
+        start += step
+
+
+def timespan_epochs(date_range: DateTimeRange, step: timedelta) -> np.ndarray:
+    """
+    Compact version of ``iter_timespans`` for bulk use: returns an int64 array of shape (n, 2) with the
+    start and end of each timespan in microseconds since 01/01/1970
+    """
+    error_if(step <= timedelta(0), f"The step must be positive, got {step}", ValueError)
+    step_us = step // timedelta(microseconds=1)
+    start_us = int(round(date_range.start_datetime.timestamp() * 1e6))
+    count = int((date_range.end_datetime - date_range.start_datetime) // step)
+    starts = start_us + np.arange(count, dtype=np.int64) * step_us
+    return np.stack([starts, starts + step_us], axis=1)
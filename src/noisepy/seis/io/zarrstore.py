@@ -1,17 +1,23 @@
+import functools
 import logging
+import re
 from pathlib import Path
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import numpy as np
 import zarr
 from datetimerange import DateTimeRange
 
 from .datatypes import CrossCorrelation, Stack
-from .hierarchicalstores import ArrayStore, HierarchicalStoreBase
+from .hierarchicalstores import ArrayStore, HierarchicalStoreBase, get_item
 from .stores import CrossCorrelationDataStore, StackStore, parse_timespan
 
 logger = logging.getLogger(__name__)
 
+FIRST_CHUNK_RE = re.compile(r"0(\.0)*")
+# target size of the chunks of 2D items (e.g. CCs with substacks), which are split by rows
+ROW_CHUNK_BYTES = 512 * 1024
+
 
 class ZarrStoreHelper(ArrayStore):
     """
@@ -23,6 +29,8 @@ class ZarrStoreHelper(ArrayStore):
         storage_options: options to pass to fsspec
     """
 
+    partial_reads = True
+
     def __init__(self, root_dir: str, mode: str, storage_options={}) -> None:
         super().__init__(root_dir, storage_options)
         logger.info(f"store creating at {root_dir}, mode={mode}, storage_options={storage_options}")
@@ -37,7 +45,7 @@ class ZarrStoreHelper(ArrayStore):
         array = self.root.create_dataset(
             path,
             data=data,
-            chunks=data.shape,
+            chunks=_chunks(data),
             dtype=data.dtype,
         )
         array.attrs.update(params)
@@ -50,10 +58,31 @@ class ZarrStoreHelper(ArrayStore):
         metadata.update(array.attrs)
         return (array[:], metadata)
 
-    def parse_path(self, path: str) -> Optional[Tuple[str, DateTimeRange]]:
-        if not path.endswith("0.0"):
+    def read_items(
+        self, path: str, select: Callable[[Dict[str, Any]], List[Tuple[int, Tuple]]]
+    ) -> Optional[Tuple[List[np.ndarray], Dict[str, Any]]]:
+        if path not in self.root:
+            return None
+        array = self.root[path]
+        metadata = {}
+        metadata.update(array.attrs)
+        # only the chunks of the selected items (and rows) are fetched
+        get = functools.partial(_get_selection, array)
+        return [get_item(get, metadata, i, index) for i, index in select(metadata)], metadata
+
+    def read_attrs(self, path: str) -> Optional[Dict[str, Any]]:
+        if path not in self.root:
             return None
+        # opening the array only reads its .zarray and .zattrs, not the chunks
+        metadata = {}
+        metadata.update(self.root[path].attrs)
+        return metadata
+
+    def parse_path(self, path: str) -> Optional[Tuple[str, DateTimeRange]]:
         parts = Path(path).parts
+        # only the first chunk of each array, e.g. 0.0 or 0.0.0
+        if len(parts) == 0 or FIRST_CHUNK_RE.fullmatch(parts[-1]) is None:
+            return None
         if len(parts) < 3:
             return None
         ts = parse_timespan(parts[-2])
@@ -63,12 +92,33 @@ class ZarrStoreHelper(ArrayStore):
 
 
 class ZarrCCStore(HierarchicalStoreBase, CrossCorrelationDataStore):
-    def __init__(self, root_dir: str, mode: str = "a", storage_options={}) -> None:
+    def __init__(self, root_dir: str, mode: str = "a", storage_options={}, ragged: bool = False) -> None:
         helper = ZarrStoreHelper(root_dir, mode, storage_options=storage_options)
-        super().__init__(helper, CrossCorrelation.load_instances)
+        super().__init__(helper, CrossCorrelation.load_instances, ragged)
 
 
 class ZarrStackStore(HierarchicalStoreBase, StackStore):
-    def __init__(self, root_dir: str, mode: str = "a", storage_options={}) -> None:
+    def __init__(self, root_dir: str, mode: str = "a", storage_options={}, ragged: bool = False) -> None:
         helper = ZarrStoreHelper(root_dir, mode, storage_options=storage_options)
-        super().__init__(helper, Stack.load_instances)
+        super().__init__(helper, Stack.load_instances, ragged)
+
+
+def _chunks(data: np.ndarray) -> Tuple[int, ...]:
+    # one chunk per item (e.g. component), so they can be read on their own, and for 2D items (e.g. substacks)
+    # chunks of consecutive rows so a time range can be read without the rest of the day
+    if data.ndim == 1:
+        # concatenated arrays of the ragged layout
+        return (max(1, min(len(data), ROW_CHUNK_BYTES // data.dtype.itemsize)),)
+    if data.ndim == 2:
+        return (1,) + data.shape[1:]
+    row_bytes = int(np.prod(data.shape[2:])) * data.dtype.itemsize
+    rows = max(1, min(data.shape[1], ROW_CHUNK_BYTES // max(row_bytes, 1)))
+    return (1, rows) + data.shape[2:]
+
+
+def _get_selection(array: zarr.Array, key: Tuple) -> np.ndarray:
+    # zarr fails on empty selections, so get the shape of the result from a (zero-strided) dummy array
+    shape = np.broadcast_to(np.empty((), dtype=array.dtype), array.shape)[key].shape
+    if 0 in shape:
+        return np.empty(shape, dtype=array.dtype)
+    return array[key]
@@ -3,6 +3,7 @@ from datetime import datetime, timedelta, timezone
 from typing import Dict
 
 import numpy as np
+import pytest
 from datetimerange import DateTimeRange
 
 from noisepy.seis.io.asdfstore import ASDFCCStore
@@ -67,6 +68,18 @@ def _ccstore_test_helper(ccstore: CrossCorrelationDataStore):
     assert_dict_equal(params, ccs[0].parameters)
     assert np.all(data == ccs[0].data)
 
+    meta_ccs = ccstore.read_metadata(ts1, src.station, rec.station)
+    assert [(c.src, c.rec) for c in meta_ccs] == [(src.type, rec.type)]
+    assert_dict_equal(params, meta_ccs[0].parameters)
+    assert meta_ccs[0].data.size == 0
+
+    # the first 5 lags
+    lag_window = (-params["maxlag"], -params["maxlag"] + 4 * params["dt"])
+    sel_ccs = ccstore.read(ts1, src.station, rec.station, components=["OR"], lag_window=lag_window)
+    assert [(c.src, c.rec) for c in sel_ccs] == [(src.type, rec.type)]
+    assert np.array_equal(sel_ccs[0].data, data[:, :5])
+    assert len(ccstore.read(ts1, src.station, rec.station, components=["ZZ"])) == 0
+
     wrong_ccs = ccstore.read(ts1, src.station, Station("nw", "wrong"))
     assert len(wrong_ccs) == 0
 
@@ -105,3 +118,47 @@ def test_numpyccstore(tmp_path):
     path = str(tmp_path)
     _ccstore_test_helper(NumpyCCStore(path))
     check_populated_store(NumpyCCStore(path))
+
+
+@pytest.mark.parametrize(
+    "store_factory",
+    [
+        ASDFCCStore,
+        ZarrCCStore,
+        NumpyCCStore,
+        lambda path: ZarrCCStore(path, ragged=True),
+        lambda path: NumpyCCStore(path, ragged=True),
+    ],
+)
+def test_read_substacks(store_factory, tmp_path):
+    store = store_factory(str(tmp_path))
+    start = ts1.start_datetime.timestamp()
+    params = {"dt": 0.5, "maxlag": 10, "time": start + 1800 * np.arange(48), "ngood": np.arange(48)}
+    data = np.random.random((48, 41)).astype(np.float32)
+    z_rec = ChannelType("bhz")
+    ccs = [
+        CrossCorrelation(src.type, rec.type, params, data),
+        CrossCorrelation(src.type, z_rec, params, data),
+    ]
+    store.append(ts1, src.station, rec.station, ccs)
+
+    # hours 2 to 5
+    window = DateTimeRange(ts1.start_datetime + timedelta(hours=2), ts1.start_datetime + timedelta(hours=5))
+    sub_ccs = store.read_substacks(ts1, src.station, rec.station, window=window, lag_window=(0, 10))
+    assert len(sub_ccs) == 2
+    assert np.array_equal(sub_ccs[0].data, data[4:10, 20:])
+    assert sub_ccs[0].parameters["time"] == (start + 1800 * np.arange(4, 10)).tolist()
+    assert list(sub_ccs[0].parameters["ngood"]) == list(range(4, 10))
+
+    sub_ccs = store.read_substacks(ts1, src.station, rec.station, rows=(40, 48), components=["OZ"])
+    assert [cc.rec for cc in sub_ccs] == [z_rec]
+    assert np.array_equal(sub_ccs[0].data, data[40:])
+
+    assert store.read_substacks(ts1, src.station, rec.station, window=ts2)[0].data.shape == (0, 41)
+    with pytest.raises(ValueError):
+        store.read_substacks(ts1, src.station, rec.station, rows=(0, 1), window=window)
+
+
+def test_ragged_ccstores(tmp_path):
+    _ccstore_test_helper(ZarrCCStore(str(tmp_path / "zarr"), ragged=True))
+    _ccstore_test_helper(NumpyCCStore(str(tmp_path / "numpy"), ragged=True))
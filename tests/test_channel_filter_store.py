@@ -3,7 +3,7 @@ import os
 from test_channelcatalog import MockCatalog
 from test_scedc_s3store import timespan1
 
-from noisepy.seis.io.channel_filter_store import LocationChannelFilterStore, channel_filter
+from noisepy.seis.io.channel_filter_store import LocationChannelFilterStore, channel_filter, name_mask
 from noisepy.seis.io.datatypes import Channel, ChannelType, Station
 from noisepy.seis.io.s3store import SCEDCS3DataStore
 
@@ -44,3 +44,45 @@ def test_filter():
     assert check(staX, "CHE") is False  # invalid channel name
     assert check(staZ, "BHE") is False  # invalid station
     assert check(staZ, "CHE") is False  # invalid station and channel name
+
+
+def test_filter_wildcards():
+    f = channel_filter(["*"], ["sta?", "AB*"], ["BH", "H?Z"])
+    assert f(Channel(ChannelType("BHE"), Station("CI", "staX")))
+    assert f(Channel(ChannelType("HNZ"), Station("CI", "ABCD")))
+    assert not f(Channel(ChannelType("EHZ"), Station("CI", "ABCD")))
+    assert not f(Channel(ChannelType("BHE"), Station("CI", "XYZ")))
+
+
+def test_filter_channels():
+    f = channel_filter(["BK", "C?"], ["sta*"], ["BHE", "HH?"])
+    channels = [
+        Channel(ChannelType("BHE"), Station("BK", "staX")),
+        Channel(ChannelType("HHZ"), Station("CI", "staY")),
+        Channel(ChannelType("BHE"), Station("NC", "staX")),
+        Channel(ChannelType("EHZ"), Station("BK", "staX")),
+        Channel(ChannelType("BHE"), Station("BK", "other")),
+    ]
+    mask = f.filter_channels(channels)
+    assert mask.tolist() == [True, True, False, False, False]
+    assert mask.tolist() == [f(ch) for ch in channels]
+    assert f.filter_channels([]).shape == (0,)
+
+
+def test_name_mask():
+    names = [("BK", "staX", "BHE", "00"), ("CI", "staX", "BHE", "")]
+    f = channel_filter(["BK"], ["*"], ["BH?"])
+    assert name_mask(f, names).tolist() == [True, False]
+    assert name_mask(f, []).shape == (0,)
+    # arbitrary functions have to be evaluated on the channels
+    assert name_mask(lambda ch: True, names) is None
+
+
+def test_sql_condition():
+    f = channel_filter(["BK", "C?"], ["*"], ["BH*"])
+    assert f.sql_condition() == "(network LIKE 'BK%' OR network LIKE 'C_%') AND (channel LIKE 'BH%%')"
+    # regular expressions can't be pushed down as LIKE patterns, the field is only checked in Python
+    f = channel_filter(["BK"], ["sta[XY]"], ["BHE|HHZ"])
+    assert f.sql_condition() == "(network LIKE 'BK%')"
+    assert f.match("BK", "staY", "HHZ")
+    assert channel_filter(["*"], ["^sta"], ["*"]).sql_condition() == ""
@@ -1,4 +1,9 @@
+import io
 import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
 
 import obspy
 import pandas as pd
@@ -6,14 +11,17 @@ import pytest
 from datetimerange import DateTimeRange
 from obspy import UTCDateTime
 
+from noisepy.seis.io import channelcatalog
 from noisepy.seis.io.channelcatalog import (
     ChannelCatalog,
+    CoordinateTable,
     CSVChannelCatalog,
     FDSNChannelCatalog,
     XMLStationChannelCatalog,
     stats2inv_mseed,
 )
 from noisepy.seis.io.datatypes import Channel, ChannelType, Station
+from noisepy.seis.io.utils import ByteLRUCache
 
 chan_data = [("ARV", "BHE", 35.1269, -118.83009, 258.0), ("BAK", "BHZ", 35.34444, -119.10445, 116.0)]
 
@@ -35,6 +43,28 @@ def test_CSVChannelCatalog(sta: str, cha: str, lat: float, lon: float, elev: flo
     assert len(content["channels"]) == len(cat.df)
 
 
+def test_CSVChannelCatalogBulk():
+    cat = CSVChannelCatalog(file)
+    chans = [Channel(ChannelType(cha), Station("CI", sta)) for sta, cha, *_ in chan_data]
+    chans.append(Channel(ChannelType("BHZ"), Station("XX", "ARV")))  # matched by station name only
+    chans.append(Channel(ChannelType("BHZ"), Station("CI", "MISSING")))
+    full_chans = cat.get_full_channels(DateTimeRange(), chans)
+    assert len(full_chans) == len(chans)
+    for (sta, cha, lat, lon, elev), full_ch in zip(chan_data, full_chans):
+        assert (full_ch.station.lat, full_ch.station.lon, full_ch.station.elevation) == (lat, lon, elev)
+        assert full_ch == cat.get_full_channel(DateTimeRange(), Channel(ChannelType(cha), Station("CI", sta)))
+    assert full_chans[-2].station.lat == chan_data[0][2]
+    assert not full_chans[-1].station.valid()
+
+    inv = cat.get_inventory(DateTimeRange(), Station("CI", "ARV"))
+    content = inv.get_contents()
+    assert [s.split()[0] for s in content["stations"]] == ["CI.ARV"]
+    assert len(content["channels"]) == len(cat.df[cat.df["station"] == "ARV"])
+    # per-station inventories are cached
+    assert cat.get_inventory(DateTimeRange(), Station("CI", "ARV"))[0][0] is inv[0][0]
+    assert len(cat.get_inventory(DateTimeRange(), Station("CI", "MISSING"))) == 0
+
+
 class MockCatalog(ChannelCatalog):
     def get_full_channel(self, timespan: DateTimeRange, channel: Channel) -> Channel:
         return channel
@@ -67,6 +97,53 @@ def test_frominventory(station: str, ch: str, lat: float, lon: float, elev: floa
     assert full_ch.station.elevation == elev
 
 
+def test_get_full_channels():
+    df = pd.read_csv(file)
+
+    class InventoryCatalog(ChannelCatalog):
+        calls = 0
+
+        def get_inventory(self, timespan: DateTimeRange, station: Station) -> obspy.Inventory:
+            self.calls += 1
+            return CSVChannelCatalog(file).get_inventory(timespan, station)
+
+    cat = InventoryCatalog()
+    chans = [Channel(ChannelType(cha), Station("CI", "ARV")) for cha in ["BHE", "BHN", "BHZ", "XXX"]]
+    full_chans = cat.get_full_channels(DateTimeRange(), chans)
+    # one inventory per station
+    assert cat.calls == 1
+    row = df[df["station"] == "ARV"].iloc[0]
+    for ch in full_chans[:3]:
+        assert (ch.station.lat, ch.station.lon, ch.station.elevation) == (
+            row["latitude"],
+            row["longitude"],
+            row["elevation"],
+        )
+    # channels not in the inventory are returned as is
+    assert full_chans[3] is chans[3]
+    assert cat.get_full_channel(DateTimeRange(), chans[0]) == full_chans[0]
+
+
+def test_get_full_channel_index_cache():
+    inv = CSVChannelCatalog(file).get_inventory(DateTimeRange(), Station("CI", "ARV"))
+
+    class InventoryCatalog(ChannelCatalog):
+        def get_inventory(self, timespan: DateTimeRange, station: Station) -> obspy.Inventory:
+            return inv
+
+    cat = InventoryCatalog()
+    chans = [Channel(ChannelType(cha), Station("CI", "ARV")) for cha in ["BHE", "BHN"]]
+    with mock.patch(
+        "noisepy.seis.io.channelcatalog._coordinate_index", wraps=channelcatalog._coordinate_index
+    ) as index_mock, mock.patch("noisepy.seis.io.channelcatalog.ThreadPoolExecutor") as executor_mock:
+        full_chans = [cat.get_full_channel(DateTimeRange(), ch) for ch in chans]
+        # the inventory is indexed once and single lookups don't need an executor
+        index_mock.assert_called_once()
+        executor_mock.assert_not_called()
+    assert full_chans[0].station.lat == inv[0][0].latitude
+    assert cat.get_full_channels(DateTimeRange(), chans) == full_chans
+
+
 xmlpaths = [
     os.path.join(os.path.dirname(__file__), "./data/stationxml/CI/"),
     "s3://scedc-pds/FDSNstationXML/CI/",
@@ -92,6 +169,54 @@ def test_XMLStationChannelCatalogCustomPath():
     assert len(yaq_inv.networks[0].stations) == 1
 
 
+def test_XMLStationChannelCatalogCache(tmp_path):
+    cache_dir = str(tmp_path)
+    cat = XMLStationChannelCatalog(xmlpaths[0], cache_dir=cache_dir, memory_cache=ByteLRUCache(1024**3))
+    yaq_inv = cat.get_inventory(DateTimeRange(), Station("CI", "YAQ"))
+    assert len(cat.memory_cache) == 1
+
+    # A new catalog (with an empty memory cache) should be served from the disk cache without parsing XML
+    cat2 = XMLStationChannelCatalog(xmlpaths[0], cache_dir=cache_dir, memory_cache=ByteLRUCache(1024**3))
+    with mock.patch("noisepy.seis.io.channelcatalog.read_inventory") as read_mock:
+        inv = cat2.get_inventory(DateTimeRange(), Station("CI", "YAQ"))
+        read_mock.assert_not_called()
+    assert inv == yaq_inv
+
+    # Inventories that don't fit are not kept in memory
+    cat3 = XMLStationChannelCatalog(xmlpaths[0], memory_cache=ByteLRUCache(10))
+    cat3.get_inventory(DateTimeRange(), Station("CI", "YAQ"))
+    assert len(cat3.memory_cache) == 0
+
+
+def test_XMLStationChannelCatalogRevalidate():
+    cat = XMLStationChannelCatalog(xmlpaths[0], memory_cache=ByteLRUCache(1024**3))
+    yaq = Station("CI", "YAQ")
+    inv = cat.get_inventory(DateTimeRange(), yaq)
+    # memory hits don't stat the file
+    with mock.patch.object(cat.fs, "info", wraps=cat.fs.info) as info_mock:
+        assert cat.get_inventory(DateTimeRange(), yaq) is inv
+        info_mock.assert_not_called()
+
+    # after the revalidation interval the file is checked, but not parsed again if it hasn't changed
+    cat.revalidate_seconds = 0
+    with mock.patch.object(cat.fs, "info", wraps=cat.fs.info) as info_mock, mock.patch(
+        "noisepy.seis.io.channelcatalog.read_inventory"
+    ) as read_mock:
+        assert cat.get_inventory(DateTimeRange(), yaq) is inv
+        info_mock.assert_called_once()
+        read_mock.assert_not_called()
+
+    # a changed file is parsed again
+    with mock.patch("noisepy.seis.io.channelcatalog.file_version", return_value="new"):
+        assert cat.get_inventory(DateTimeRange(), yaq) is not inv
+
+
+def test_sleep_time_deprecated(tmp_path):
+    with pytest.warns(DeprecationWarning, match="sleep_time"):
+        cat = FDSNChannelCatalog("IRIS", str(tmp_path), sleep_time=4)
+    assert cat.rate_limiter.rate == 0.25
+
+
 def test_FDSNStationChannelCatalog(tmp_path: str):
     cat = FDSNChannelCatalog("IRIS", tmp_path)
     chan = Channel(ChannelType("BHZ"), Station("UW", "SEP"))
@@ -103,3 +228,86 @@ def test_FDSNStationChannelCatalog(tmp_path: str):
     chan = Channel(ChannelType("ABC"), Station("UW", "DEF"))
     yaq_inv = cat.get_inventory(DateTimeRange(), chan.station)
     assert len(yaq_inv) == 0
+
+
+@pytest.fixture
+def fdsn_server():
+    """A local stand-in for an FDSN station web service, serving the StationXML files in data/stationxml/CI"""
+    inv = obspy.read_inventory(os.path.join(xmlpaths[0], "*.xml"))
+    queries = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            queries.append(query)
+            selected = obspy.Inventory()
+            for sta in query["station"][0].split(","):
+                selected += inv.select(network=query["network"][0], station=sta)
+            if len(selected) == 0:
+                self.send_response(204)
+                self.end_headers()
+                return
+            buf = io.BytesIO()
+            selected.write(buf, format="STATIONXML")
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(buf.getvalue())
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", queries
+    server.shutdown()
+
+
+def test_FDSNChannelCatalogBulk(tmp_path, fdsn_server):
+    url, queries = fdsn_server
+    cat = FDSNChannelCatalog(
+        url, str(tmp_path), requests_per_second=100, client_kwargs={"_discover_services": False}
+    )
+    stations = [Station("CI", "YAQ"), Station("CI", "WBM"), Station("CI", "NONE")]
+    # all stations of a network are fetched in a single (channel level) request
+    cat.prefetch(DateTimeRange(), stations)
+    assert len(queries) == 1
+    assert sorted(queries[0]["station"][0].split(",")) == ["NONE", "WBM", "YAQ"]
+    assert queries[0]["level"] == ["channel"]
+    full_ch = cat.get_full_channel(DateTimeRange(), Channel(ChannelType("EHZ"), stations[0]))
+    assert full_ch.station.valid()
+    missing_ch = cat.get_full_channel(DateTimeRange(), Channel(ChannelType("EHZ"), stations[2]))
+    assert not missing_ch.station.valid()
+    assert len(queries) == 1
+
+    # responses are only requested when the inventories are needed
+    invs = cat.get_inventories(DateTimeRange(), stations)
+    assert len(queries) == 2
+    assert queries[1]["level"] == ["response"]
+    assert invs[stations[0]].get_contents()["stations"][0].startswith("CI.YAQ")
+    assert invs[stations[1]].get_contents()["stations"][0].startswith("CI.WBM")
+    assert len(invs[stations[2]]) == 0
+
+    # a new catalog with the same cache dir shouldn't hit the service
+    cat2 = FDSNChannelCatalog(url, str(tmp_path), client_kwargs={"_discover_services": False})
+    assert len(cat2.get_inventory(DateTimeRange(), stations[1])) == 1
+    assert cat2.get_full_channel(DateTimeRange(), Channel(ChannelType("EHZ"), stations[0])) == full_ch
+    assert len(queries) == 2
+
+
+def test_coordinate_table():
+    inv = obspy.read_inventory(os.path.join(xmlpaths[0], "*.xml"))
+    table = CoordinateTable.from_inventory(inv)
+    assert len(table) == len(inv.get_contents()["channels"])
+    yaq = table.select("CI", "YAQ")
+    assert set(yaq.station) == {"YAQ"}
+
+    cha = inv.select(network="CI", station="YAQ", channel="EHZ")[0][0][0]
+    assert yaq.lookup("CI", "YAQ", "EHZ") == (cha.latitude, cha.longitude, cha.elevation)
+    assert yaq.lookup("CI", "YAQ", "EHZ", cha.start_date.timestamp + 1) == (
+        cha.latitude,
+        cha.longitude,
+        cha.elevation,
+    )
+    assert yaq.lookup("CI", "YAQ", "BHZ") is None
+    assert len(CoordinateTable.from_inventory(obspy.Inventory())) == 0
@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from unittest.mock import MagicMock
 
@@ -105,3 +106,34 @@ def test_empty_stores(span):
     store = CompositeRawStore({})
     assert store.get_channels(span) == []
     assert store.get_timespans() == []
+
+
+def test_read_data_bulk_routes_by_network(span):
+    ci_store = _mock_store([], [span])
+    bk_store = _mock_store([], [span])
+    ci_store.read_data_bulk.side_effect = lambda ts, chans, *ex: [f"CI{i}" for i in range(len(chans))]
+    bk_store.read_data_bulk.side_effect = lambda ts, chans, *ex: [f"BK{i}" for i in range(len(chans))]
+    store = CompositeRawStore({"CI": ci_store, "BK": bk_store})
+    chans = [_channel("CI", "WBM"), _channel("BK", "THIS"), _channel("CI", "SDD")]
+
+    results = store.read_data_bulk(span, chans)
+
+    assert results == ["CI0", "BK0", "CI1"]
+    assert ci_store.read_data_bulk.call_args[0][1] == [chans[0], chans[2]]
+    assert bk_store.read_data_bulk.call_args[0][1] == [chans[1]]
+
+
+def test_read_data_bulk_unknown_network_raises(composite, span):
+    with pytest.raises(ValueError, match="XX"):
+        composite.read_data_bulk(span, [_channel("XX", "UNKN")])
+
+
+def test_executor_owned_by_caller(ci_store, bk_store, span):
+    # without an executor, no pool outlives the calls
+    assert CompositeRawStore({"CI": ci_store, "BK": bk_store}).executor is None
+    executor = MagicMock(wraps=ThreadPoolExecutor(max_workers=1))
+    store = CompositeRawStore({"CI": ci_store, "BK": bk_store}, executor)
+    assert len(store.get_channels(span)) == 2
+    assert executor.submit.call_count == 2
+    executor.shutdown.assert_not_called()
+    executor.shutdown()
@@ -2,13 +2,18 @@ import logging
 
 logging.basicConfig(level=logging.INFO)
 
+import json
 import os
-from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 
+import h5py
+import numpy as np
 import pytest
+import zarr
 from datetimerange import DateTimeRange
 
-from noisepy.seis.io.h5store import DASH5DataStore
+from noisepy.seis.io.h5store import DASH5DataStore, _contiguous_runs
 from noisepy.seis.io.stores import RawDataStore
 
 timespan1 = DateTimeRange(
@@ -56,3 +61,193 @@ def test_read_data(store: RawDataStore):
     assert len(channels) == 3
     data = store.read_data(timespan2, channels[0])
     assert data.data.shape == (120,)
+
+
+@pytest.mark.parametrize("store", stores)
+def test_read_block(store: DASH5DataStore):
+    store.get_channels(timespan2)
+    data, starttime, fs = store.read_block(timespan2, [2, 0, 1, 0])
+    assert data.shape == (4, 120)
+    assert fs == 2
+    assert starttime == timespan2.start_datetime.timestamp()
+    for row, number in enumerate([2, 0, 1, 0]):
+        assert np.array_equal(data[row], store.read_data(timespan2, store._parse_channel(number)).data)
+    assert len(store.blocks) == 1
+    with h5py.File(os.path.join(os.path.dirname(__file__), "./data/das/2021-10-15-01-02-03.h5")) as f:
+        assert np.array_equal(data[0], f["/Acquisition/Raw[0]/RawData"][:, 2])
+
+
+def test_contiguous_runs():
+    assert _contiguous_runs(np.array([0, 1, 2, 5, 6, 9])) == [(0, 3), (3, 5), (5, 6)]
+    assert _contiguous_runs(np.array([], dtype=int)) == []
+
+
+@pytest.mark.parametrize("store", stores)
+def test_read_data_bulk(store: DASH5DataStore):
+    channels = store.get_channels(timespan2)
+    block = store.read_channel_block(timespan2, channels)
+    assert block.data.shape == (3, 120)
+    assert block.channels == channels
+    bulk = store.read_data_bulk(timespan2, channels)
+    for ch, cd in zip(channels, bulk):
+        assert np.array_equal(cd.data, store.read_data(timespan2, ch).data)
+        assert cd.stream[0].stats.station == ch.station.name
+
+
+def _write_das_file(path: str, start: datetime, nsamples: int, nchannels: int, fs: float):
+    data = np.arange(nsamples * nchannels, dtype=np.float64).reshape(nsamples, nchannels)
+    data += start.timestamp() * fs * nchannels
+    with h5py.File(os.path.join(path, start.strftime("%Y-%m-%d-%H-%M-%S.h5")), "w") as f:
+        f["/Acquisition/Raw[0]/RawData"] = data
+        f["/Acquisition/Raw[0]/RawDataTime"] = (start.timestamp() + np.arange(nsamples) / fs) * 1e6
+    return data
+
+
+def test_read_block_multiple_files(tmp_path):
+    start = datetime(2021, 10, 15, 1, 0, 0, tzinfo=timezone.utc)
+    # three one minute files with a missing minute between the last two
+    files = {m: _write_das_file(str(tmp_path), start + timedelta(minutes=m), 120, 4, 2) for m in [0, 1, 3]}
+    store = DASH5DataStore(str(tmp_path), 2, [0, 1, 2, 3])
+    span = DateTimeRange(start + timedelta(seconds=30), start + timedelta(minutes=4))
+    assert len(store.get_channels(span)) == 4
+
+    data, starttime, fs = store.read_block(span, [3, 1])
+    assert starttime == span.start_datetime.timestamp()
+    assert data.shape == (2, 420)
+    assert np.array_equal(data[0, :60], files[0][60:, 3])
+    assert np.array_equal(data[1, 60:180], files[1][:, 1])
+    assert data.mask[:, 180:300].all()
+    assert not data.mask[:, :180].any() and not data.mask[:, 300:].any()
+    assert np.array_equal(data[0, 300:], files[3][:, 3])
+
+    # a timespan covered by a single file is read as is
+    one = DateTimeRange(start, start + timedelta(minutes=1))
+    data, _, _ = store.read_block(one, [0])
+    assert not np.ma.isMaskedArray(data)
+    assert np.array_equal(data[0], files[0][:, 0])
+    assert (
+        store.read_block(DateTimeRange(start - timedelta(hours=2), start - timedelta(hours=1)), [0]) is None
+    )
+
+
+def test_read_block_single_file_bounds(tmp_path):
+    start = datetime(2021, 10, 15, 1, 0, 0, tzinfo=timezone.utc)
+    file = _write_das_file(str(tmp_path), start, 120, 2, 2)
+    store = DASH5DataStore(str(tmp_path), 2, [0, 1])
+    chan = store.get_channels(DateTimeRange(start, start + timedelta(minutes=1)))[1]
+
+    # a span that covers part of a file is trimmed to the span
+    half = DateTimeRange(start, start + timedelta(seconds=30))
+    data, _, _ = store.read_block(half, [1])
+    assert data.shape == (1, 60)
+    assert np.array_equal(data[0], file[:60, 1])
+    window = DateTimeRange(start + timedelta(seconds=10), start + timedelta(seconds=20))
+    assert np.array_equal(store.read_data(half, chan, window).data, file[20:40, 1])
+
+    # a span that extends past the last file is padded and masked
+    data, starttime, _ = store.read_block(DateTimeRange(start, start + timedelta(minutes=10)), [1])
+    assert starttime == start.timestamp()
+    assert data.shape == (1, 1200)
+    assert np.array_equal(data[0, :120], file[:, 1])
+    assert not data.mask[:, :120].any() and data.mask[:, 120:].all()
+
+
+def test_read_block_bounded_executor(tmp_path):
+    start = datetime(2021, 10, 15, 1, 0, 0, tzinfo=timezone.utc)
+    for m in range(3):
+        _write_das_file(str(tmp_path), start + timedelta(minutes=m), 120, 2, 2)
+    # reads issued from a single worker of a caller's executor must not wait on that executor, and the
+    # store reads the files on its own pool of at most max_file_readers threads
+    executor = ThreadPoolExecutor(max_workers=1)
+    store = DASH5DataStore(str(tmp_path), 2, [0, 1], max_file_readers=1)
+    assert store._file_executor is None
+    span = DateTimeRange(start, start + timedelta(minutes=3))
+    data, _, _ = executor.submit(store.read_block, span, [0, 1]).result(timeout=30)
+    assert data.shape == (2, 360)
+    assert store._file_executor._max_workers == 1
+    executor.shutdown()
+
+
+def _write_references(h5file: str, ref_file: str):
+    # kerchunk style references for the (contiguous, uncompressed) datasets of a file
+    refs = {".zgroup": json.dumps({"zarr_format": 2})}
+    with h5py.File(h5file) as f:
+        for name in ["Acquisition", "Acquisition/Raw[0]"]:
+            refs[f"{name}/.zgroup"] = json.dumps({"zarr_format": 2})
+        for name in ["Acquisition/Raw[0]/RawData", "Acquisition/Raw[0]/RawDataTime"]:
+            dset = f[name]
+            zarray = {
+                "zarr_format": 2,
+                "shape": dset.shape,
+                "chunks": dset.shape,
+                "dtype": dset.dtype.str,
+                "compressor": None,
+                "filters": None,
+                "fill_value": None,
+                "order": "C",
+            }
+            refs[f"{name}/.zarray"] = json.dumps(zarray)
+            refs[f"{name}/" + ".".join(["0"] * dset.ndim)] = [
+                h5file,
+                dset.id.get_offset(),
+                dset.id.get_storage_size(),
+            ]
+    with open(ref_file, "w") as f:
+        json.dump({"version": 1, "refs": refs}, f)
+
+
+def test_read_block_references(tmp_path):
+    path = os.path.join(os.path.dirname(__file__), "./data/das")
+    h5file = os.path.abspath(os.path.join(path, "2021-10-15-01-02-03.h5"))
+    _write_references(h5file, str(tmp_path / "2021-10-15-01-02-03.h5.json"))
+    store = DASH5DataStore(path, 2, [0, 1, 2], reference_dir=str(tmp_path))
+    with store._open(h5file) as f:
+        assert isinstance(f, zarr.Group)
+    data, starttime, _ = store.read_block(timespan2, [2, 0])
+    expected, expected_start, _ = stores[1].read_block(timespan2, [2, 0])
+    assert np.array_equal(data, expected)
+    assert starttime == expected_start
+
+
+def test_generate_references_requires_reference_dir():
+    pytest.importorskip("kerchunk")
+    with pytest.raises(ValueError):
+        stores[1].generate_references()
+
+
+def test_iter_timespans(tmp_path):
+    start = datetime(2021, 10, 15, 1, 0, 0, tzinfo=timezone.utc)
+    for m in [0, 1, 3]:
+        _write_das_file(str(tmp_path), start + timedelta(minutes=m), 120, 2, 2)
+    store = DASH5DataStore(str(tmp_path), 2, [0, 1])
+    assert [t.start_datetime for t in store.iter_timespans()] == [
+        start + timedelta(minutes=m) for m in [0, 1, 3]
+    ]
+    spans = list(store.iter_timespans(chunk=timedelta(minutes=3)))
+    assert spans == [
+        DateTimeRange(start, start + timedelta(minutes=3)),
+        DateTimeRange(start + timedelta(minutes=3), start + timedelta(minutes=6)),
+    ]
+    assert store.read_block(spans[0], [0])[0].shape == (1, 360)
+
+    dr = DateTimeRange(start, start + timedelta(hours=2))
+    store = DASH5DataStore(str(tmp_path), 2, [0, 1], date_range=dr)
+    assert len(store.get_timespans()) == 120
+    assert len(list(store.iter_timespans(chunk=timedelta(minutes=30)))) == 4
+
+
+@pytest.mark.parametrize("store", stores)
+def test_read_data_window(store: DASH5DataStore):
+    chan = store.get_channels(timespan2)[1]
+    full = store.read_data(timespan2, chan)
+    window = DateTimeRange(
+        timespan2.start_datetime + timedelta(seconds=10), timespan2.start_datetime + timedelta(seconds=20)
+    )
+    data = store.read_data(timespan2, chan, window)
+    assert np.array_equal(data.data, full.data[20:40])
+    assert data.start_timestamp == window.start_datetime.timestamp()
+
+    windows = list(store.iter_windows(timespan2, chan, 10, 5))
+    assert len(windows) == 11
+    assert np.array_equal(windows[2].data, data.data)
+    assert windows[2].data.base is not None
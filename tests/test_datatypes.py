@@ -1,10 +1,25 @@
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import dateutil
+import numpy as np
 import pytest
 
-from noisepy.seis.io.datatypes import ChannelType, ConfigParameters, StackMethod, Station
+from noisepy.seis.io.datatypes import (
+    AnnotatedData,
+    Channel,
+    ChannelBlock,
+    ChannelData,
+    ChannelType,
+    ConfigParameters,
+    CrossCorrelation,
+    Stack,
+    StackMethod,
+    Station,
+    unpack_ragged,
+)
 
 
 def test_channeltype():
@@ -81,3 +96,90 @@ def test_save_load_stations(tmp_path: Path):
 
     c.load_stations(os.path.join(tmp_path, "stations1.txt"))
     assert c.stations == ["new_station1", "new_station2"]
+
+
+def test_channeldata_from_array():
+    chan = Channel(ChannelType("BHZ", "00"), Station("CI", "ABC"))
+    data = np.arange(10, dtype=np.float32)
+    cd = ChannelData.from_array(data, 20.0, 1e9, chan)
+    assert cd.data is data
+    assert cd.sampling_rate == 20.0
+    assert cd.start_timestamp == 1e9
+    assert cd._stream is None
+    tr = cd.stream[0]
+    assert tr.stats.station == "ABC" and tr.stats.channel == "BHZ" and tr.stats.location == "00"
+    assert tr.stats.sampling_rate == 20.0
+    assert tr.stats.starttime.timestamp == 1e9
+    assert np.array_equal(tr.data, data)
+
+
+def test_channelblock():
+    chans = [Channel(ChannelType("XXZ"), Station("DAS", str(i).zfill(5))) for i in range(3)]
+    block = ChannelBlock(np.arange(12.0).reshape(3, 4), chans, 2.0, 10.0)
+    assert len(block) == 3
+    cds = block.channel_data()
+    assert np.array_equal(cds[1].data, [4.0, 5.0, 6.0, 7.0])
+    assert cds[2].stream[0].stats.station == "00002"
+    with pytest.raises(AssertionError):
+        ChannelBlock(np.zeros((2, 4)), chans, 2.0, 10.0)
+
+
+def test_pack():
+    stacks = [Stack("ZZ", "a", {}, np.arange(3.0)), Stack("ZR", "a", {}, np.arange(5, dtype=np.float32))]
+    data, meta = Stack.pack(stacks)
+    assert data.dtype == np.float64
+    assert np.array_equal(data, [[0, 1, 2, np.nan, np.nan], [0, 1, 2, 3, 4]], equal_nan=True)
+    assert meta == [("ZZ", "a", {}), ("ZR", "a", {})]
+
+    ccs = [
+        CrossCorrelation(ChannelType("BHZ"), ChannelType("BHZ"), {}, np.ones((r, c)))
+        for r, c in [(2, 3), (1, 4)]
+    ]
+    data, _ = CrossCorrelation.pack(ccs)
+    assert data.shape == (2, 2, 4)
+    assert np.isnan(data[0, :, 3]).all() and np.isnan(data[1, 1]).all()
+    assert np.nansum(data) == 10
+
+    with pytest.raises(ValueError):
+        Stack.pack([])
+
+
+def test_pack_ragged():
+    ccs = [
+        CrossCorrelation(ChannelType("BHZ"), ChannelType("BHN"), {}, np.random.random((r, 4))) for r in [2, 3]
+    ]
+    data, offsets, shapes, meta = CrossCorrelation.pack_ragged(ccs)
+    assert data.shape == (20,)
+    assert offsets == [0, 8, 20]
+    assert shapes == [(2, 4), (3, 4)]
+    assert meta[1][2] == "BHN"
+    for cc, array in zip(ccs, unpack_ragged(data, offsets, shapes)):
+        assert np.array_equal(cc.data, array)
+
+
+def test_lazy_data_concurrent_access():
+    calls = []
+
+    def load():
+        calls.append(1)
+        time.sleep(0.1)
+        return np.arange(5.0)
+
+    stack = Stack("ZZ", "Allstack_linear", {}, None)
+    stack.set_loader(load)
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lambda _: stack.data, range(8)))
+    # the data is loaded once and every thread gets it
+    assert len(calls) == 1
+    assert all(r is results[0] for r in results)
+    assert stack.is_loaded() and np.array_equal(stack.data, np.arange(5.0))
+
+
+def test_annotated_data_subclass_without_component():
+    class Custom(AnnotatedData):
+        def get_metadata(self):
+            return (self.parameters,)
+
+    data = Custom({}, np.zeros(3))
+    with pytest.raises(NotImplementedError):
+        data.get_component()
@@ -1,14 +1,18 @@
 import errno
+import io
+import json
+import tarfile
 from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple
 from unittest import mock
 
+import numpy as np
 import pytest
 from datetimerange import DateTimeRange
 from utils import date_range
 
 from noisepy.seis.io.hierarchicalstores import PairDirectoryCache
-from noisepy.seis.io.numpystore import NumpyArrayStore, NumpyCCStore
+from noisepy.seis.io.numpystore import FILE_ARRAY_NPY, FILE_PARAMS_JSON, NumpyArrayStore, NumpyCCStore
 from noisepy.seis.io.utils import FIND_RETRIES, io_retry
 from noisepy.seis.io.zarrstore import ZarrStoreHelper
 
@@ -96,6 +100,13 @@ zarr_paths = [
     ),
     ("some/path/CI.BAK/CI.BAK_CI.ARV/2021_07_01_00_00_00/0.0.0", None),
     ("some/path/CI.BAK/CI.BAK/2021_07_01_00_00_00/.zgroup", None),
+    ("some/path/CI.BAK/CI.ARV/2021_07_01_00_00_00T2021_07_02_00_00_00/1.0.0", None),
+    ("some/path/CI.BAK/CI.ARV/2021_07_01_00_00_00T2021_07_02_00_00_00/10.0", None),
+    (
+        "some/path/CI.BAK/CI.ARV/2021_07_01_00_00_00T2021_07_02_00_00_00/0",
+        ("CI.ARV", date_range(7, 1, 2)),
+    ),
+    ("some/path/CI.BAK/CI.ARV/2021_07_01_00_00_00T2021_07_02_00_00_00/1", None),
     ("path/non_ts/0.0.0", None),
     ("too_short/0.0.0", None),
 ]
@@ -129,3 +140,30 @@ def test_find(find_mock, tmp_path):
     with pytest.raises(Exception):
         retry_find()
     assert FIND_RETRIES + 2 == find_mock.call_count
+
+
+def test_numpy_read_attrs(tmp_path):
+    store = NumpyArrayStore(str(tmp_path), "a")
+    store.append("a/b/c", {"dist": 1.5}, np.random.random((2, 10)))
+    assert store.read_attrs("a/b/c") == {"dist": 1.5}
+    assert store.read_attrs("a/b/missing") is None
+
+    # files written before the params were stored first
+    with tarfile.open(tmp_path / "a/b/old.tar.gz", mode="w:gz") as tar:
+        for name, content in [
+            (FILE_ARRAY_NPY, b"not read"),
+            (FILE_PARAMS_JSON, json.dumps({"dist": 2.0}).encode()),
+        ]:
+            ti = tarfile.TarInfo(name=name)
+            ti.size = len(content)
+            tar.addfile(ti, fileobj=io.BytesIO(content))
+    assert store.read_attrs("a/b/old") == {"dist": 2.0}
+
+
+def test_zarr_chunks(tmp_path):
+    store = ZarrStoreHelper(str(tmp_path), "a")
+    store.append("a/b/c", {}, np.zeros((2, 48, 8001), dtype=np.float32))
+    store.append("a/b/d", {}, np.zeros((9, 8001), dtype=np.float32))
+    # 16 rows of 32 KB per chunk
+    assert store.root["a/b/c"].chunks == (1, 16, 8001)
+    assert store.root["a/b/d"].chunks == (1, 8001)
@@ -0,0 +1,83 @@
+import os
+from pathlib import Path
+
+import matplotlib
+import numpy as np
+import pytest
+from utils import date_range
+
+matplotlib.use("Agg")
+
+from noisepy.seis.io.asdfstore import ASDFStackStore
+from noisepy.seis.io.datatypes import Stack, Station
+from noisepy.seis.io.moveout import compute_moveout, compute_moveout_products, read_moveout
+from noisepy.seis.io.numpystore import NumpyStackStore
+from noisepy.seis.io.plotting_modules import plot_moveout_store
+from noisepy.seis.io.stores import StackStore
+from noisepy.seis.io.utils import bandpass_2d
+from noisepy.seis.io.zarrstore import ZarrStackStore
+
+DT = 0.05
+MAXLAG = 5.0
+NLAG = int(2 * MAXLAG / DT) + 1
+
+
+def _sta_stacks(dists):
+    sta_stacks = []
+    for i, dist in enumerate(dists):
+        params = {"dt": DT, "maxlag": MAXLAG, "dist": dist, "ngood": 3}
+        stacks = [
+            Stack("ZZ", "Allstack_linear", params, np.random.random(NLAG).astype(np.float32)),
+            Stack("ZR", "Allstack_linear", params, np.random.random(NLAG).astype(np.float32)),
+        ]
+        sta_stacks.append(((Station("nw", f"s{i}"), Station("nw", f"r{i}")), stacks))
+    return sta_stacks
+
+
+def test_compute_moveout():
+    dists = [0.2, 0.7, 1.5, 3.1, 3.9, 7.5]
+    sta_stacks = _sta_stacks(dists)
+    moveout = compute_moveout(sta_stacks, "Allstack_linear", "ZZ", 0.1, 1.0, 1.0)
+
+    # bins of 1 km (the last one is dropped): [0, 1) has 2 pairs, [1, 2) 1 and [3, 4) 2
+    assert moveout.distances.tolist() == [0.5, 1.5, 3.5]
+    assert moveout.counts.tolist() == [2, 1, 2]
+    data = bandpass_2d(np.stack([st[1][0].data for st in sta_stacks]), 0.1, 1.0, int(1 / DT))
+    assert np.allclose(moveout.data[0], data[:2].mean(axis=0), atol=1e-6)
+    assert np.allclose(moveout.data[2], data[3:5].mean(axis=0), atol=1e-6)
+    assert compute_moveout(sta_stacks, "Allstack_pws", "ZZ", 0.1, 1.0, 1.0) is None
+
+
+@pytest.mark.parametrize("store_type", [NumpyStackStore, ZarrStackStore, ASDFStackStore])
+def test_moveout_products(store_type: type, tmp_path: Path):
+    store = store_type(str(tmp_path / "stacks"))
+    ts = date_range(4, 1, 2)
+    for (src, rec), stacks in _sta_stacks([0.2, 1.5, 2.5, 3.9, 6.1]):
+        store.append(ts, src, rec, stacks)
+
+    moveouts = compute_moveout_products(
+        store, ts, ["Allstack_linear"], ["ZZ", "ZR"], [(0.1, 1.0), (0.5, 2.0)], 1.0
+    )
+    assert len(moveouts) == 4
+    # the products aren't listed as station pairs
+    assert len(store.get_station_pairs()) == 5
+
+    moveout = read_moveout(store, ts, "Allstack_linear", "ZR", 0.5, 2.0, 1.0)
+    assert np.allclose(moveout.data, moveouts[3].data)
+    assert moveout.distances.tolist() == moveouts[3].distances.tolist()
+    assert read_moveout(store, ts, "Allstack_linear", "ZZ", 0.1, 1.0, 2.0) is None
+
+    # recomputing replaces the product
+    compute_moveout_products(store, ts, ["Allstack_linear"], ["ZZ"], [(0.1, 1.0)], 1.0)
+    assert read_moveout(store, ts, "Allstack_linear", "ZZ", 0.1, 1.0, 1.0) is not None
+
+    sdir = str(tmp_path / "figs")
+    os.makedirs(sdir)
+    plot_moveout_store(store, ts, "Allstack_linear", 0.1, 1.0, "ZZ", 2.0, savefig=True, sdir=sdir)
+    assert read_moveout(store, ts, "Allstack_linear", "ZZ", 0.1, 1.0, 2.0) is not None
+    assert os.listdir(sdir) == ["moveout_stack_Allstack_linear_2.0kmbin.pdf"]
+
+
+def test_moveout_products_unsupported(tmp_path: Path):
+    with pytest.raises(NotImplementedError):
+        read_moveout(StackStore(), date_range(4, 1, 2), "Allstack_linear", "ZZ", 0.1, 1.0, 1.0)
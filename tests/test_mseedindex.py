@@ -0,0 +1,85 @@
+import os
+import shutil
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import obspy
+from datetimerange import DateTimeRange
+from test_channelcatalog import MockCatalog
+
+from noisepy.seis.io.mseedindex import INDEX_SUFFIX, MiniSeedIndex, RecordIndex
+from noisepy.seis.io.s3store import SCEDCS3DataStore
+from noisepy.seis.io.utils import get_filesystem
+
+data_dir = os.path.join(os.path.dirname(__file__), "./data/scedc/2022/2022_002/")
+file_name = "CIFOX2_LHZ___2022002.ms"
+timespan = DateTimeRange(datetime(2022, 1, 2, tzinfo=timezone.utc), datetime(2022, 1, 3, tzinfo=timezone.utc))
+
+
+def test_build():
+    with open(os.path.join(data_dir, file_name), "rb") as f:
+        index = RecordIndex.build(f)
+    stream = obspy.read(os.path.join(data_dir, file_name))
+    assert len(index) == 11
+    assert np.all(index.lengths == 512)
+    assert np.array_equal(index.offsets, np.arange(11) * 512)
+    assert index.npts.sum() == sum(tr.stats.npts for tr in stream)
+    assert index.starts[0] == stream[0].stats.starttime.timestamp
+    assert index.gaps() == []
+
+
+def test_gaps():
+    index = RecordIndex(
+        np.array([0, 512, 1024]),
+        np.array([512, 512, 512]),
+        np.array([0.0, 10.0, 30.0]),
+        np.array([10.0, 20.0, 40.0]),
+        np.array([10, 10, 10]),
+        np.array([1.0, 1.0, 1.0]),
+    )
+    assert index.gaps() == [(20.0, 30.0)]
+    assert index.byte_ranges(DateTimeRange(datetime.fromtimestamp(5), datetime.fromtimestamp(15))) == [
+        (0, 1024)
+    ]
+
+
+def test_persisted_index(tmp_path):
+    shutil.copy(os.path.join(data_dir, file_name), tmp_path)
+    path = str(tmp_path / file_name)
+    index = MiniSeedIndex(get_filesystem(str(tmp_path))).get(path)
+    assert os.path.exists(tmp_path / ("." + file_name + INDEX_SUFFIX))
+
+    # a new instance loads the persisted index
+    loaded = MiniSeedIndex(get_filesystem(str(tmp_path))).get(path)
+    assert loaded.version == index.version
+    assert np.array_equal(loaded.offsets, index.offsets)
+
+    # the index is rebuilt when the file changes
+    with open(path, "ab") as f:
+        f.write(open(os.path.join(data_dir, file_name), "rb").read()[:512])
+    assert len(MiniSeedIndex(get_filesystem(str(tmp_path))).get(path)) == 12
+
+
+def test_store_indexed_read(tmp_path):
+    chan = SCEDCS3DataStore._parse_channel(None, file_name)
+    store = SCEDCS3DataStore(data_dir, MockCatalog())
+    indexed = SCEDCS3DataStore(data_dir, MockCatalog(), use_index=True, index_dir=str(tmp_path))
+    start = timespan.start_datetime + timedelta(hours=23, minutes=10)
+    window = DateTimeRange(start, start + timedelta(minutes=10))
+
+    data = indexed.read_data(timespan, chan, window)
+    expected = store.read_data(timespan, chan, window)
+    assert data.data.shape == (600,)
+    assert np.array_equal(data.data, expected.data)
+    assert data.start_timestamp == expected.start_timestamp
+    assert len(indexed.index.read_bytes(indexed._get_filename(timespan, chan), window)) < os.path.getsize(
+        os.path.join(data_dir, file_name)
+    )
+    assert len(os.listdir(tmp_path)) == 1
+
+    windows = list(indexed.iter_windows(timespan, chan, 600))
+    expected_windows = list(store.iter_windows(timespan, chan, 600))
+    assert len(windows) == len(expected_windows)
+    for w, e in zip(windows, expected_windows):
+        assert np.array_equal(w.data, e.data)
+    assert len(indexed.get_record_index(timespan, chan)) == 11
@@ -1,13 +1,30 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
 from unittest.mock import MagicMock
 
 import matplotlib
 import numpy as np
 import pytest
+from utils import date_range
 
 matplotlib.use("Agg")
 
 from noisepy.seis.io.datatypes import Stack, Station
-from noisepy.seis.io.plotting_modules import plot_all_moveout, plot_substack_cc, plot_waveform
+from noisepy.seis.io.numpystore import NumpyStackStore
+from noisepy.seis.io.plotting_modules import (
+    _data_lag_indices,
+    _lag_indices,
+    _read_substacks,
+    plot_all_moveout,
+    plot_all_moveout_1D_1comp_store,
+    plot_all_moveout_1D_9comp_store,
+    plot_substack_all_spect_store,
+    plot_substack_all_store,
+    plot_substack_cc,
+    plot_substack_cc_spect_store,
+    plot_waveform,
+)
+from noisepy.seis.io.stores import lag_slice
 
 SRC = Station("UW", "STA1")
 REC = Station("UW", "STA2")
@@ -46,9 +63,38 @@ def _make_cc_store(ccs):
     store = MagicMock()
     store.get_station_pairs.return_value = [(SRC, REC)]
     store.read.return_value = ccs
+    store.read_metadata.return_value = ccs
+    store.read_bulk.side_effect = lambda ts, pairs, executor, components=None, lag_window=None: [
+        (
+            p,
+            [
+                _select_lags(cc, lag_window)
+                for cc in ccs
+                if components is None or cc.get_component() in components
+            ],
+        )
+        for p in pairs
+    ]
     return store
 
 
+def _select_lags(item, lag_window):
+    # read only the lag window, like the stores do
+    if lag_window is None:
+        return item
+    sl, params = lag_slice(item.parameters, lag_window)
+    if isinstance(item, Stack):
+        return Stack(item.component, item.name, params, item.data[sl])
+    selected = MagicMock()
+    selected.src, selected.rec, selected.parameters, selected.data = (
+        item.src,
+        item.rec,
+        params,
+        item.data[:, sl],
+    )
+    return selected
+
+
 def _make_raw_store(n_channels=1, npts=400, dt=0.05):
     """Return a (mock RawDataStore, mock timespan) pair."""
     data_arr = np.random.random(npts).astype(np.float32)
@@ -123,6 +169,22 @@ def test_plot_substack_cc_skips_nwin_zero():
 def test_plot_substack_cc_saves_figure(tmp_path):
     store = _make_cc_store([_make_cc(nwin=3)])
     plot_substack_cc(store, ts=MagicMock(), freqmin=0.1, freqmax=1.0, savefig=True, sdir=str(tmp_path))
+    assert os.listdir(tmp_path) == ["UW.STA1.BHZ_UW.STA2.BHZ.pdf"]
+
+
+def test_plot_substack_cc_multipage_and_thumbnails(tmp_path):
+    store = _make_cc_store([_make_cc(nwin=3), _make_cc(nwin=4)])
+    plot_substack_cc(store, MagicMock(), 0.1, 1.0, sdir=str(tmp_path / "pdf"), multipage=True)
+    assert os.listdir(tmp_path / "pdf") == ["substack_cc.pdf"]
+
+    with ProcessPoolExecutor(1) as executor:
+        plot_substack_cc(
+            store, MagicMock(), 0.1, 1.0, sdir=str(tmp_path / "png"), fmt="png", render_executor=executor
+        )
+    assert os.listdir(tmp_path / "png") == ["UW.STA1.BHZ_UW.STA2.BHZ.png"]
+
+    with pytest.raises(ValueError):
+        plot_substack_cc(store, MagicMock(), 0.1, 1.0, sdir=str(tmp_path), fmt="png", multipage=True)
 
 
 # ── plot_all_moveout ──────────────────────────────────────────────────────────
@@ -234,3 +296,149 @@ def test_plot_waveform_single_channel():
 def test_plot_waveform_three_channels_savefig(tmp_path):
     store, ts = _make_raw_store(n_channels=3)
     plot_waveform(store, ts, "nw", "sta1", 0.1, 5.0, savefig=True, sdir=str(tmp_path))
+
+
+# ── store-backed plots ────────────────────────────────────────────────────────
+
+
+def _make_stack_store(comps=["ZZ", "ZR"], nsub=4):
+    rec2 = Station("UW", "STA3")
+    pair_stacks = {}
+    for i, rec in enumerate([REC, rec2]):
+        stacks = []
+        for comp in comps:
+            stacks.append(
+                Stack(
+                    comp,
+                    "Allstack_linear",
+                    {"dt": 0.05, "maxlag": 10.0, "dist": 5.0 + i, "ngood": 10},
+                    _data(),
+                )
+            )
+            for j in range(nsub):
+                params = {"dt": 0.05, "maxlag": 10.0, "dist": 5.0 + i, "ngood": 5, "time": 1e6 + j * 3600}
+                stacks.append(Stack(comp, f"T{1e6 + j * 3600}", params, _data()))
+        pair_stacks[(SRC, rec)] = stacks
+    store = MagicMock()
+    store.get_station_pairs.return_value = list(pair_stacks.keys())
+
+    def select(stacks, components, lag_window):
+        return [
+            _select_lags(st, lag_window) for st in stacks if components is None or st.component in components
+        ]
+
+    store.read.side_effect = lambda ts, src, rec, components=None, lag_window=None: select(
+        pair_stacks[(src, rec)], components, lag_window
+    )
+    store.read_bulk.side_effect = lambda ts, pairs, executor, components=None, lag_window=None: [
+        (p, select(pair_stacks[p], components, lag_window)) for p in pairs
+    ]
+    return store
+
+
+def _data():
+    return np.random.random(401).astype(np.float32)
+
+
+def test_plot_substack_all_store(tmp_path):
+    store = _make_stack_store()
+    plot_substack_all_store(
+        store, MagicMock(), SRC, REC, 0.1, 1.0, "ZZ", disp_lag=5, savefig=True, sdir=str(tmp_path)
+    )
+    plot_substack_all_spect_store(
+        store, MagicMock(), SRC, REC, 0.1, 1.0, "ZR", savefig=True, sdir=str(tmp_path)
+    )
+    assert sorted(os.listdir(tmp_path)) == ["UW.STA1_UW.STA2_ZR.pdf", "UW.STA1_UW.STA2_ZZ_0.10_1.00Hz.pdf"]
+    with pytest.raises(ValueError):
+        plot_substack_all_store(_make_stack_store(nsub=1), MagicMock(), SRC, REC, 0.1, 1.0, "ZZ")
+
+
+def test_plot_all_moveout_1D_store(tmp_path):
+    store = _make_stack_store(comps=["ZR", "ZT", "ZZ", "RR", "RT", "RZ", "TR", "TT", "TZ"], nsub=0)
+    plot_all_moveout_1D_1comp_store(
+        store, MagicMock(), SRC, "Allstack_linear", 0.1, 1.0, "ZZ", savefig=True, sdir=str(tmp_path)
+    )
+    plot_all_moveout_1D_9comp_store(
+        store, MagicMock(), REC, "Allstack_linear", 0.1, 1.0, 10, savefig=True, sdir=str(tmp_path)
+    )
+    assert sorted(os.listdir(tmp_path)) == ["moveout_UW.STA1_1D_linear.pdf", "moveout_UW.STA2_1D_linear.pdf"]
+    # only the pairs with the station are read
+    assert store.read_bulk.call_args[0][1] == [(SRC, REC)]
+
+
+def test_plot_substack_cc_spect_store(tmp_path):
+    store = _make_cc_store([_make_cc(nwin=3)])
+    plot_substack_cc_spect_store(store, MagicMock(), 0.1, 1.0, disp_lag=2, sdir=str(tmp_path))
+    assert os.listdir(tmp_path) == ["UW.STA1.BHZ_UW.STA2.BHZ.pdf"]
+
+
+def test_plot_reads_only_displayed_lags(tmp_path):
+    store = _make_stack_store(comps=["ZZ", "ZR"])
+    plot_substack_all_store(
+        store, MagicMock(), SRC, REC, 0.1, 1.0, "ZR", disp_lag=2, savefig=True, sdir=str(tmp_path)
+    )
+    assert store.read.call_args.kwargs == {"components": ["ZR"], "lag_window": (-2, 2)}
+
+    plot_all_moveout_1D_1comp_store(
+        store,
+        MagicMock(),
+        SRC,
+        "Allstack_linear",
+        0.1,
+        1.0,
+        "ZZ",
+        disp_lag=3,
+        savefig=True,
+        sdir=str(tmp_path),
+    )
+    assert store.read_bulk.call_args[0][3:] == (["ZZ"], (-3, 3))
+
+    cc_store = _make_cc_store([_make_cc(nwin=3)])
+    plot_substack_cc_spect_store(
+        cc_store, MagicMock(), 0.1, 1.0, components=["ZZ"], disp_lag=2, sdir=str(tmp_path)
+    )
+    assert cc_store.read_bulk.call_args[0][3:] == (["ZZ"], (-2, 2))
+    plot_substack_cc(cc_store, MagicMock(), 0.1, 1.0, disp_lag=2, sdir=str(tmp_path))
+    assert cc_store.read_bulk.call_args.kwargs == {"lag_window": (-2, 2)}
+    cc_store.read.assert_not_called()
+
+    # without a display lag all the lags are read
+    plot_substack_all_store(store, MagicMock(), SRC, REC, 0.1, 1.0, "ZZ", savefig=True, sdir=str(tmp_path))
+    assert store.read.call_args.kwargs["lag_window"] is None
+
+
+def test_read_substacks_lag_window(tmp_path):
+    store = NumpyStackStore(str(tmp_path))
+    stacks = [st for st in _make_stack_store().read(None, SRC, REC) if st.component == "ZZ"]
+    ts = date_range(4, 1, 2)
+    store.append(ts, SRC, REC, stacks)
+    data, ngood, _, _, _, disp_lag = _read_substacks(store, ts, SRC, REC, "ZZ", 2.5)
+    _, indx1, indx2 = _lag_indices(2.5, 10.0, 0.05)
+    assert disp_lag == 2.5
+    assert np.array_equal(data, np.stack([st.data[indx1:indx2] for st in stacks[1:]]))
+    assert ngood.tolist() == [5, 5, 5, 5]
+
+
+def test_read_substacks_unaligned_lag(tmp_path):
+    # disp_lag / dt is not an integer: the windowed read must show the same samples as the full read
+    params = {"dt": 0.05, "maxlag": 100.0}
+    full = np.arange(4001)
+    _, indx1, indx2 = _data_lag_indices(params, 10.02)
+    assert indx2 - indx1 == 401
+    # the displayed lags are symmetric
+    assert indx1 + indx2 - 1 == len(full) - 1
+    lags, window_params = lag_slice(params, (-10.02, 10.02))
+    _, windx1, windx2 = _data_lag_indices(window_params, 10.02)
+    assert np.array_equal(full[lags][windx1:windx2], full[indx1:indx2])
+
+    store = NumpyStackStore(str(tmp_path))
+    ts = date_range(4, 1, 2)
+    stacks = [
+        Stack(
+            "ZZ", f"T{1e6 + j * 3600}", {**params, "dist": 5.0, "ngood": 5, "time": 1e6 + j * 3600}, full + j
+        )
+        for j in range(2)
+    ]
+    store.append(ts, SRC, REC, stacks)
+    data, _, _, _, _, _ = _read_substacks(store, ts, SRC, REC, "ZZ", 10.02)
+    assert np.array_equal(data, np.stack([st.data[indx1:indx2] for st in stacks]))
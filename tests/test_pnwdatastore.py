@@ -11,6 +11,7 @@ import pytest
 from datetimerange import DateTimeRange
 from utils import date_range
 
+from noisepy.seis.io.channel_filter_store import channel_filter
 from noisepy.seis.io.channelcatalog import ChannelCatalog
 from noisepy.seis.io.datatypes import Channel, ChannelType, Station
 from noisepy.seis.io.pnwstore import PNWDataStore
@@ -232,6 +233,27 @@ def test_pnw_load_channels_filters_out_rejected_channels(tmp_path):
     assert store.channels[key][0].type.name == "BHN"
 
 
+def test_pnw_load_channels_pushes_channel_filter_to_query(tmp_path):
+    full_path = "/base/UW/2020/125/"
+    rows = [
+        ("UW", "YA2", "BHN", "00", "/base/UW/2020/125/YA2.UW.2020.125"),
+        ("UW", "YA2", "bhe", "00", "/base/UW/2020/125/YA2.UW.2020.125"),
+    ]
+    queries = []
+    store = _new_pnw_store(str(tmp_path / "unused.sqlite"))
+    store._dbquery = lambda q: queries.append(q) or rows
+    store.paths = {}
+    store.channels = {}
+
+    store._load_channels(full_path, channel_filter(["*"], ["YA2"], ["BH?"]))
+
+    assert "(station LIKE 'YA2%') AND (channel LIKE 'BH_%')" in queries[0]
+    assert "network LIKE" not in queries[0]
+    # LIKE is case insensitive, the rows are still checked against the filter
+    key = next(iter(store.channels))
+    assert [c.type.name for c in store.channels[key]] == ["BHN"]
+
+
 def test_pnw_load_channels_wildcard_logs_warning(tmp_path, caplog):
     full_path = "/base/__/2020/125/"
     store = _new_pnw_store(str(tmp_path / "unused.sqlite"))
@@ -270,14 +292,12 @@ def test_pnw_get_channels_returns_catalog_channels(tmp_path):
     store = _new_pnw_store(str(tmp_path / "unused.sqlite"))
     store.channels = {str(ts): [chan]}
     store.chan_catalog = mock.Mock(spec=ChannelCatalog)
-    store.chan_catalog.get_inventory.return_value = mock.Mock()
-    store.chan_catalog.get_full_channel.return_value = chan
+    store.chan_catalog.get_full_channels.return_value = [chan]
 
     result = store.get_channels(ts)
 
     assert result == [chan]
-    store.chan_catalog.get_inventory.assert_called_once()
-    store.chan_catalog.get_full_channel.assert_called_once_with(ts, chan)
+    store.chan_catalog.get_full_channels.assert_called_once_with(ts, [chan])
 
 
 # ── get_inventory ─────────────────────────────────────────────────────────────
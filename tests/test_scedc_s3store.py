@@ -1,10 +1,12 @@
 import os
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
+import numpy as np
 import pytest
 from datetimerange import DateTimeRange
 from test_channelcatalog import MockCatalog
 
+from noisepy.seis.io.channel_filter_store import channel_filter
 from noisepy.seis.io.s3store import SCEDCS3DataStore
 
 timespan1 = DateTimeRange(
@@ -65,3 +67,33 @@ def test_timespan_channels(store: SCEDCS3DataStore):
     assert len(channels) == len(read_channels)
     channels = store.get_channels(timespan2)
     assert len(channels) == 0
+
+
+def test_load_channels_channel_filter():
+    path = os.path.join(os.path.dirname(__file__), "./data/scedc/2022/2022_002/")
+    store = SCEDCS3DataStore(path, MockCatalog(), channel_filter(["CI"], ["*"], ["LHZ"]))
+    channels = store.get_channels(timespan1)
+    assert sorted(str(c) for c in channels) == sorted(str(c) for c in read_channels[1:])
+
+
+def test_read_data_window():
+    path = os.path.join(os.path.dirname(__file__), "./data/scedc/2022/2022_002/")
+    store = SCEDCS3DataStore(path, MockCatalog())
+    chan = read_channels[1]
+    # the test file has data from 22:55:07 to 23:59:59
+    full = store.read_data(timespan1, chan)
+    start = timespan1.start_datetime + timedelta(hours=23, minutes=10)
+    window = DateTimeRange(start, start + timedelta(minutes=10))
+    offset = int(np.ceil(start.timestamp() - full.start_timestamp))
+
+    data = store.read_data(timespan1, chan, window)
+    assert data.data.shape == (600,)
+    assert np.array_equal(data.data, full.data[offset : offset + 600])
+
+    windows = list(store.iter_windows(timespan1, chan, 600))
+    assert len(windows) == 7
+    assert len(windows[0].data) == 293
+    assert np.array_equal(windows[2].data, data.data)
+    assert windows[2].start_timestamp == data.start_timestamp
+    before = DateTimeRange(timespan1.start_datetime, timespan1.start_datetime + timedelta(hours=22))
+    assert len(store.read_data(timespan1, chan, before).data) == 0
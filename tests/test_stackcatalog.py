@@ -0,0 +1,46 @@
+from pathlib import Path
+
+import numpy as np
+from utils import date_range
+
+from noisepy.seis.io.datatypes import Stack, Station
+from noisepy.seis.io.numpystore import NumpyStackStore
+from noisepy.seis.io.stackcatalog import CatalogStackStore, StackCatalog
+
+
+def _stacks(dist: float, azi: float):
+    params = {"dist": dist, "azi": azi, "baz": (azi + 180) % 360, "ngood": [2, 3], "latS": 1.0}
+    return [
+        Stack("ZZ", "Allstack_linear", params, np.random.random(10)),
+        Stack("ZR", "Allstack_linear", params, np.random.random(10)),
+    ]
+
+
+def test_catalog_store(tmp_path: Path):
+    catalog = StackCatalog(str(tmp_path / "catalog.db"))
+    store = CatalogStackStore(NumpyStackStore(str(tmp_path / "stacks")), catalog)
+    ts1 = date_range(4, 1, 2)
+    ts2 = date_range(4, 2, 3)
+    for i, (dist, azi) in enumerate([(5.0, 10.0), (20.0, 355.0), (45.0, 90.0), (80.0, 180.0)]):
+        store.append(ts1, Station("nw", f"s{i}"), Station("nw", "r"), _stacks(dist, azi))
+    store.append(ts2, Station("nw", "s1"), Station("nw", "r"), _stacks(20.0, 355.0))
+
+    entries = store.query(components=["ZZ"], dist_range=(10, 50))
+    assert [(str(e.src), e.timespan) for e in entries] == [("nw.s1", ts1), ("nw.s1", ts2), ("nw.s2", ts1)]
+    assert entries[0].ngood == 5 and entries[0].latS == 1.0 and entries[0].lonS is None
+
+    assert [str(e.src) for e in store.query(components=["ZR"], azi_range=(350, 20), timespan=ts1)] == [
+        "nw.s0",
+        "nw.s1",
+    ]
+    assert len(store.query(src=Station("nw", "s3"))) == 2
+    assert len(store.query(names=["Allstack_pws"])) == 0
+
+    # appending again replaces the rows
+    store.append(ts1, Station("nw", "s0"), Station("nw", "r"), _stacks(5.0, 10.0))
+    assert len(catalog.query()) == 10
+
+    # a catalog can be built from the stacks already in a store
+    new_catalog = StackCatalog(str(tmp_path / "new_catalog.db"))
+    new_catalog.index(store)
+    assert new_catalog.query() == catalog.query()
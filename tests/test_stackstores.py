@@ -1,4 +1,6 @@
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
+from unittest import mock
 
 import numpy as np
 import pytest
@@ -6,8 +8,9 @@ from utils import date_range
 
 from noisepy.seis.io.asdfstore import ASDFStackStore
 from noisepy.seis.io.datatypes import Stack, Station
+from noisepy.seis.io.hierarchicalstores import LAYOUT_ATTR
 from noisepy.seis.io.numpystore import NumpyStackStore
-from noisepy.seis.io.stores import StackStore, convert_stackstore
+from noisepy.seis.io.stores import LAG_WINDOW_PARAM, StackStore, convert_stackstore, timespan_str
 from noisepy.seis.io.zarrstore import ZarrStackStore
 
 
@@ -57,6 +60,36 @@ def _stackstore_test_helper(store: StackStore):
     assert sta_stacks[0][0] == (src, rec)
     assert len(sta_stacks[0][1]) == len(stacks)
 
+    meta_stacks = store.read_metadata(ts, src, rec)
+    assert [(s.name, s.component, s.parameters) for s in meta_stacks] == [
+        (s.name, s.component, s.parameters) for s in read_stacks
+    ]
+    assert all(s.data.size == 0 for s in meta_stacks)
+    assert store.read_metadata_bulk(ts, [(src, rec)])[0][1][1].parameters == stack2.parameters
+
+
+def _selective_read_test_helper(store: StackStore):
+    src = Station("nw", "sta1")
+    rec = Station("nw", "sta2")
+    ts = date_range(4, 1, 2)
+    params = {"dt": 0.5, "maxlag": 10, "dist": 3.0}
+    stacks = [Stack(comp, "Allstack_linear", params, np.random.random(41)) for comp in ["ZZ", "ZR", "RR"]]
+    store.append(ts, src, rec, stacks)
+
+    read_stacks = store.read(ts, src, rec, components=["RR", "ZZ"])
+    assert sorted(s.component for s in read_stacks) == ["RR", "ZZ"]
+    assert all(np.array_equal(s.data, stacks[0].data) for s in read_stacks if s.component == "ZZ")
+
+    # lags from -2.2 s to 3 s -> samples of -2, -1.5, ..., 3 s
+    read_stacks = store.read(ts, src, rec, components=["ZR"], lag_window=(-2.2, 3))
+    assert len(read_stacks) == 1
+    assert np.array_equal(read_stacks[0].data, stacks[1].data[16:27])
+    assert read_stacks[0].parameters[LAG_WINDOW_PARAM] == [-2.0, 3.0]
+    assert read_stacks[0].parameters["dist"] == 3.0
+
+    sta_stacks = store.read_bulk(ts, [(src, rec)], lag_window=(-100, 0))
+    assert [s.data.size for s in sta_stacks[0][1]] == [21, 21, 21]
+
 
 def test_asdfstore(asdfstore: ASDFStackStore):
     _stackstore_test_helper(asdfstore)
@@ -86,3 +119,143 @@ def test_convert_stackstore(tmp_path: Path):
     assert len(result) == 1
     assert result[0].component == stacks[0].component
     assert np.all(result[0].data == stacks[0].data)
+
+
+@pytest.mark.parametrize("store_type", [ASDFStackStore, ZarrStackStore, NumpyStackStore])
+def test_selective_read(store_type: type, tmp_path: Path):
+    _selective_read_test_helper(store_type(str(tmp_path)))
+
+
+@pytest.mark.parametrize("store_type", [ASDFStackStore, ZarrStackStore, NumpyStackStore])
+def test_lazy_read(store_type: type, tmp_path: Path):
+    store = store_type(str(tmp_path))
+    ts = date_range(4, 1, 2)
+    pairs = [(Station("nw", "sta1"), Station("nw", f"rec{i}")) for i in range(3)]
+    data = {}
+    for pair in pairs:
+        stacks = [
+            Stack(comp, "Allstack_linear", {"dist": 1.0}, np.random.random(10 + i))
+            for i, comp in enumerate("ZNE")
+        ]
+        store.append(ts, pair[0], pair[1], stacks)
+        data[pair] = stacks
+
+    # the stores may return the components in a different order
+    lazy = sorted(store.read_lazy(ts, *pairs[0]), key=lambda s: s.component)
+    expected = sorted(data[pairs[0]], key=lambda s: s.component)
+    assert [s.component for s in lazy] == ["E", "N", "Z"]
+    assert not any(s.is_loaded() for s in lazy)
+    assert lazy[0].parameters == {"dist": 1.0}
+    assert np.array_equal(lazy[1].data, expected[1].data)
+    assert lazy[1].is_loaded() and not lazy[2].is_loaded()
+
+    items = [s for pair in pairs[1:] for s in store.read_lazy(ts, *pair)]
+    assert store.materialize(items) is items
+    assert all(s.is_loaded() for s in items)
+    expected = [s for pair in pairs[1:] for s in sorted(data[pair], key=lambda s: s.component)]
+    items = sorted(items[:3], key=lambda s: s.component) + sorted(items[3:], key=lambda s: s.component)
+    assert all(np.array_equal(s.data, e.data) for s, e in zip(items, expected))
+
+
+def test_lazy_read_mmap(asdfstore: ASDFStackStore):
+    ts = date_range(4, 1, 2)
+    src, rec = Station("nw", "sta1"), Station("nw", "sta2")
+    stack = Stack("ZZ", "Allstack_linear", {}, np.random.random(10))
+    asdfstore.append(ts, src, rec, [stack])
+    lazy = asdfstore.read_lazy(ts, src, rec, mmap=True)
+    assert isinstance(lazy[0].data, np.memmap)
+    assert np.array_equal(lazy[0].data, stack.data)
+
+
+def test_lazy_read_append_and_materialize(asdfstore: ASDFStackStore):
+    ts = date_range(4, 1, 2)
+    src, rec = Station("nw", "sta1"), Station("nw", "sta2")
+    stacks = [Stack(c, "Allstack_linear", {}, np.random.random(10)) for c in ["ZZ", "ZR"]]
+    asdfstore.append(ts, src, rec, stacks[:1])
+    lazy = asdfstore.read_lazy(ts, src, rec)
+    # the file is written again by the same store before the lazy data is loaded
+    asdfstore.append(ts, src, rec, stacks[1:])
+    asdfstore.materialize(lazy)
+    assert np.array_equal(lazy[0].data, stacks[0].data)
+
+    # loads wait for the writes of the file to finish
+    lazy = sorted(asdfstore.read_lazy(ts, src, rec), key=lambda s: s.component)
+    lock = asdfstore.datasets.file_lock(lazy[0].get_loader().filename)
+    with ThreadPoolExecutor() as executor:
+        with lock:
+            future = executor.submit(asdfstore.materialize, lazy)
+            assert not wait([future], timeout=0.2).done
+        future.result(timeout=30)
+    assert [s.data.tolist() for s in lazy] == [s.data.tolist() for s in stacks[::-1]]
+
+
+def test_product_writes_and_reads_locked(asdfstore: ASDFStackStore):
+    ts = date_range(4, 1, 2)
+    data = np.random.random((2, 10))
+    asdfstore.append_product("moveout", ts, {"dt": 0.05}, data)
+    lock = asdfstore.datasets.file_lock(asdfstore._get_product_file(ts))
+    with ThreadPoolExecutor() as executor:
+        with lock:
+            write = executor.submit(asdfstore.append_product, "moveout", ts, {"dt": 0.1}, data * 2)
+            read = executor.submit(asdfstore.read_product, "moveout", ts)
+            assert not wait([write, read], timeout=0.2).done
+        write.result(timeout=30)
+        read.result(timeout=30)
+    product, params = asdfstore.read_product("moveout", ts)
+    assert np.array_equal(product, data * 2) and params["dt"] == 0.1
+
+
+def test_materialize_reads_each_file_once(numpystore: NumpyStackStore):
+    ts = date_range(4, 1, 2)
+    pairs = [(Station("nw", "sta1"), Station("nw", f"rec{i}")) for i in range(2)]
+    for pair in pairs:
+        numpystore.append(
+            ts, *pair, [Stack(c, "Allstack_linear", {}, np.random.random(10)) for c in ["ZZ", "ZR"]]
+        )
+    items = [s for pair in pairs for s in numpystore.read_lazy(ts, *pair)]
+    with mock.patch.object(numpystore.helper, "read_items", wraps=numpystore.helper.read_items) as read_items:
+        numpystore.materialize(items)
+    assert read_items.call_count == 2
+
+
+def test_lazy_read_reads_archive_once(tmp_path: Path):
+    numpystore = NumpyStackStore(str(tmp_path / "numpy"))
+    zarrstore = ZarrStackStore(str(tmp_path / "zarr"))
+    ts = date_range(4, 1, 2)
+    src, rec = Station("nw", "sta1"), Station("nw", "sta2")
+    stacks = [Stack(c, "Allstack_linear", {}, np.random.random(10)) for c in ["ZZ", "ZR", "RR"]]
+    numpystore.append(ts, src, rec, stacks)
+    lazy = numpystore.read_lazy(ts, src, rec)
+    # the tar.gz files can only be read whole, so the first access loads all the items
+    with mock.patch.object(numpystore.helper, "read", wraps=numpystore.helper.read) as read:
+        assert [s.data.tolist() for s in lazy] == [s.data.tolist() for s in stacks]
+    assert read.call_count == 1
+
+    zarrstore.append(ts, src, rec, stacks)
+    lazy = zarrstore.read_lazy(ts, src, rec)
+    assert np.array_equal(lazy[1].data, stacks[1].data)
+    assert not lazy[0].is_loaded() and not lazy[2].is_loaded()
+
+
+@pytest.mark.parametrize("store_type", [ZarrStackStore, NumpyStackStore])
+def test_ragged_layout(store_type: type, tmp_path: Path):
+    store = store_type(str(tmp_path), ragged=True)
+    _stackstore_test_helper(store)
+    # stacks of different lengths are read back without padding
+    ts = date_range(4, 2, 3)
+    src, rec = Station("nw", "sta1"), Station("nw", "sta2")
+    stacks = [
+        Stack("ZZ", "Allstack_linear", {}, np.arange(4.0)),
+        Stack("ZR", "Allstack_linear", {}, np.arange(9.0)),
+    ]
+    store.append(ts, src, rec, stacks)
+    attrs = store.helper.read_attrs(f"{src}/{rec}/{timespan_str(ts)}")
+    assert attrs[LAYOUT_ATTR] == {"offsets": [0, 4, 13], "shapes": [[4], [9]]}
+    assert [s.data.tolist() for s in store.read(ts, src, rec, components=["ZR"])] == [list(range(9))]
+    assert [s.data.size for s in store.materialize(store.read_lazy(ts, src, rec))] == [4, 9]
+
+    # stores in both layouts can read each other's data
+    assert len(store_type(str(tmp_path)).read(ts, src, rec)) == 2
+    _selective_read_test_helper(store_type(str(tmp_path / "padded")))
+    assert len(store_type(str(tmp_path / "padded"), ragged=True).read(date_range(4, 1, 2), src, rec)) == 3
+    _selective_read_test_helper(store_type(str(tmp_path / "ragged"), ragged=True))
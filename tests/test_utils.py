@@ -1,12 +1,30 @@
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 
 import numpy as np
 import pytest
+from datetimerange import DateTimeRange
 from fsspec.implementations.http import HTTPFileSystem
 from fsspec.implementations.local import LocalFileSystem
+from obspy.signal.filter import bandpass
 from s3fs import S3FileSystem
 
-from noisepy.seis.io.utils import error_if, fs_join, get_filesystem, get_fs_sep, remove_nan_rows, unstack
+from noisepy.seis.io.utils import (
+    ByteLRUCache,
+    RateLimiter,
+    bandpass_2d,
+    error_if,
+    fs_join,
+    get_filesystem,
+    get_fs_sep,
+    iter_timespans,
+    normalize_rows,
+    remove_nan_rows,
+    timespan_epochs,
+    unstack,
+)
 
 SEP = os.path.sep
 paths = [
@@ -62,3 +80,72 @@ def test_error_if():
 
     with pytest.raises(ValueError, match="bad value"):
         error_if(True, "bad value", ValueError)
+
+
+def test_byte_lru_cache():
+    cache = ByteLRUCache(10)
+    cache.put("a", 1, 4)
+    cache.put("b", 2, 4)
+    assert cache.get("a") == 1  # "a" is now the most recently used
+    cache.put("c", 3, 4)
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.nbytes == 8
+
+    cache.put("big", 4, 11)
+    assert "big" not in cache
+    cache.put("a", 5, 2)
+    assert cache.get("a") == 5
+    assert cache.nbytes == 6
+    cache.clear()
+    assert len(cache) == 0 and cache.nbytes == 0
+
+
+def test_rate_limiter():
+    limiter = RateLimiter(rate=50.0, burst=2)
+    start = time.monotonic()
+    with ThreadPoolExecutor(4) as exec:
+        list(exec.map(lambda _: limiter.acquire(), range(12)))
+    # 2 tokens available immediately, the remaining 10 at 50/sec
+    assert time.monotonic() - start >= 10 / 50.0 * 0.9
+
+    with pytest.raises(ValueError):
+        RateLimiter(rate=0)
+
+
+def test_iter_timespans():
+    start = datetime(2021, 1, 1, tzinfo=timezone.utc)
+    dr = DateTimeRange(start, start + timedelta(minutes=95))
+    spans = iter_timespans(dr, timedelta(minutes=30))
+    assert not isinstance(spans, list)
+    spans = list(spans)
+    assert len(spans) == 3
+    assert spans[0] == DateTimeRange(start, start + timedelta(minutes=30))
+    assert spans[-1].end_datetime == start + timedelta(minutes=90)
+
+    epochs = timespan_epochs(dr, timedelta(minutes=30))
+    assert epochs.dtype == np.int64
+    assert epochs.shape == (3, 2)
+    assert epochs.tolist() == [
+        [int(s.start_datetime.timestamp() * 1e6), int(s.end_datetime.timestamp() * 1e6)] for s in spans
+    ]
+    with pytest.raises(ValueError):
+        list(iter_timespans(dr, timedelta(0)))
+
+
+@pytest.mark.parametrize("freqmax", [2.0, 10.0])
+def test_bandpass_2d(freqmax: float):
+    data = np.random.random((5, 401))
+    filtered = bandpass_2d(data, 0.1, freqmax, 20)
+    expected = np.stack([bandpass(d, 0.1, freqmax, 20, corners=4, zerophase=True) for d in data])
+    assert filtered.shape == data.shape
+    assert np.allclose(filtered, expected)
+    assert np.allclose(bandpass_2d(data.T, 0.1, freqmax, 20, axis=0), expected.T)
+
+
+def test_normalize_rows():
+    data = np.array([[1.0, -4.0, 2.0], [0.0, 0.0, 0.0], [1.0, 2.0, -1.0]])
+    assert np.allclose(normalize_rows(data.copy()), [[0.25, -1.0, 0.5], [0, 0, 0], [0.5, 1.0, -0.5]])
+    assert np.allclose(
+        normalize_rows(data.copy(), absolute=False), [[0.5, -2.0, 1.0], [0, 0, 0], [0.5, 1.0, -0.5]]
+    )